@@ -0,0 +1,218 @@
+"""Benchmarks pyreutil on synthetic corpora.
+
+    python -m benchmarks [--scale 0.1] [--only textutil] [--output results.json]
+    python -m benchmarks --compare baseline.json [--threshold 0.25]
+
+Each benchmark runs in its own process so its peak RSS can be measured, and
+reports the best of --repeat runs with files/s and MB/s. Results are saved as
+JSON, and comparing against a saved run exits with status 1 if a benchmark got
+slower by more than the threshold."""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import NEEDLE, generate
+from pyreutil import FilenameUtil, ReUtil, TextUtil
+from pyreutil import cli
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class Benchmark(NamedTuple):
+    corpus : str
+    # Called with the corpus directory, returns the operation to time.
+    setup : Callable[[str], Callable[[], None]]
+    # Whether the operation changes the corpus, which is then copied for each run.
+    mutates : bool = False
+
+def _huge_text(root : str) -> str:
+    texts = []
+    for name in sorted(os.listdir(root)):
+        with open(os.path.join(root, name)) as f:
+            texts.append(f.read())
+    return ''.join(texts)
+
+def _reutil(method : str, *args, **kwargs) -> Callable[[str], Callable[[], None]]:
+    def setup(root):
+        util, text = ReUtil(), _huge_text(root)
+        return lambda: getattr(util, method)(*args[:1], text, *args[1:], **kwargs)
+    return setup
+
+def _textutil(method : str, *args, save : bool = False, util_options : dict = {}, **kwargs) -> Callable[[str], Callable[[], None]]:
+    def setup(root):
+        def run():
+            util = TextUtil(filenames=root, verbose=False, search_subdirs=True, **util_options)
+            getattr(util, method)(*args, **kwargs)
+            if save:
+                util.save_changes(mode='inplace')
+            elif util.stream:
+                for _ in util.iter_text():
+                    pass
+        return run
+    return setup
+
+def _filenameutil(method : str, *args, **kwargs) -> Callable[[str], Callable[[], None]]:
+    def setup(root):
+        def run():
+            getattr(FilenameUtil(path=root, verbose=False, search_subdirs=True), method)(*args, **kwargs)
+        return run
+    return setup
+
+def _cli(*argv : str) -> Callable[[str], Callable[[], None]]:
+    def setup(root):
+        def run():
+            sys.argv = ['pyreutil', '-t', root, '-d', '-si', *argv]
+            with contextlib.redirect_stdout(io.StringIO()):
+                try:
+                    cli.main()
+                except SystemExit as e:
+                    # main always exits, only a failed run is an error.
+                    if e.code:
+                        raise
+        return run
+    return setup
+
+BENCHMARKS : Dict[str, Benchmark] = {
+    'reutil.search': Benchmark('huge', _reutil('search', NEEDLE)),
+    'reutil.search_and_replace.literal': Benchmark('huge', _reutil('search_and_replace', NEEDLE, replace='pin')),
+    'reutil.search_and_replace.regex': Benchmark('huge', _reutil('search_and_replace', r"(\w+)-(\d+)", replace=r"\2-\1")),
+    'reutil.remove_extra_whitespaces': Benchmark('huge', lambda root: (lambda util, text: lambda: util.remove_extra_whitespaces(text))(ReUtil(), _huge_text(root))),
+    'textutil.search.dense': Benchmark('tiny_dense', _textutil('search', NEEDLE)),
+    'textutil.search.sparse': Benchmark('tiny_sparse', _textutil('search', NEEDLE)),
+    'textutil.search.deep_tree': Benchmark('deep_tree', _textutil('search', r"\bfoo_\w+")),
+    'textutil.search_and_replace.save': Benchmark('tiny_dense', _textutil('search_and_replace', r"(\w+)-(\d+)", replace=r"\2-\1", save=True), mutates=True),
+    'textutil.remove.stream': Benchmark('tiny_sparse', _textutil('remove', NEEDLE, util_options={'stream': True})),
+    'textutil.append': Benchmark('tiny_sparse', _textutil('append', "appended line")),
+    'textutil.remove_extra_whitespaces': Benchmark('tiny_dense', _textutil('remove_extra_whitespaces')),
+    'textutil.search_and_replace.chunked': Benchmark('huge', _textutil('search_and_replace', NEEDLE, replace='pin', save=True, util_options={'chunk_size': 1 << 20}), mutates=True),
+    'filenameutil.search': Benchmark('long_filenames', _filenameutil('search', NEEDLE)),
+    'filenameutil.search_and_replace': Benchmark('long_filenames', _filenameutil('search_and_replace', r"-(\w)", lambda_func="x.group(1).upper()")),
+    'filenameutil.append': Benchmark('long_filenames', _filenameutil('append', "_v2")),
+    'cli.search': Benchmark('tiny_dense', _cli('-s', NEEDLE)),
+    'cli.search_and_replace.inplace': Benchmark('tiny_dense', _cli('-s', NEEDLE, '-r', 'pin', '-w', '-i'), mutates=True),
+}
+
+def peak_rss() -> Optional[int]:
+    """Returns the peak resident set size of this process in bytes."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def run_child(name : str, corpus : str, repeat : int) -> dict:
+    """Times a benchmark in this process, returning its best wall and CPU times."""
+    benchmark = BENCHMARKS[name]
+    best_wall = best_cpu = float('inf')
+    for i in range(repeat):
+        root = corpus
+        if benchmark.mutates:
+            root = os.path.join(tempfile.mkdtemp(prefix='pyreutil-bench-'), 'corpus')
+            shutil.copytree(corpus, root)
+        try:
+            operation = benchmark.setup(root)
+            wall, cpu = time.perf_counter(), time.process_time()
+            operation()
+            best_wall = min(best_wall, time.perf_counter() - wall)
+            best_cpu = min(best_cpu, time.process_time() - cpu)
+        finally:
+            if benchmark.mutates:
+                shutil.rmtree(os.path.dirname(root))
+    return {'seconds': best_wall, 'cpu_seconds': best_cpu, 'peak_rss': peak_rss()}
+
+def run(names : List[str], scale : float, repeat : int, workdir : str) -> dict:
+    """Generates the corpora and runs each benchmark in a child process."""
+    corpora = {}
+    results = {}
+    for name in names:
+        benchmark = BENCHMARKS[name]
+        if benchmark.corpus not in corpora:
+            corpora[benchmark.corpus] = generate(benchmark.corpus, os.path.join(workdir, benchmark.corpus), scale=scale)
+        stats = corpora[benchmark.corpus]
+        child = subprocess.run([sys.executable, '-m', 'benchmarks', '--child', name, '--corpus', os.path.join(workdir, benchmark.corpus), '--repeat', str(repeat)],
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, text=True)
+        if child.returncode != 0:
+            print("{:<40} FAILED\n{}".format(name, child.stderr))
+            continue
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        # FilenameUtil benchmarks only touch names, so bytes are not counted for them.
+        if stats['bytes']:
+            result['mb_per_second'] = stats['bytes'] / 2**20 / result['seconds']
+        result['files_per_second'] = stats['files'] / result['seconds']
+        result.update(corpus=benchmark.corpus, **stats)
+        results[name] = result
+        print("{:<40} {:>9.4f}s {:>12.0f} files/s {:>10} MB/s {:>8} MB peak".format(
+            name, result['seconds'], result['files_per_second'],
+            "{:.1f}".format(result['mb_per_second']) if 'mb_per_second' in result else '-',
+            "{:.0f}".format(result['peak_rss'] / 2**20) if result['peak_rss'] else '-'))
+    return results
+
+def compare(results : dict, baseline : dict, threshold : float) -> List[str]:
+    """Returns the benchmarks that are slower than the baseline by more than the
+    threshold (a fraction of the baseline time)."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['seconds'] / baseline[name]['seconds']
+        if ratio > 1 + threshold:
+            regressions.append(name)
+        print("{:<40} {:>+7.1%}{}".format(name, ratio - 1, "  REGRESSION" if ratio > 1 + threshold else ""))
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks pyreutil on synthetic corpora.")
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against', type=str, required=False)
+    parser.add_argument('--keep', help='directory to generate the corpora in and keep them', type=str, required=False)
+    parser.add_argument('--only', help='regex of the benchmark names to run', type=str, required=False)
+    parser.add_argument('--output', help='file to save the JSON results to', type=str, required=False)
+    parser.add_argument('--repeat', help='number of runs of each benchmark (the best is reported)', type=int, default=3, required=False)
+    parser.add_argument('--scale', help='size of the corpora relative to the default', type=float, default=1.0, required=False)
+    parser.add_argument('--threshold', help='slowdown (as a fraction) that counts as a regression with --compare', type=float, default=0.25, required=False)
+    parser.add_argument('--child', help=argparse.SUPPRESS, type=str, required=False)
+    parser.add_argument('--corpus', help=argparse.SUPPRESS, type=str, required=False)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.corpus, args.repeat)))
+        return
+
+    names = [name for name in BENCHMARKS if not args.only or re.search(args.only, name)]
+    workdir = args.keep or tempfile.mkdtemp(prefix='pyreutil-bench-')
+    try:
+        results = run(names, args.scale, args.repeat, workdir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir)
+    document = {
+        'meta': {'python': platform.python_version(), 'platform': platform.platform(), 'scale': args.scale, 'repeat': args.repeat, 'time': time.time()},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['meta']['scale'] != args.scale:
+            print("Warning: The baseline was run with --scale {}.".format(baseline['meta']['scale']))
+        if compare(results, baseline['results'], args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
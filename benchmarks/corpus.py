@@ -0,0 +1,87 @@
+import os
+import random
+
+from typing import Callable, Dict
+
+# Words the synthetic text is made of, and the word the benchmarks search for.
+WORDS = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do',
+         'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua', 'foo_bar']
+NEEDLE = 'needle-42'
+
+def make_text(rng : random.Random, size : int, density : float) -> str:
+    """Returns about `size` characters of text, where `density` is the fraction
+    of lines containing NEEDLE."""
+    lines = []
+    length = 0
+    while length < size:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(4, 14))]
+        if rng.random() < density:
+            words.insert(rng.randrange(len(words)), NEEDLE)
+        line = ' '.join(words) + '.  \n'
+        lines.append(line)
+        length += len(line)
+    return ''.join(lines)
+
+def _write(path : str, text : str = '') -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+    return len(text)
+
+def tiny_dense(root : str, rng : random.Random, scale : float) -> Dict[str, int]:
+    """Many small files, most of which match."""
+    count = int(2000 * scale)
+    size = sum(_write(os.path.join(root, "d{:02}".format(i % 20), "file{:05}.txt".format(i)), make_text(rng, 400, 0.5)) for i in range(count))
+    return {'files': count, 'bytes': size}
+
+def tiny_sparse(root : str, rng : random.Random, scale : float) -> Dict[str, int]:
+    """Many small files, few of which match."""
+    count = int(2000 * scale)
+    size = sum(_write(os.path.join(root, "d{:02}".format(i % 20), "file{:05}.txt".format(i)), make_text(rng, 400, 0.002)) for i in range(count))
+    return {'files': count, 'bytes': size}
+
+def huge(root : str, rng : random.Random, scale : float) -> Dict[str, int]:
+    """A few large files with scattered matches."""
+    size = 0
+    for i in range(2):
+        size += _write(os.path.join(root, "huge{}.log".format(i)), make_text(rng, int(8 * 2**20 * scale), 0.05))
+    return {'files': 2, 'bytes': size}
+
+def deep_tree(root : str, rng : random.Random, scale : float) -> Dict[str, int]:
+    """A deep, branching directory tree with a few files per directory."""
+    files = size = 0
+    depth = 7 if scale >= 1 else 5
+    def build(directory, level):
+        nonlocal files, size
+        for i in range(3):
+            size += _write(os.path.join(directory, "f{}.md".format(i)), make_text(rng, 200, 0.1))
+            files += 1
+        if level < depth:
+            for name in ('a', 'b'):
+                build(os.path.join(directory, name), level + 1)
+    build(root, 0)
+    return {'files': files, 'bytes': size}
+
+def long_filenames(root : str, rng : random.Random, scale : float) -> Dict[str, int]:
+    """Empty files with long names, for FilenameUtil."""
+    count = int(1000 * scale)
+    for i in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(10, 25))]
+        if i % 3 == 0:
+            words.append(NEEDLE)
+        _write(os.path.join(root, "{:05}-{}.txt".format(i, '-'.join(words))[:240]))
+    return {'files': count, 'bytes': 0}
+
+CORPORA : Dict[str, Callable[[str, random.Random, float], Dict[str, int]]] = {
+    'tiny_dense': tiny_dense,
+    'tiny_sparse': tiny_sparse,
+    'huge': huge,
+    'deep_tree': deep_tree,
+    'long_filenames': long_filenames,
+}
+
+def generate(name : str, root : str, scale : float = 1.0, seed : int = 0) -> Dict[str, int]:
+    """Writes a corpus to root, returning its number of files and bytes. The
+    same name, scale and seed always give the same files."""
+    os.makedirs(root, exist_ok=True)
+    return CORPORA[name](root, random.Random("{}:{}".format(name, seed)), scale)
@@ -1 +1,2 @@
-from .pyreutil import *
\ No newline at end of file
+from .pyreutil import *
+from .plan import OperationPlan
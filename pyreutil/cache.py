@@ -0,0 +1,131 @@
+import codecs
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from typing import List, Optional, Tuple
+
+# Bumped whenever the meaning of cached results changes.
+CACHE_VERSION = 2
+
+def default_cache_path() -> str:
+    """Returns the result cache location in the user's cache directory."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pyreutil', 'results.sqlite3')
+
+class ResultCache:
+    """On-disk cache of per-file search results, keyed by the file's path, size
+    and modification time together with the pattern searched for and the
+    encoding files are read with (a file with a byte order mark is read in
+    its own encoding, which only changes with its contents). With
+    verify_hash, a file whose mtime changed but whose contents (by SHA-1) did
+    not is still a hit. The least recently used entries beyond max_entries are
+    evicted."""
+
+    def __init__(self, path : str = None, max_entries : int = 200000, verify_hash : bool = False):
+        self.path : str = path or default_cache_path()
+        self.max_entries : int = max_entries
+        self.verify_hash : bool = verify_hash
+        self.hits : int = 0
+        self.misses : int = 0
+        self._conn : Optional[sqlite3.Connection] = None
+        self._touched : List[Tuple[float, str, str]] = []
+        self._puts : int = 0
+
+    def __getstate__(self) -> dict:
+        # Sent to worker processes without the connection, which reopen it.
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_touched'] = []
+        return state
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=OFF")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS results (
+                path TEXT, key TEXT, size INTEGER, mtime INTEGER, hash TEXT,
+                count INTEGER, spans TEXT, used REAL, PRIMARY KEY (path, key))""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+        return self._conn
+
+    def key(self, regex : str, flags : int = 0, encoding : str = None) -> str:
+        encoding = codecs.lookup(encoding).name if encoding else ''
+        return "{}:{}:{}:{}".format(CACHE_VERSION, encoding, flags, regex)
+
+    def get(self, filepath : str, regex : str, flags : int = 0, encoding : str = None) -> Optional[Tuple[int, List[Tuple[int, int]]]]:
+        """Returns the cached (count, spans) of a file, or None if the file has
+        changed since it was cached or was never searched for the pattern in
+        the encoding."""
+        path = os.path.abspath(filepath)
+        key = self.key(regex, flags, encoding)
+        row = self.conn.execute("SELECT size, mtime, hash, count, spans FROM results WHERE path = ? AND key = ?", (path, key)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        size, mtime, digest, count, spans = row
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+        if st.st_size != size or (st.st_mtime_ns != mtime and not (self.verify_hash and digest == file_hash(filepath))):
+            self.misses += 1
+            return None
+        if st.st_mtime_ns != mtime:
+            self.conn.execute("UPDATE results SET mtime = ? WHERE path = ? AND key = ?", (st.st_mtime_ns, path, key))
+        self.hits += 1
+        self._touched.append((time.time(), path, key))
+        if len(self._touched) >= 1000:
+            self.flush()
+        return count, [tuple(span) for span in json.loads(spans)]
+
+    def put(self, filepath : str, st : os.stat_result, regex : str, spans : List[Tuple[int, int]], flags : int = 0, encoding : str = None) -> None:
+        """Stores the matches of a file as of the given stat result (taken
+        before the file was read, so a concurrent change is never hidden)."""
+        digest = file_hash(filepath) if self.verify_hash else None
+        self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                          (os.path.abspath(filepath), self.key(regex, flags, encoding), st.st_size, st.st_mtime_ns, digest, len(spans), json.dumps(spans), time.time()))
+        self._puts += 1
+        if self._puts % 1000 == 0:
+            self.evict()
+
+    def flush(self) -> None:
+        """Records the use of entries that were hit, for eviction order."""
+        if self._touched:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("UPDATE results SET used = ? WHERE path = ? AND key = ?", self._touched)
+            self.conn.execute("COMMIT")
+            self._touched = []
+
+    def evict(self) -> None:
+        """Deletes the least recently used entries beyond max_entries."""
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()
+        if count > self.max_entries:
+            self.conn.execute("DELETE FROM results WHERE rowid IN (SELECT rowid FROM results ORDER BY used LIMIT ?)", (count - self.max_entries,))
+
+    def clear(self) -> None:
+        """Invalidates every cached result."""
+        self.conn.execute("DELETE FROM results")
+        self.conn.execute("VACUUM")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self.flush()
+            self.evict()
+            self._conn.close()
+            self._conn = None
+
+def file_hash(filepath : str) -> str:
+    """Returns the SHA-1 digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,79 @@
+import re
+
+from typing import Callable, Iterable, Iterator, List, TextIO, Union
+
+Replacement = Union[str, Callable[[re.Match], str]]
+
+def read_chunks(f : TextIO, chunk_size : int) -> Iterator[str]:
+    """Yields the contents of an open file in blocks of chunk_size characters."""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def _match_function(repl : Replacement) -> Callable[[re.Match], str]:
+    if callable(repl):
+        return repl
+    if '\\' not in repl:
+        return lambda m: repl
+    return lambda m: m.expand(repl)
+
+def sub_chunks(chunks : Iterable[str], pattern : re.Pattern, repl : Replacement, max_match_length : int, counter : List[int] = None) -> Iterator[str]:
+    """Substitutes regex matches in a stream of text blocks, yielding the new
+    text as it goes. Matches may span block boundaries as long as they, with
+    any lookahead or lookbehind around them, are no longer than
+    max_match_length characters. A match is only kept once that many
+    characters after it have been read, so `$`, word boundaries and lookaheads
+    see the text that follows, and the same number of characters before each
+    block is kept as context for `^`, word boundaries and lookbehinds."""
+    func = _match_function(repl)
+    buffer = ''
+    pos = 0
+    for chunk in chunks:
+        buffer += chunk
+        # Matches ending before `safe` are followed by enough text to be final.
+        safe = len(buffer) - max_match_length
+        if safe <= pos:
+            continue
+        parts = []
+        last = pos
+        cut = safe
+        for m in pattern.finditer(buffer, pos):
+            if m.start() >= safe:
+                break
+            if m.end() > safe and m.start() >= safe - max_match_length:
+                # May still change once more text is read, so it is matched again from its start.
+                cut = m.start()
+                break
+            # Matches longer than max_match_length are kept as found.
+            parts.append(buffer[last:m.start()])
+            parts.append(func(m))
+            last = m.end()
+            if counter is not None:
+                counter[0] += 1
+        cut = max(last, cut)
+        parts.append(buffer[last:cut])
+        yield ''.join(parts)
+        drop = max(0, cut - max_match_length)
+        buffer = buffer[drop:]
+        pos = cut - drop
+    parts = []
+    last = pos
+    for m in pattern.finditer(buffer, pos):
+        parts.append(buffer[last:m.start()])
+        parts.append(func(m))
+        last = m.end()
+        if counter is not None:
+            counter[0] += 1
+    parts.append(buffer[last:])
+    yield ''.join(parts)
+
+def sub_lines(lines : Iterable[str], pattern : re.Pattern, repl : Replacement, counter : List[int] = None) -> Iterator[str]:
+    """Substitutes regex matches line by line, for patterns that never match
+    across a line break."""
+    for line in lines:
+        line, n = pattern.subn(repl, line)
+        if counter is not None:
+            counter[0] += n
+        yield line
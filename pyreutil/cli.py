@@ -1,53 +1,196 @@
 import argparse
+import codecs
+import contextlib
+import json
+import sys
 
+from typing import List, Optional, Union
+
+from .cache import ResultCache, default_cache_path
+from .plan import OperationPlan
+from .shard import Shard, format_merged, merge_summaries, write_manifest, write_summary
+from .stats import Stats
+from .watch import Watcher
 from .pyreutil import *
 
-def run(args) -> None:
+def run(args) -> Optional[int]:
+    """Runs the command, reporting timings and counters at the end with --stats
+    and writing them to a --summary file. Returns the exit status with --quiet."""
+    stats = Stats(top=args.stats_top) if args.stats or args.summary else None
+    with stats.timed_stdout() if stats else contextlib.nullcontext():
+        status = run_operations(args, stats)
+    if args.stats:
+        stats.report(args.stats)
+    if args.summary:
+        write_summary(args.summary, stats, args.shard)
+    return status
+
+def run_operations(args, stats : Stats = None) -> Optional[int]:
     
-    if args.textfiles:
-        content = TextUtil(filenames=args.textfiles, verbose=not args.silence, search_subdirs=args.deep)
-    elif args.filenames:
-        content = FilenameUtil(path=args.filenames, verbose=not args.silence, search_subdirs=args.deep)
+    if args.clear_cache:
+        ResultCache(args.cache).clear()
+        print("Cleared the search result cache.")
+        if not (args.textfiles or args.filenames):
+            return
+    if args.resume_rename or args.rollback_rename:
+        journal = RenameJournal.load(args.resume_rename or args.rollback_rename)
+        if args.resume_rename:
+            print(">> {} remaining renames made.".format(journal.resume(threads=args.jobs, verbose=not args.silence)))
+        else:
+            journal.rollback(verbose=True)
+        return
+    
+    walk_options = {
+        'search_subdirs': args.deep,
+        'include': args.include,
+        'exclude': args.exclude,
+        'exclude_dirs': () if args.no_default_excludes else DEFAULT_EXCLUDE_DIRS,
+        'gitignore': args.gitignore,
+    }
+    source = args.textfiles or args.filenames
+    if args.write_manifest:
+        count = write_manifest(args.write_manifest, walk_files(source, **walk_options) if isdir(source) else [source], source if isdir(source) else None)
+        print(">> Wrote the sizes of {} file(s) to '{}'.".format(count, args.write_manifest))
+        return
+    cache = ResultCache(args.cache, max_entries=args.cache_size, verify_hash=args.cache_hash) if args.textfiles and args.cache else None
+    plan = build_plan(args)
+    
+    def process_changes(paths : Optional[List[str]]) -> List[str]:
+        if paths is not None and args.shard is not None:
+            paths = args.shard.select(paths, source if isdir(source) else None)
+            if not paths:
+                return []
+        return process(args, plan, make_util(args, walk_options, stats, cache, paths))
     
+    try:
+        if args.watch is not None:
+            watcher = Watcher(source, walk_options, interval=args.watch, debounce=args.debounce, stats=stats)
+            try:
+                watcher.run(process_changes)
+            except KeyboardInterrupt:
+                print("Stopped watching.")
+            return
+        content = make_util(args, walk_options, stats, cache)
+        if args.quiet:
+            # Only the exit status is given, so the search stops at the first match.
+            before = OperationPlan()
+            before.operations = plan.operations[:[name for name, _ in plan].index('search')]
+            before.apply(content)
+            return 0 if next(content.iter_matches(args.search, max_total=1), None) is not None else 1
+        process(args, plan, content)
+    finally:
+        if cache is not None:
+            cache.close()
+
+def make_util(args, walk_options : dict, stats : Stats = None, cache : ResultCache = None, paths : List[str] = None) -> Union[TextUtil, FilenameUtil]:
+    """Returns the TextUtil or FilenameUtil of the arguments. Given paths (as
+    when watching), only those files under the source are used, and they are
+    not sharded again."""
+    verbose = not (args.silence or args.quiet)
+    shard = args.shard if paths is None else None
+    if args.textfiles:
+        # With --quiet, files are read only until the first match.
+        content = TextUtil(filenames=paths if paths is not None else args.textfiles, verbose=verbose, stats=stats, stream=args.stream or args.quiet, jobs=args.jobs, cache=cache,
+                           chunk_size=args.chunk_size, max_match_length=args.max_match_length, line_mode=args.line_mode,
+                           io_threads=args.io_threads, read_ahead=args.read_ahead, write_behind=args.write_behind,
+                           context=args.context, list_matches='files' if args.files_with_matches else 'count' if args.count else None,
+                           encoding=args.encoding, timeout=args.timeout, time_budget=args.time_budget, shard=shard, **walk_options)
+        if paths is not None and isdir(args.textfiles):
+            # Copies still go to the copy of the source directory.
+            content.original_dir = args.textfiles
+    elif paths is not None:
+        content = FilenameUtil(pathnames=paths, verbose=verbose, stats=stats, shard=shard, **walk_options)
+        content.path = args.filenames
+    else:
+        content = FilenameUtil(path=args.filenames, verbose=verbose, stats=stats, shard=shard, **walk_options)
+    return content
+
+def process(args, plan : OperationPlan, content : Union[TextUtil, FilenameUtil]) -> List[str]:
+    """Applies the plan and saves the changes as the arguments say, returning
+    the paths of the files written or renamed."""
+    plan.apply(content)
+
+    # Save content
+    if args.textfiles and not (args.inplace or args.copy):
+        content.preview()
+    if plan.modifies and not (args.inplace or args.copy):
+        print("Warning: Changes have not been saved. Use -i --inplace or -c --copy to save changes.")
+    if args.textfiles:
+        save_options = {'fsync': args.fsync, 'link': args.copy_links}
+        written = []
+    else:
+        save_options = {'journal': args.journal, 'threads': args.jobs, 'on_conflict': args.on_conflict, 'link': args.copy_links}
+        written = [target for _, target in content.table.changes()] if args.inplace else []
+    for mode in ('inplace', 'copy'):
+        if getattr(args, mode):
+            report = content.save_changes(mode=mode, **save_options)
+            if args.textfiles and report:
+                written.extend(report['paths'])
+    if not args.silence:
+        for name, kwargs in plan:
+            if name == 'apply_rules':
+                content.print_rule_hits(kwargs['rules'])
+        if args.textfiles:
+            content.print_skipped()
+    return written
+
+def build_plan(args) -> OperationPlan:
+    """Returns the operations given by the arguments, in the documented order:
+    remove, append, search (and replace), rules, and remove whitespaces."""
+    plan = OperationPlan()
     # Build-in regex function
     # if args.textfiles and args.remove_md_links:
-    #     content.strip_markdown_links()
-    
-    # Core functions
+    #     plan.strip_markdown_links()
     if args.remove:
-        content.remove(args.remove)
+        plan.remove(args.remove)
     if args.append_file:
-        content.append(args.append_file, is_file=True)
+        plan.append(args.append_file, is_file=True)
     if args.append:
-        content.append(args.append)
-    if not args.search and (args.replace or args.group):
-        raise("Error: --replace and --group must be used with --search")
-    if args.replace and args.group:
-        raise("Error: --replace and --group cannot be used together")
-    if args.search and not (args.replace or args.replacement_file or args.group or args.lambda_func):
-        content.search(args.search)
-    if args.search and args.replace:
-        content.search_and_replace(args.search, replace=args.replace)
-    if args.search and args.replacement_file:
-        content.search_and_replace(args.search, from_file=args.replacement_file)
-    if args.search and args.group:
-        content.search_and_replace(args.search, group=args.group)
-    if args.search and args.lambda_func:
-        content.search_and_replace(args.search, lambda_func=args.lambda_func)
+        plan.append(args.append)
+    if args.search:
+        if args.replace is not None:
+            plan.search_and_replace(args.search, replace=args.replace)
+        elif args.replacement_file:
+            plan.search_and_replace(args.search, from_file=args.replacement_file)
+        elif args.group is not None:
+            plan.search_and_replace(args.search, group=args.group)
+        elif args.lambda_func:
+            plan.search_and_replace(args.search, lambda_func=args.lambda_func)
+        else:
+            plan.search(args.search, max_count=args.max_count)
+    if args.rules:
+        plan.apply_rules(args.rules)
     if args.remove_whitespaces:
-        content.remove_extra_whitespaces()
+        plan.remove_extra_whitespaces()
+    return plan
 
-    # Save content
-    if args.search and (args.replace or args.replacement_file, args.group or args.lambda_func) and not (args.inplace or args.copy):
-        print("Warning: Changes have not been saved. Use -i --inplace or -c --copy to save changes.")
-    if args.inplace:
-        content.save_changes(mode='inplace')
-    if args.copy:
-        content.save_changes(mode='copy')
-    
+def merge_stats(argv : List[str]) -> int:
+    """Combines the --summary files of the shards of a run. Exits with status 1
+    if the summary of any shard is missing."""
+    parser = argparse.ArgumentParser(prog="pyreutil merge-stats", description="Combines the --summary files written by the shards of a pyreutil run.")
+    parser.add_argument('summaries', help='summary files to combine', nargs='+')
+    parser.add_argument('--format', help='prints the combined stats as text or json', choices=['text', 'json'], default='text', required=False)
+    parser.add_argument('--stats-top', help='number of slowest files reported', type=int, default=10, required=False)
+    args = parser.parse_args(argv)
+    summaries = []
+    for path in args.summaries:
+        try:
+            with open(path) as f:
+                summaries.append(json.load(f))
+        except (OSError, ValueError) as e:
+            parser.error("Could not read the summary '{}': {}".format(path, e))
+    merged = merge_summaries(summaries, top=args.stats_top)
+    if args.format == 'json':
+        json.dump(merged, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print(format_merged(merged))
+    return 1 if merged['missing'] else 0
 
 def main() -> None:
     """Process command line arguments and execute the given command.""" 
+    if sys.argv[1:2] == ['merge-stats']:
+        sys.exit(merge_stats(sys.argv[2:]))
     parser = argparse.ArgumentParser(description="pyreutil - A python command line utility for searching and modifying files and filenames using regex.")
     
     # Two Modes
@@ -58,16 +201,55 @@ def main() -> None:
     # Global commands
     parser.add_argument('-a', '--append', help='text to append', type=str, required=False)
     parser.add_argument('-af', '--append-file', help='appends file contents', type=str, required=False) # only for textfiles
+    parser.add_argument('--cache', help='caches search results of unchanged text files (in the given file, or the user cache directory)', nargs='?', const=default_cache_path(), required=False)
+    parser.add_argument('--cache-hash', help='also reuses cached results of files whose mtime changed but whose contents did not', action='store_true', required=False)
+    parser.add_argument('--cache-size', help='maximum number of file results kept in the search cache', type=int, default=200000, required=False)
+    parser.add_argument('--chunk-size', help='modifies text files in blocks of this many characters instead of reading them whole', type=int, default=0, required=False)
+    parser.add_argument('-C', '--context', help='prints only the lines of text files with matches, with this many lines around them', type=int, required=False)
+    parser.add_argument('--clear-cache', help='invalidates all cached search results', action='store_true', required=False)
+    parser.add_argument('--copy-links', help='how -c --copy shares unchanged files with the originals (default: reflink, else copy; hardlink shares them with the originals)', choices=CLONE_METHODS, default='auto', required=False)
+    parser.add_argument('--count', help='prints only the number of matches in each text file', action='store_true', required=False)
     parser.add_argument('-c', '--copy', help='saves changes as a copy of the original directory/file', action='store_true', required=False)
+    parser.add_argument('--debounce', help='seconds a changed file has to stay unchanged before --watch processes it', type=float, default=0.5, required=False)
     parser.add_argument('-d', '--deep', help='search subdirectories if a directory is given', action='store_true', required=False)
+    parser.add_argument('--encoding', help='encoding of text files without a byte order mark (default: the platform encoding)', type=str, required=False)
+    parser.add_argument('--exclude', help='glob of file or directory names/paths to skip (can be repeated)', action='append', required=False)
+    parser.add_argument('--files-with-matches', help='prints only the names of text files with matches', action='store_true', required=False)
+    parser.add_argument('--fsync', help='flushes saved text files to disk before replacing the originals', action='store_true', required=False)
+    parser.add_argument('--gitignore', help='skips files ignored by .gitignore files', action='store_true', required=False)
+    parser.add_argument('--include', help='glob of file names/paths to search, all others are skipped (can be repeated)', action='append', required=False)
+    parser.add_argument('--no-default-excludes', help='also searches version control, node_modules and __pycache__ directories', action='store_true', required=False)
+    parser.add_argument('--io-threads', help='number of threads reading text files ahead of, and writing them behind, the regex work', type=int, default=0, required=False)
     parser.add_argument('-i', '--inplace', help='save changes to the existing directory/file', action='store_true', required=False)
+    parser.add_argument('-j', '--jobs', help='number of processes to read, modify and save text files with (or threads to rename files with)', type=int, default=1, required=False)
+    parser.add_argument('--journal', help='file to journal inplace renames in, so an interrupted run can be resumed or rolled back', type=str, required=False)
+    parser.add_argument('--line-mode', help='modifies text files line by line (matches cannot span lines)', action='store_true', required=False)
+    parser.add_argument('-m', '--max-count', help='stops counting (and printing) the matches of --search in each file or filename after this many', type=int, required=False)
+    parser.add_argument('--max-match-length', help='longest match (in characters, counting any lookahead or lookbehind) guaranteed to be found across blocks with --chunk-size', type=int, default=4096, required=False)
     parser.add_argument('-l', '--lambda-func', help='code string to execute in a lambda function. Must be used with -s --search', type=str, required=False)
     parser.add_argument('-r', '--replace', help='raw string to replace searches with. Must be used with -s --search', type=str, required=False)
     parser.add_argument('-rf', '--replacement-file', help='file containing contents to replaces regex searches with. Must be used with -s --search', type=str, required=False) 
     parser.add_argument('-g', '--group', help='integer representing the group to replace. Must be used with -s --search', type=int, required=False)
     parser.add_argument('-rm', '--remove', help='removes regex matches', type=str, required=False)
+    parser.add_argument('--on-conflict', help='what to do when renamed files would overwrite each other or other files (default: error)', choices=['error', 'skip'], default='error', required=False)
+    parser.add_argument('-q', '--quiet', help='prints nothing and exits with status 0 if --search matches anything, otherwise 1 (reading files only until the first match)', action='store_true', required=False)
+    parser.add_argument('--read-ahead', help='maximum number of text files read ahead with --io-threads', type=int, default=64, required=False)
+    parser.add_argument('--resume-rename', help='makes the remaining renames of an interrupted run from its --journal file', type=str, required=False)
+    parser.add_argument('--rollback-rename', help='undoes the renames made by a run from its --journal file', type=str, required=False)
+    parser.add_argument('--rules', help='file of regex/replacement rules (tab separated lines, or JSON) applied in one pass per file', type=str, required=False)
+    parser.add_argument('--shard', help='processes only the files of shard K of N (0 <= K < N), by a stable hash of their path in the source', metavar='K/N', type=str, required=False)
+    parser.add_argument('--shard-manifest', help='JSON file of file sizes (see --write-manifest) by which --shard assigns files so shards get about as many bytes', type=str, required=False)
+    parser.add_argument('--summary', help='writes the stats of the run (and its --shard) to a JSON file, for merge-stats', type=str, required=False)
     parser.add_argument('-s', '--search', help='searches for regex matches', type=str, required=False)
     parser.add_argument('-si', '--silence', help='silences the output', action='store_true', required=False)
+    parser.add_argument('--stats', help='reports time per phase, bytes, matches and the slowest files at the end (as text or json)', nargs='?', const='text', choices=['text', 'json'], required=False)
+    parser.add_argument('--stats-top', help='number of slowest files reported by --stats', type=int, default=10, required=False)
+    parser.add_argument('--stream', help='reads, modifies and saves text files one at a time instead of loading them all into memory', action='store_true', required=False)
+    parser.add_argument('--time-budget', help='seconds the whole run may take, after which the text files not processed yet are skipped', type=float, required=False)
+    parser.add_argument('--timeout', help='seconds a text file may take to process, after which its worker process is killed and the file skipped', type=float, required=False)
+    parser.add_argument('--watch', help='after a full pass, polls the source every this many seconds (default 1) and processes only added or modified files', nargs='?', const=1.0, type=float, metavar='SECONDS', required=False)
+    parser.add_argument('--write-manifest', help='writes the size of each file of the source to a JSON file for --shard-manifest, and exits', type=str, required=False)
+    parser.add_argument('--write-behind', help='maximum number of text files waiting to be written with --io-threads', type=int, default=64, required=False)
     parser.add_argument('-w', '--remove-whitespaces', help='removes redundant whitespaces (repeat, leading, trailing, and spaces before a period or comma)', action='store_true', required=False)
     # Exclusive to modifying contents
     # parser.add_argument('-md', '--remove-md-links', help='removes markdown links and replaces it with the link name', action='store_true', required=False)
@@ -76,7 +258,47 @@ def main() -> None:
         g._group_actions.sort(key=lambda x:x.dest)
     
     args = parser.parse_args()
-    run(args)
+    replacements = [args.replace is not None, args.replacement_file is not None, args.group is not None, args.lambda_func is not None]
+    if any(replacements) and not args.search:
+        parser.error("--replace, --replacement-file, --group and --lambda-func must be used with --search")
+    if sum(replacements) > 1:
+        parser.error("--replace, --replacement-file, --group and --lambda-func cannot be used together")
+    if args.quiet and (not args.search or any(replacements) or args.inplace or args.copy):
+        parser.error("--quiet must be used with --search, without a replacement, --inplace or --copy")
+    if args.watch is not None and (args.quiet or not (args.textfiles or args.filenames)):
+        parser.error("--watch must be used with --textfiles or --filenames, and not with --quiet")
+    if args.files_with_matches and args.count:
+        parser.error("--files-with-matches and --count cannot be used together")
+    if args.lambda_func:
+        try:
+            compile_lambda(args.lambda_func)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.shard_manifest and not args.shard:
+        parser.error("--shard-manifest must be used with --shard")
+    if args.shard:
+        try:
+            args.shard = Shard.parse(args.shard, args.shard_manifest)
+        except (OSError, ValueError) as e:
+            parser.error("Could not load the shard manifest '{}': {}".format(args.shard_manifest, e))
+        except Exception as e:
+            parser.error(str(e))
+    if args.write_manifest and not (args.textfiles or args.filenames):
+        parser.error("--write-manifest must be used with --textfiles or --filenames")
+    if args.encoding:
+        try:
+            codecs.lookup(args.encoding)
+        except LookupError:
+            parser.error("Unknown encoding '{}'".format(args.encoding))
+    if args.rules:
+        try:
+            args.rules = RuleSet(load_rules(args.rules), name=args.rules)
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            parser.error("Could not load the rules file '{}': {}".format(args.rules, e))
+    # Undecodable bytes of text files are printed as they are.
+    if hasattr(sys.stdout, 'reconfigure'):
+        sys.stdout.reconfigure(errors='surrogateescape')
+    sys.exit(run(args))
 
 if __name__ == "__main__":
     main()
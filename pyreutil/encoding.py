@@ -0,0 +1,43 @@
+import codecs
+import io
+import locale
+
+from typing import Optional
+
+# Bytes at the start of a file looked at to tell its encoding, or that it is binary.
+SNIFF_SIZE = 8192
+# Bytes that cannot be decoded are kept as lone surrogates, which the regexes
+# pass over and which are written back as the same bytes.
+ERRORS = 'surrogateescape'
+
+# UTF-32 first, as its little endian mark starts with UTF-16's.
+_BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+def default_encoding() -> str:
+    """Returns the encoding files are opened with by default on this platform."""
+    return locale.getpreferredencoding(False)
+
+def ascii_compatible(encoding : str) -> bool:
+    """Whether ASCII text is stored as the same bytes in the encoding."""
+    return not codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32'))
+
+def sniff_encoding(head : bytes, default : str) -> Optional[str]:
+    """Returns the encoding of a file from its first bytes: the encoding of its
+    byte order mark if it has one, otherwise the default, or None if the file
+    looks binary (a NUL byte, which ASCII-compatible text does not contain)."""
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    if b'\0' in head and ascii_compatible(default):
+        return None
+    return default
+
+def decode(data : bytes, encoding : str) -> str:
+    """Decodes a file's bytes as reading it in text mode would."""
+    return io.TextIOWrapper(io.BytesIO(data), encoding=encoding, errors=ERRORS).read()
@@ -0,0 +1,62 @@
+import bisect
+import re
+
+from typing import List, Optional, Sequence, Tuple
+
+Span = Tuple[int, int]
+
+def line_offsets(text : str) -> List[int]:
+    """Returns the offset at which each line of the text starts."""
+    return [0] + [m.end() for m in re.finditer('\n', text)]
+
+def context_groups(offsets : List[int], spans : Sequence[Span], context : int) -> List[Tuple[int, int, List[int]]]:
+    """Groups the matches into runs of lines to show, as (first line, last line,
+    indexes of the spans in the run), with `context` lines around each match
+    and overlapping or adjacent runs merged."""
+    groups = []
+    for i, (start, end) in enumerate(spans):
+        first = bisect.bisect_right(offsets, start) - 1
+        last = bisect.bisect_right(offsets, max(start, end - 1)) - 1
+        first, last = max(0, first - context), min(len(offsets) - 1, last + context)
+        if groups and first <= groups[-1][1] + 1:
+            groups[-1] = (groups[-1][0], max(last, groups[-1][1]), groups[-1][2] + [i])
+        else:
+            groups.append((first, last, [i]))
+    return groups
+
+def render_group(text : str, offsets : List[int], group : Tuple[int, int, List[int]], spans : Sequence[Span], pieces : Sequence[str], marker : Optional[str] = None) -> List[str]:
+    """Returns the numbered lines of a group with each span replaced by its
+    (colored) piece. Lines with a match are marked ':' and context lines '-',
+    unless a marker is given for every line."""
+    first, last, indexes = group
+    start = offsets[first]
+    end = offsets[last + 1] - 1 if last + 1 < len(offsets) else len(text)
+    matched = set()
+    parts = []
+    position = start
+    for i in indexes:
+        span_start, span_end = spans[i]
+        parts.append(text[position:span_start])
+        parts.append(pieces[i])
+        position = span_end
+        matched.update(range(bisect.bisect_right(offsets, span_start) - 1, bisect.bisect_right(offsets, max(span_start, span_end - 1))))
+    parts.append(text[position:end])
+    lines = ''.join(parts).split('\n')
+    return ["{}{}{}".format(first + n + 1, marker or (':' if first + n in matched else '-'), line) for n, line in enumerate(lines)]
+
+def render_context(filename : Optional[str], text : str, spans : Sequence[Span], found : Sequence[str], replaced : Sequence[str] = None, context : int = 0) -> str:
+    """Renders the lines with matches (and `context` lines around them) grep
+    style, under a header with the filename. With replacements, each run of
+    lines is followed by the same lines as they are after the replacement,
+    marked '+'."""
+    if not spans:
+        return ''
+    offsets = line_offsets(text)
+    out = [filename] if filename is not None else []
+    for n, group in enumerate(context_groups(offsets, spans, context)):
+        if n > 0:
+            out.append('--')
+        out.extend(render_group(text, offsets, group, spans, found))
+        if replaced is not None:
+            out.extend(render_group(text, offsets, group, spans, replaced, marker='+'))
+    return '\n'.join(out) + '\n'
@@ -0,0 +1,66 @@
+import collections
+import concurrent.futures
+import functools
+
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Union
+
+from .encoding import SNIFF_SIZE, sniff_encoding
+
+def read_bytes(filepath : str, encoding : str = 'utf-8') -> Union[bytes, OSError]:
+    """Returns the contents of a file, or the error raised reading it. Only the
+    first block of a binary file is read, which is enough to skip it."""
+    try:
+        with open(filepath, 'rb') as f:
+            data = f.read(SNIFF_SIZE)
+            if sniff_encoding(data, encoding) is None:
+                return data
+            return data + f.read()
+    except OSError as e:
+        return e
+
+def prefetch(filepaths : List[str], read : Callable[[str], Any], pool : concurrent.futures.Executor, depth : int) -> Iterator[Tuple[str, Any]]:
+    """Yields (filepath, read(filepath)) in order, with up to `depth` reads
+    running or waiting ahead of the consumer in the pool."""
+    pending = collections.deque()
+    for filepath in filepaths:
+        pending.append((filepath, pool.submit(read, filepath)))
+        if len(pending) >= depth:
+            filepath, future = pending.popleft()
+            yield filepath, future.result()
+    while pending:
+        filepath, future = pending.popleft()
+        yield filepath, future.result()
+
+def process_files(util, filepaths : List[str], final : Optional[Tuple[str, tuple]], threads : int, read_ahead : int, write_behind : int) -> Iterator[Tuple[bool, Any]]:
+    """Runs util._process_file over the files with reads and writes overlapped
+    with the regex work: a pool of I/O threads reads up to read_ahead files
+    ahead, and saved files are written by another pool while up to
+    write_behind of them are pending. Text processing and printing stay in the
+    calling thread, and the (ok, result) pairs are yielded in file order."""
+    readers = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    writers = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+    util._writer = writers
+    pending = collections.deque()
+    try:
+        if util._reads_whole_files(final):
+            files = prefetch(filepaths, functools.partial(read_bytes, encoding=util.encoding), readers, max(1, read_ahead))
+        else:
+            files = ((filepath, None) for filepath in filepaths)
+        for filepath, data in files:
+            pending.append(util._process_file(filepath, final, data))
+            if len(pending) > write_behind:
+                yield _resolve(pending.popleft())
+        while pending:
+            yield _resolve(pending.popleft())
+    finally:
+        util._writer = None
+        readers.shutdown(wait=True, cancel_futures=True)
+        writers.shutdown(wait=True)
+
+def _resolve(item : Tuple[bool, Any]) -> Tuple[bool, Any]:
+    """Waits for a pending write, returning the saved path and size."""
+    ok, result = item
+    if isinstance(result, tuple) and isinstance(result[1], concurrent.futures.Future):
+        size = result[1].result()
+        result = (result[0], size) if size is not None else None
+    return ok, result
@@ -0,0 +1,71 @@
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import io
+import sys
+
+from typing import Any, Iterator, List, Optional, Tuple
+
+# The TextUtil each worker process runs its files through (set by _init_worker).
+_worker = None
+
+def _init_worker(util) -> None:
+    global _worker
+    _worker = util
+
+def _run_batch(filepaths : List[str], final : Optional[Tuple[str, tuple]]) -> Tuple[List[Tuple[bool, Any, str]], dict, Optional[dict]]:
+    """Processes a batch of files in a worker, capturing what each one prints.
+    The counters and stats collected for the batch are returned along with
+    the results."""
+    results = []
+    for filepath in filepaths:
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            ok, result = _worker._process_file(filepath, final)
+        results.append((ok, result, output.getvalue()))
+    counters = dict(_worker.counters)
+    _worker.counters.clear()
+    return results, counters, _worker.stats.take()
+
+def _batches(items : List[str], size : int) -> Iterator[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+def worker_copy(util):
+    """Returns a copy of the util to send to worker processes, which only need
+    the settings and queued steps, not the file lists."""
+    shell = copy.copy(util)
+    shell.original_filenames = []
+    shell.original_text = []
+    shell.text = []
+    shell.counters = collections.Counter()
+    shell.encodings = {}
+    shell.stats = util.stats.empty()
+    return shell
+
+def process_files(util, filepaths : List[str], final : Optional[Tuple[str, tuple]], jobs : int, batch_size : int = 16) -> Iterator[Tuple[bool, Any]]:
+    """Runs util._process_file over the files across a pool of processes,
+    yielding the (ok, result) pairs and printing each file's output in the
+    original file order."""
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(worker_copy(util),))
+    # Only a few batches per worker are in flight so memory stays bounded.
+    pending = collections.deque()
+    try:
+        for batch in _batches(filepaths, batch_size):
+            pending.append(executor.submit(_run_batch, batch, final))
+            if len(pending) >= jobs * 2:
+                yield from _collect(util, pending.popleft())
+        while pending:
+            yield from _collect(util, pending.popleft())
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _collect(util, future : concurrent.futures.Future) -> Iterator[Tuple[bool, Any]]:
+    results, counters, stats = future.result()
+    util.counters.update(counters)
+    util.stats.merge(stats)
+    for ok, result, output in results:
+        if output:
+            sys.stdout.write(output)
+        yield ok, result
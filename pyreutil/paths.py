@@ -0,0 +1,124 @@
+import array
+import os
+import sys
+
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+class PathTable(Sequence[str]):
+    """Compact table of paths, each stored as a directory, a stem and an
+    extension. Every directory is stored once and referenced by index, and
+    extensions are interned, so millions of paths in few directories take
+    little more memory than their stems. Changed stems are kept apart from
+    the original ones, so operations run on stems alone and full paths are
+    only built when asked for.
+
+    As a sequence, the table holds the current (changed) paths."""
+
+    def __init__(self, paths : Iterable[str] = ()):
+        self.dirs : List[str] = []
+        self.dir_ids : array.array = array.array('L')
+        self.stems : List[str] = []
+        self.exts : List[str] = []
+        # Index -> stem of each entry whose stem was changed.
+        self.changed : Dict[int, str] = {}
+        self._dir_index : Dict[str, int] = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path : str) -> int:
+        """Adds a path, returning its index."""
+        head, tail = os.path.split(path)
+        stem, ext = os.path.splitext(tail)
+        dir_id = self._dir_index.get(head)
+        if dir_id is None:
+            dir_id = self._dir_index[head] = len(self.dirs)
+            self.dirs.append(head)
+        self.dir_ids.append(dir_id)
+        self.stems.append(stem)
+        self.exts.append(sys.intern(ext))
+        return len(self.stems) - 1
+
+    def __len__(self) -> int:
+        return len(self.stems)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.path(k) for k in range(*i.indices(len(self)))]
+        return self.path(i)
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.path(i) for i in range(len(self.stems)))
+
+    def directory(self, i : int) -> str:
+        return self.dirs[self.dir_ids[i]]
+
+    def stem(self, i : int) -> str:
+        """Returns the current stem of an entry."""
+        return self.changed.get(i, self.stems[i])
+
+    def current_stems(self) -> Iterator[str]:
+        changed = self.changed
+        if not changed:
+            return iter(self.stems)
+        return (changed.get(i, stem) for i, stem in enumerate(self.stems))
+
+    def set_stem(self, i : int, stem : str) -> None:
+        if stem == self.stems[i]:
+            self.changed.pop(i, None)
+        else:
+            self.changed[i] = stem
+
+    def set_stems(self, stems : Iterable[str]) -> int:
+        """Sets the current stem of every entry in order, returning how many
+        differ from the stem they had before."""
+        count = 0
+        for i, stem in enumerate(stems):
+            if stem != self.stem(i):
+                count += 1
+                self.set_stem(i, stem)
+        return count
+
+    def path(self, i : int) -> str:
+        """Returns the current full path of an entry."""
+        return os.path.join(self.dirs[self.dir_ids[i]], self.stem(i) + self.exts[i])
+
+    def original(self, i : int) -> str:
+        return os.path.join(self.dirs[self.dir_ids[i]], self.stems[i] + self.exts[i])
+
+    def originals(self) -> Iterator[str]:
+        return (self.original(i) for i in range(len(self.stems)))
+
+    def changes(self) -> Iterator[Tuple[str, str]]:
+        """Yields the (original, current) path of each changed entry in order."""
+        for i in sorted(self.changed):
+            yield self.original(i), self.path(i)
+
+class PathView(Sequence[str]):
+    """Read-only view of the current paths of a PathTable, returned by the
+    FilenameUtil operations. Paths are only built when read, and the view
+    compares equal to a list (or any sequence) of the same paths. It follows
+    later changes to the table, use list(view) for a snapshot."""
+
+    def __init__(self, table : PathTable):
+        self._table : PathTable = table
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __getitem__(self, i):
+        return self._table[i]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._table)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PathView):
+            other = other._table
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return "PathView({!r})".format(list(self))
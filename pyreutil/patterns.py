@@ -0,0 +1,168 @@
+import functools
+import re
+
+from collections import OrderedDict
+from typing import Callable, List, Optional, Pattern, Tuple, Union
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError: # Python < 3.11
+    import sre_constants, sre_parse
+
+class PatternCache:
+    """Bounded LRU cache of compiled regex patterns."""
+
+    def __init__(self, maxsize : int = 512):
+        if maxsize < 1:
+            raise ValueError("Error: The pattern cache size must be at least 1.")
+        self.maxsize : int = maxsize
+        self.hits : int = 0
+        self.misses : int = 0
+        self._patterns : "OrderedDict[Tuple[type, Union[str, bytes], int], Pattern]" = OrderedDict()
+
+    def compile(self, regex : Union[str, bytes, Pattern], flags : int = 0) -> Pattern:
+        """Returns the compiled pattern, compiling it only on a cache miss."""
+        if isinstance(regex, re.Pattern):
+            return regex
+        key = (type(regex), regex, flags)
+        try:
+            pattern = self._patterns[key]
+        except KeyError:
+            self.misses += 1
+            pattern = re.compile(regex, flags)
+            self._patterns[key] = pattern
+            if len(self._patterns) > self.maxsize:
+                self._patterns.popitem(last=False)
+            return pattern
+        self.hits += 1
+        self._patterns.move_to_end(key)
+        return pattern
+
+    def clear(self) -> None:
+        """Empties the cache and resets the hit/miss counters."""
+        self._patterns.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        """Returns the hit/miss counters and current size of the cache."""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._patterns), 'maxsize': self.maxsize}
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_lambda(lambda_str : str) -> Callable[[re.Match], str]:
+    """Compiles a lambda expression body (with the match bound to `x`) into a
+    reusable function, e.g. "x.group(2).upper()". The expression sees the
+    names of the pyreutil module (such as re and os), as it always has."""
+    from . import pyreutil
+    try:
+        return eval("lambda x: (\n{}\n)".format(lambda_str), vars(pyreutil))
+    except SyntaxError as e:
+        raise ValueError("Error: Could not compile lambda function '{}': {}".format(lambda_str, e.msg)) from None
+
+def as_match_function(lambda_func : Union[str, Callable[[re.Match], str]]) -> Callable[[re.Match], str]:
+    """Returns the given callable, or the compiled function for a lambda string."""
+    if callable(lambda_func):
+        return lambda_func
+    return compile_lambda(lambda_func)
+
+
+def _parse(regex : str):
+    """Returns the parsed regex, or None if it is not a case-sensitive str
+    pattern that compiles."""
+    if not isinstance(regex, str):
+        return None
+    try:
+        parsed = sre_parse.parse(regex)
+    except re.error:
+        return None
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    if state.flags & re.IGNORECASE:
+        return None
+    return parsed
+
+@functools.lru_cache(maxsize=512)
+def required_literals(regex : str) -> Tuple[str, ...]:
+    """Returns substrings that every match of the regex must contain, longest
+    first. Nothing is returned when no literal can be derived, e.g. for
+    case-insensitive patterns or patterns made only of classes and branches."""
+    parsed = _parse(regex)
+    if parsed is None:
+        return ()
+    literals = []
+    _collect_literals(parsed, literals)
+    return tuple(sorted({lit for lit in literals if lit}, key=len, reverse=True))
+
+def _collect_literals(subpattern, literals : List[str]) -> None:
+    """Adds the runs of literal characters that must be matched in sequence.
+    Runs are broken at any other construct, so the result is conservative."""
+    run = []
+    for op, av in subpattern:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+        literals.append(''.join(run))
+        run = []
+        if op is sre_constants.SUBPATTERN:
+            add_flags, p = av[1], av[-1]
+            if not add_flags & re.IGNORECASE:
+                _collect_literals(p, literals)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) or op.name == 'POSSESSIVE_REPEAT':
+            if av[0] >= 1:
+                _collect_literals(av[2], literals)
+        elif op.name == 'ATOMIC_GROUP':
+            _collect_literals(av, literals)
+    literals.append(''.join(run))
+
+def may_contain(text : Union[str, bytes], literals : Tuple[str, ...]) -> bool:
+    """Returns whether the text contains all of the literals. Raw bytes are only
+    checked for ASCII literals without line breaks (which may be stored as CRLF),
+    as those are encoded the same by any ASCII-compatible encoding."""
+    if isinstance(text, bytes):
+        for literal in literals:
+            if literal.isascii() and '\n' not in literal and '\r' not in literal and literal.encode('ascii') not in text:
+                return False
+        return True
+    for literal in literals:
+        if literal not in text:
+            return False
+    return True
+
+@functools.lru_cache(maxsize=512)
+def literal_pattern(regex : str) -> Optional[str]:
+    """Returns the string a regex matches if it has no metacharacters (after
+    escapes are resolved), e.g. "foo\\.bar" -> "foo.bar", otherwise None."""
+    parsed = _parse(regex)
+    if parsed is None or len(parsed) == 0 or not all(op is sre_constants.LITERAL for op, _ in parsed):
+        return None
+    return ''.join(chr(av) for _, av in parsed)
+
+def literal_replacement(replace : str) -> Optional[str]:
+    """Returns the replacement if re.sub would insert it as-is (no escapes or
+    group references), otherwise None."""
+    if isinstance(replace, str) and '\\' not in replace:
+        return replace
+    return None
+
+@functools.lru_cache(maxsize=512)
+def literal_core(regex : str) -> Optional[Tuple[str, bool]]:
+    """Returns (literal, bounded) for a regex that matches a fixed string,
+    optionally between \\b word boundaries (e.g. r"\\bfoo\\b"), otherwise None."""
+    parsed = _parse(regex)
+    if parsed is None:
+        return None
+    parsed = list(parsed)
+    boundary = (sre_constants.AT, sre_constants.AT_BOUNDARY)
+    bounded = False
+    while parsed and parsed[0] == boundary:
+        parsed.pop(0)
+        bounded = True
+    while parsed and parsed[-1] == boundary:
+        parsed.pop()
+        bounded = True
+    if not parsed or not all(op is sre_constants.LITERAL for op, _ in parsed):
+        return None
+    return ''.join(chr(av) for _, av in parsed), bounded
@@ -0,0 +1,76 @@
+import re
+
+from typing import Callable, Iterable, Iterator, List, Tuple, Union
+
+from .patterns import as_match_function
+from .rules import Rule, RuleSet, load_rules
+from .utils import get_file_contents, mutually_exclusive
+
+class OperationPlan:
+    """An ordered list of operations that is built once and then applied to any
+    number of TextUtil or FilenameUtil instances. TextUtil runs the whole chain
+    on each file in a single pass, with one read and one write per file."""
+
+    def __init__(self):
+        self.operations : List[Tuple[str, dict]] = []
+
+    def __iter__(self) -> Iterator[Tuple[str, dict]]:
+        return iter(self.operations)
+
+    def __len__(self) -> int:
+        return len(self.operations)
+
+    @property
+    def modifies(self) -> bool:
+        """Whether any operation changes the text or filenames."""
+        return any(name != 'search' for name, _ in self.operations)
+
+    def remove(self, regex : str) -> 'OperationPlan':
+        self.operations.append(('remove', {'regex': regex}))
+        return self
+
+    def append(self, content : str, is_file : bool = False) -> 'OperationPlan':
+        if is_file:
+            content = get_file_contents(content)
+        self.operations.append(('append', {'content': content}))
+        return self
+
+    @mutually_exclusive('replace', 'from_file', 'group', 'lambda_func')
+    def search_and_replace(self, regex : str, replace : str = None, from_file : str = None, group : int = None, lambda_func : Union[str, Callable[[re.Match], str]] = None) -> 'OperationPlan':
+        # Files and lambda expressions are read and checked once for every use of the plan.
+        if from_file is not None:
+            replace = get_file_contents(from_file)
+        if replace is not None:
+            kwargs = {'replace': replace}
+        elif lambda_func is not None:
+            as_match_function(lambda_func)
+            kwargs = {'lambda_func': lambda_func}
+        else:
+            kwargs = {'group': group}
+        self.operations.append(('search_and_replace', dict(regex=regex, **kwargs)))
+        return self
+
+    def search(self, regex : str, max_count : int = None) -> 'OperationPlan':
+        self.operations.append(('search', {'regex': regex, 'max_count': max_count}))
+        return self
+
+    def apply_rules(self, rules : Union[str, RuleSet, Iterable[Rule]]) -> 'OperationPlan':
+        # Rules files are loaded and merged once for every use of the plan.
+        if isinstance(rules, str):
+            rules = RuleSet(load_rules(rules), name=rules)
+        elif not isinstance(rules, RuleSet):
+            rules = RuleSet(rules)
+        self.operations.append(('apply_rules', {'rules': rules}))
+        return self
+    
+    def remove_extra_whitespaces(self) -> 'OperationPlan':
+        self.operations.append(('remove_extra_whitespaces', {}))
+        return self
+
+    def strip_markdown_links(self) -> 'OperationPlan':
+        self.operations.append(('strip_markdown_links', {}))
+        return self
+
+    def apply(self, util):
+        """Applies the plan to a TextUtil or FilenameUtil, returning it."""
+        return util.apply_plan(self)
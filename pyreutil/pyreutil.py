@@ -1,37 +1,194 @@
+import collections
+import concurrent.futures
+import itertools
 import re
 import os
 import shutil
+import sys
+import time
 
-from typing import List, Union
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 
 from .utils import *
+from .cache import ResultCache
+from .chunked import read_chunks, sub_chunks, sub_lines
+from .encoding import ERRORS, SNIFF_SIZE, ascii_compatible, decode, default_encoding, sniff_encoding
+from .output import render_context
+from .overlapped import process_files as process_files_overlapped
+from .parallel import process_files
+from .paths import PathTable, PathView
+from .patterns import PatternCache, as_match_function, compile_lambda, literal_pattern, literal_replacement, may_contain, required_literals
+from .rename import RenameJournal, RenamePlan
+from .rules import Rule, RuleSet, load_rules
+from .shard import Shard
+from .stats import NULL_STATS, Stats
+from .timeouts import process_files as process_files_killable
+
+class MatchRecord(NamedTuple):
+    """A match yielded by iter_matches: the path it was found in, its line
+    (1-based, None for filenames), its span and the text of its groups."""
+    path : Optional[str]
+    line : Optional[int]
+    span : Tuple[int, int]
+    groups : Tuple[Optional[str], ...]
 
 class ReUtil:
     
-    def __init__(self, verbose : bool = False, **kwargs):
+    # Shared by every instance so each pattern is compiled once per run.
+    pattern_cache : PatternCache = PatternCache()
+    
+    def __init__(self, verbose : bool = False, stats : Stats = None, shard : Union[Shard, str, Tuple[int, int]] = None, **kwargs):
         self.verbose : bool = verbose
+        # Timings and counters of the run when profiling, see stats.Stats.
+        self.stats : Stats = stats if stats is not None else NULL_STATS
+        # Only the files of this shard ('K/N') of the source are used, see shard.Shard.
+        if isinstance(shard, str):
+            shard = Shard.parse(shard)
+        elif shard is not None and not isinstance(shard, Shard):
+            shard = Shard(*shard)
+        self.shard : Optional[Shard] = shard
+        self._columns : Optional[int] = None
         self.color_search : List[int] = [255,0,0]
         self.color_replace : List[int] = [0,255,0]
+        # Options for walking directories, see utils.walk_files.
+        self.walk_options : dict = {'search_subdirs': False}
+        self.walk_options.update((k, v) for k, v in kwargs.items() if k in WALK_OPTIONS)
+        # Totals collected while processing, e.g. hits per rule of a RuleSet.
+        self.counters : collections.Counter = collections.Counter()
+    
+    def compile(self, regex : str, flags : int = 0) -> re.Pattern:
+        """Returns the compiled regex from the shared pattern cache."""
+        return self.pattern_cache.compile(regex, flags)
+    
+    def engine(self, regex : str, replace : str = '') -> str:
+        """Returns 'literal' if the search (and replacement) can be done with
+        plain string methods, otherwise 'regex'."""
+        if literal_pattern(regex) is not None and literal_replacement(replace) is not None:
+            return 'literal'
+        return 'regex'
+    
+    def print_engine(self, regex : str, replace : str = '', search : bool = False) -> None:
+        """Prints which engine an operation (a search, or a replacement)
+        runs on in verbose mode. Texts scanned with each engine are counted in
+        the stats as scans_literal and scans_regex."""
+        if self.verbose:
+            print(">> Using the {} engine for '{}'.".format(self.engine(regex, replace), regex))
     
     @mutually_exclusive('replace', 'group')
     def search_and_replace(self, regex : str, text : str, replace : str = None, group : int = 0) -> str:
         """Searches through text and replaces with string."""
+        if replace is not None and self.engine(regex, replace) == 'literal':
+            if self.stats:
+                self.stats.add('scans_literal')
+                self.stats.add('matches', text.count(literal_pattern(regex)))
+            return text.replace(literal_pattern(regex), replace)
+        self.stats.add('scans_regex')
+        pattern = self.compile(regex)
         if replace is None:
-            return re.sub(r'{}'.format(regex), lambda m: m.group(group), text)
-        return re.sub(r'{}'.format(regex), r'{}'.format(replace), text) 
+            text, count = pattern.subn(lambda m: m.group(group), text)
+        else:
+            text, count = pattern.subn(replace, text)
+        self.stats.add('matches', count)
+        return text
     
-    def lambda_search_and_replace(self, regex : str, text : str, lambda_str : str) -> str:
-        """Regex search and replace with a lambda function."""
-        return re.sub(r'{}'.format(regex), lambda x: eval(lambda_str), text)
+    def lambda_search_and_replace(self, regex : str, text : str, lambda_str : Union[str, Callable[[re.Match], str]]) -> str:
+        """Regex search and replace with a lambda function, given either as a
+        callable or as an expression string in terms of the match `x`."""
+        text, count = self.compile(regex).subn(as_match_function(lambda_str), text)
+        self.stats.add('scans_regex')
+        self.stats.add('matches', count)
+        return text
     
-    def search(self, regex: str, text : str) -> int:
-        """Returns the number of matches found in the text."""
-        count = len(re.findall(r'{}'.format(regex), text))
-        return count 
+    def search(self, regex: str, text : str, max_count : int = None) -> int:
+        """Returns the number of matches found in the text, stopping the scan
+        after max_count matches if given."""
+        literal = literal_pattern(regex)
+        if literal is not None:
+            count = text.count(literal)
+            if max_count is not None:
+                count = min(count, max_count)
+            self.stats.add('scans_literal')
+        else:
+            count = sum(1 for _ in itertools.islice(self.compile(regex).finditer(text), max_count))
+            self.stats.add('scans_regex')
+        self.stats.add('matches', count)
+        return count
     
     def remove(self, regex : str, text : str) -> str:
         """Removes matches from a given text."""
-        return re.sub(r'{}'.format(regex), '', text) 
+        literal = literal_pattern(regex)
+        if literal is not None:
+            if self.stats:
+                self.stats.add('scans_literal')
+                self.stats.add('matches', text.count(literal))
+            return text.replace(literal, '')
+        text, count = self.compile(regex).subn('', text)
+        self.stats.add('scans_regex')
+        self.stats.add('matches', count)
+        return text
+    
+    @mutually_exclusive('replace', 'group', 'lambda_func')
+    def match_function(self, replace : str = None, group : int = 0, lambda_func : Union[str, Callable[[re.Match], str]] = None) -> Callable[[re.Match], str]:
+        """Returns a function giving the replacement for a match."""
+        if replace is not None:
+            return lambda m: m.expand(replace)
+        if lambda_func:
+            return as_match_function(lambda_func)
+        return lambda m: m.group(group) or ''
+    
+    @mutually_exclusive('replace', 'group', 'lambda_func')
+    def scan_and_replace(self, regex : str, text : str, replace : str = None, group : int = 0, lambda_func : Union[str, Callable[[re.Match], str]] = None) -> Tuple[str, List[re.Match], List[str]]:
+        """Substitutes regex matches in a single pass, returning the new text
+        along with the matches and their replacements for rendering."""
+        matches = list(self.compile(regex).finditer(text))
+        if replace is not None:
+            func = self.match_function(replace=replace)
+        elif lambda_func:
+            func = self.match_function(lambda_func=lambda_func)
+        else:
+            func = self.match_function(group=group)
+        pieces = [func(m) for m in matches]
+        self.stats.add('scans_regex')
+        self.stats.add('matches', len(matches))
+        return self.join_spans(text, matches, pieces), matches, pieces
+    
+    def iter_spans(self, regex : str, text : str, max_count : int = None) -> Iterator[Tuple[int, re.Match]]:
+        """Lazily yields the (line, match) of up to max_count matches in the
+        text, counting lines only up to each match as it is reached."""
+        line, position = 1, 0
+        for m in itertools.islice(self.compile(regex).finditer(text), max_count):
+            line += text.count('\n', position, m.start())
+            position = m.start()
+            yield line, m
+    
+    def may_match(self, regex : str, text : str) -> bool:
+        """Cheap check of whether the text contains the literals every match of
+        the regex requires. A False result means the regex cannot match."""
+        return may_contain(text, required_literals(regex))
+    
+    def join_spans(self, text : str, matches : List[re.Match], pieces : List[str]) -> str:
+        """Rebuilds the text with each match span substituted by its piece."""
+        if not matches:
+            return text
+        parts = []
+        last = 0
+        for m, piece in zip(matches, pieces):
+            parts.append(text[last:m.start()])
+            parts.append(piece)
+            last = m.end()
+        parts.append(text[last:])
+        return ''.join(parts)
+    
+    def colored_spans(self, text : str, matches : List[re.Match], pieces : List[str] = None, color = None) -> str:
+        """Returns the text with the match spans (or their replacement pieces)
+        colored, without scanning the text again."""
+        if pieces is None:
+            print_color = self.color_search if color is None else color
+            pieces = [m.group() for m in matches]
+        else:
+            print_color = self.color_replace if color is None else color
+        with self.stats.phase('render'):
+            return self.join_spans(text, matches, [self._colored(print_color, piece) for piece in pieces])
     
     def save_changes(self, mode : str) -> None:
         modes = ['inplace', 'copy']
@@ -40,8 +197,8 @@ class ReUtil:
         
     def remove_extra_whitespaces(self, text : str) -> str:
         """Removes extra whitespaces from a given text."""
-        text = re.sub(r'\s+', ' ', text.strip())
-        text = re.sub('[ ]([,|.|\)])', r'\1', text)
+        text = self.compile(r'\s+').sub(' ', text.strip())
+        text = self.compile('[ ]([,|.|\)])').sub(r'\1', text)
         return text
         
     def colored_search(self, regex : str, text : str, color = None) -> str:
@@ -49,126 +206,615 @@ class ReUtil:
         if color is not None and (len(color) != 3 or not all(isinstance(k, int) for k in color)):
             raise TypeError("Error: Color must be a list or tuple of three integers.")
         print_color = self.color_search if color is None else color
-        return re.sub(regex, lambda m: self._colored(print_color, m.group()), text)
+        with self.stats.phase('render'):
+            return self.compile(regex).sub(lambda m: self._colored(print_color, m.group()), text)
     
     @mutually_exclusive('replace', 'group', 'lambda_func')
-    def colored_replace(self, regex : str, text : str, replace : str = None, group : int = 0, lambda_func : str = None, color = None) -> str:
+    def colored_replace(self, regex : str, text : str, replace : str = None, group : int = 0, lambda_func : Union[str, Callable[[re.Match], str]] = None, color = None) -> str:
         """Returns a string with the regex substitutes colored."""
         if color is not None and (len(color) != 3 or not all(isinstance(k, int) for k in color)):
             raise TypeError("Error: Color must be a list or tuple of three integers.")
         print_color = self.color_replace if color is None else color
-        if lambda_func: 
-            return re.sub(regex, lambda x: self._colored(print_color, eval(lambda_func)), text)
-        if group > 0:
-            return re.sub(regex, lambda m: self._colored(print_color, m.group(group)), text)
-        return re.sub(regex, self._colored(print_color, replace), text)
+        pattern = self.compile(regex)
+        with self.stats.phase('render'):
+            if lambda_func: 
+                func = as_match_function(lambda_func)
+                return pattern.sub(lambda m: self._colored(print_color, func(m)), text)
+            if group > 0:
+                return pattern.sub(lambda m: self._colored(print_color, m.group(group)), text)
+            return pattern.sub(self._colored(print_color, replace), text)
             
     def _colored(self, values : List[int], text : str) -> str:
         """Returns a colored version of the string."""
         r, g, b = values[0], values[1], values[2]
         return "\033[38;2;{};{};{}m{}\033[m".format(r, g, b, text)
     
+    def ruleset(self, rules : Union[str, RuleSet, Iterable[Rule]]) -> RuleSet:
+        """Returns a RuleSet from a rules file, a RuleSet or (pattern, replacement) pairs."""
+        if isinstance(rules, RuleSet):
+            return rules
+        if isinstance(rules, str):
+            return RuleSet(load_rules(rules), name=rules)
+        return RuleSet(rules)
+    
+    def rule_hits(self, ruleset : RuleSet) -> List[int]:
+        """Returns the number of matches replaced by each rule so far."""
+        return [self.counters[('rule', ruleset.name, i)] for i in range(len(ruleset))]
+    
+    def print_rule_hits(self, ruleset : RuleSet) -> None:
+        hits = self.rule_hits(ruleset)
+        print("Rule hits ({}):".format(ruleset.name))
+        for rule, count in zip(ruleset.rules, hits):
+            print("  {:>8}  '{}' -> '{}'".format(count, rule.pattern, rule.replacement))
+        print(">> {} replacements by {}/{} rules.".format(sum(hits), sum(1 for count in hits if count), len(hits)))
+    
     def print_line_divider(self, char : str = '-') -> None:
         """Prints a divider based on the length of the terminal."""
         assert(len(char) == 1)
-        print(char*shutil.get_terminal_size().columns)
+        if self._columns is None:
+            self._columns = shutil.get_terminal_size().columns
+        print(char*self._columns)
     
 
+# Returned by TextUtil._read_file for files that cannot match any queued step.
+_SKIPPED = object()
+
 class TextUtil(ReUtil):
     
+    # Steps whose first argument is the regex they search for.
+    _REGEX_STEPS = {'_search_and_replace_text', '_remove_text', '_search_text', '_matches_text'}
+    # Final steps that can skip a file without reading it, and their result.
+    _SKIP_RESULTS = {'_search_text': 0, '_save_text': None, '_preview_text': None, '_matches_text': None}
+    # Steps that can be applied to a file in blocks.
+    _CHUNK_STEPS = {'_search_and_replace_text', '_remove_text', '_append_text'}
+    
     @mutually_exclusive('text', 'filenames')
-    def __init__(self, text : List[str]=[], filenames : Union[str, List[str]] = [], *args, **kwargs):
+    def __init__(self, text : List[str] = [], filenames : Union[str, List[str]] = [], stream : bool = False, jobs : int = 1,
+                 chunk_size : int = 0, max_match_length : int = 4096, line_mode : bool = False, cache : ResultCache = None,
+                 io_threads : int = 0, read_ahead : int = 64, write_behind : int = 64,
+                 context : int = None, list_matches : str = None, encoding : str = None,
+                 timeout : float = None, time_budget : float = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._started : float = time.monotonic()
         self.original_dir : str = None
         if type(filenames) is str and isdir(filenames):
             self.original_dir = filenames
-        self.original_filenames : List[str] = filenames
-        self.original_text : List[str] = text
-        self.text : List[str] = text
+        self.original_filenames : List[str] = list(filenames) if type(filenames) is list else filenames
+        self.original_text : List[str] = list(text)
+        self.text : List[str] = self.original_text
+        # In stream mode files are only read (and transformed) one at a time,
+        # so operations are queued until the texts are iterated or saved.
+        # Running with several jobs streams the files through a process pool.
+        # In chunked (or line) mode each file is also streamed in blocks (or
+        # lines), with matches (and their lookarounds) no longer than
+        # max_match_length characters.
+        self.jobs : int = max(1, jobs)
+        self.chunk_size : int = chunk_size
+        self.max_match_length : int = max_match_length
+        self.line_mode : bool = line_mode
+        self.chunked : bool = chunk_size > 0 or line_mode
+        # Search results of unmodified files are looked up in the cache
+        # instead of reading them, which needs files to be read on demand.
+        self.cache : ResultCache = cache
+        # With I/O threads, files are read ahead of (and written behind) the
+        # regex work, with at most read_ahead and write_behind files in memory.
+        self.io_threads : int = max(0, io_threads)
+        self.read_ahead : int = read_ahead
+        self.write_behind : int = write_behind
+        self._writer : Optional[concurrent.futures.Executor] = None
+        # In verbose mode, with a context only the lines with matches (and that
+        # many lines around them) are printed instead of whole files. Listing
+        # 'files' or 'count' prints only the files with matches or their counts.
+        if list_matches not in (None, 'files', 'count'):
+            raise Exception("Error: The listing {} is not valid. Input 'files' or 'count'.".format(list_matches))
+        self.context : Optional[int] = context
+        self.list_matches : Optional[str] = list_matches
+        # Files are read with this encoding unless they start with a byte order
+        # mark, whose encoding is then kept in encodings to write them back in.
+        # Files with a NUL byte in their first block are skipped as binary.
+        self.encoding : str = encoding or default_encoding()
+        self.encodings : dict = {}
+        # With a timeout (per file) or time budget (per run, from when the
+        # TextUtil is created), files are processed in worker processes that
+        # are killed when they run over, skipping their files.
+        self.timeout : Optional[float] = timeout
+        self.time_budget : Optional[float] = time_budget
+        self.stream : bool = (stream or self.jobs > 1 or self.chunked or cache is not None or self.io_threads > 0
+                              or timeout is not None or time_budget is not None) and len(filenames) > 0
+        self._pipeline : List[Tuple[str, tuple]] = []
+        # Whether a full pass over the files has run (and printed) the queued steps.
+        self._pipeline_shown : bool = False
+        self._deferring : bool = False
         if len(filenames) > 0:
-            self.original_filenames = iterate_files(filenames, search_subdirs=kwargs['search_subdirs']) if isdir(filenames) else [ filenames ]
-            to_remove = []
+            if type(filenames) is str:
+                with self.stats.phase('walk'):
+                    self.original_filenames = list(walk_files(filenames, **self.walk_options)) if isdir(filenames) else [ filenames ]
+            if self.shard is not None:
+                self.original_filenames = self.shard.select(self.original_filenames, self.original_dir)
             self.original_filenames.sort()
-            for filepath in self.original_filenames:
-                try:
-                    with open(filepath, 'r') as f:
-                        self.original_text.append(f.read())
-                except Exception as e:
-                    print("Error: Could not read file '{}'. Removing from search list.".format(filepath))
-                    to_remove.append(filepath)
-                    super().print_line_divider()
-            for file in to_remove:
-                self.original_filenames.remove(file)
-            self.text = self.original_text
+            if not self.stream:
+                readable = []
+                for filepath in self.original_filenames:
+                    txt = self._read_file(filepath)
+                    if txt is not None:
+                        readable.append(filepath)
+                        self.original_text.append(txt)
+                self.original_filenames = readable
+    
+    def engine(self, regex : str, replace : str = '') -> str:
+        # Blocks are always scanned with the compiled regex.
+        if self.chunked:
+            return 'regex'
+        return super().engine(regex, replace)
+    
+    def print_engine(self, regex : str, replace : str = '', search : bool = False) -> None:
+        # Matches shown in verbose mode are found with the compiled regex, to
+        # color them, unless a search only lists file names or counts.
+        if self.verbose:
+            engine = self.engine(regex, replace) if search and self.list_matches else 'regex'
+            print(">> Using the {} engine for '{}'.".format(engine, regex))
+    
+    def _write(self, text : str) -> None:
+        # Output of a file is written at once rather than line by line.
+        sys.stdout.write(text)
+    
+    def _write_count(self, filename : Optional[str], count : int) -> None:
+        self._write("{}{}\n".format(filename + ':' if filename else '', count))
+    
+    def _print_skipped_count(self, filename : Optional[str]) -> None:
+        """Prints a zero count for a file a step skipped because it cannot
+        match, so every file is listed with --count however it was skipped."""
+        if self.verbose and self.list_matches == 'count':
+            self._write_count(filename, 0)
+    
+    def _print_matches(self, filename : Optional[str], txt : str, matches : List[re.Match], pieces : List[str] = None) -> bool:
+        """Prints the matches of a step in the context or listing output modes,
+        returning False if the whole text is to be printed instead."""
+        if self.list_matches == 'count':
+            self._write_count(filename, len(matches))
+        elif self.list_matches == 'files':
+            if matches:
+                self._write("{}\n".format(filename))
+        elif self.context is not None:
+            with self.stats.phase('render'):
+                found = [self._colored(self.color_search, m.group()) for m in matches]
+                replaced = None if pieces is None else [self._colored(self.color_replace, piece) for piece in pieces]
+                out = render_context(filename, txt, [m.span() for m in matches], found, replaced, self.context)
+            self._write(out)
+        else:
+            return False
+        return True
+    
+    def _read_file(self, filepath : str, literals : Optional[List[Tuple[str, ...]]] = None, data : Union[bytes, OSError, None] = None) -> Union[str, None, object]:
+        """Returns the contents of a file, or None if it is binary or could not
+        be read. The encoding is told from the first block, so a binary file is
+        not read any further. If sets of required literals are given, the raw
+        bytes are checked first and _SKIPPED is returned when no set can be fully
+        present in the file. The raw bytes (or the error reading them) may be
+        given if already read."""
+        try:
+            with self.stats.phase('read'):
+                if data is None:
+                    with open(filepath, 'rb') as f:
+                        data = f.read(SNIFF_SIZE)
+                        encoding = sniff_encoding(data, self.encoding)
+                        if encoding is not None:
+                            data += f.read()
+                elif isinstance(data, OSError):
+                    raise data
+                else:
+                    encoding = sniff_encoding(data[:SNIFF_SIZE], self.encoding)
+                self.stats.add('bytes_read', len(data))
+                if encoding is None:
+                    self._skip_file(filepath, 'binary')
+                    return None
+                if literals is not None and ascii_compatible(encoding) and not any(may_contain(data, lits) for lits in literals):
+                    self.stats.add('files_prefiltered')
+                    return _SKIPPED
+                if encoding != self.encoding:
+                    self.encodings[filepath] = encoding
+                return decode(data, encoding)
+        except (OSError, UnicodeError, LookupError):
+            self._skip_file(filepath, 'unreadable')
+            return None
+    
+    def _skip_file(self, filepath : str, reason : str) -> None:
+        # Kept per file, as a file can be skipped once per pass over the files.
+        self.counters[('skipped', reason, filepath)] = 1
+        self.stats.add('files_' + reason)
+    
+    def skipped_files(self) -> collections.Counter:
+        """Returns the number of files skipped for each reason: 'binary',
+        'unreadable', or with a time limit 'timeout', 'budget' or 'failed'."""
+        return collections.Counter(key[1] for key in self.counters if key[0] == 'skipped')
+    
+    def print_skipped(self, top : int = 10) -> None:
+        """Prints how many files were skipped, if any, and the first few files
+        that ran over the timeout."""
+        skipped = self.skipped_files()
+        if skipped:
+            print(">> Skipped {} file(s): {}.".format(sum(skipped.values()), ', '.join("{} {}".format(count, reason) for reason, count in sorted(skipped.items()))))
+        timed_out = sorted(key[2] for key in self.counters if key[:2] == ('skipped', 'timeout'))
+        for filepath in timed_out[:top]:
+            print("  Timed out after {}s: '{}'".format(self.timeout, filepath))
+    
+    def _step_literals(self, final : Optional[Tuple[str, tuple]]) -> Optional[List[Tuple[str, ...]]]:
+        """Returns the literals required by each regex step queued for a file,
+        or None if the file has to be processed regardless of its contents."""
+        if final is None or final[0] not in self._SKIP_RESULTS:
+            return None
+        literals = []
+        for step, args in self._pipeline + [final]:
+            if step in self._REGEX_STEPS:
+                lits = required_literals(args[0])
+                if not lits:
+                    return None
+                literals.append(lits)
+            elif step == '_rules_text':
+                lits = args[0].required_literals()
+                if lits is None:
+                    return None
+                literals.extend(lits)
+            elif step not in self._SKIP_RESULTS:
+                return None
+        return literals
+    
+    def _apply(self, step : str, *args) -> Iterable[str]:
+        """Applies a per-file step (the name of a method called with `args`, the
+        text and the filename) to every text, or queues it in stream mode."""
+        if self.stream or self._deferring:
+            if self.chunked and step not in self._CHUNK_STEPS:
+                raise Exception("Error: This operation cannot be used in chunked or line mode.")
+            self._pipeline.append((step, args))
+            self._pipeline_shown = False
+            return self.iter_text()
+        filenames = self.original_filenames or [None]*len(self.text)
+        self.text = [self._run_steps([(step, args)], txt, filename) for txt, filename in zip(self.text, filenames)]
+        return self.text
+    
+    def _run_steps(self, steps : List[Tuple[str, tuple]], txt : str, filename : Optional[str]) -> str:
+        with self.stats.phase('regex', filename):
+            for step, args in steps:
+                txt = getattr(self, step)(*args, txt, filename)
+        return txt
+    
+    def _run_final(self, final : Tuple[str, tuple], original : str, txt : str, filename : Optional[str]) -> Any:
+        step, args = final
+        if step == '_save_text':
+            with self.stats.phase('save'):
+                return self._save_text(*args, original, txt, filename)
+        with self.stats.phase('regex', filename):
+            return getattr(self, step)(*args, original, txt, filename)
+    
+    def apply_plan(self, plan) -> 'TextUtil':
+        """Applies the operations of an OperationPlan, running the whole chain on
+        each file in one pass instead of one pass per operation."""
+        for name, kwargs in plan:
+            if name == 'search':
+                self._flush_pipeline()
+                self.search(**kwargs)
+                continue
+            self._deferring = True
+            try:
+                getattr(self, name)(**kwargs)
+            finally:
+                self._deferring = False
+        self._flush_pipeline()
+        return self
+    
+    def _flush_pipeline(self) -> None:
+        """Runs the queued steps over the loaded texts in a single pass. In
+        stream mode they stay queued until the files are read."""
+        if self.stream or not self._pipeline:
+            return
+        steps, self._pipeline = self._pipeline, []
+        filenames = self.original_filenames or [None]*len(self.text)
+        self.text = [self._run_steps(steps, txt, filename) for txt, filename in zip(self.text, filenames)]
+    
+    def _uses_cache(self, final : Optional[Tuple[str, tuple]]) -> bool:
+        return self.cache is not None and final is not None and final[0] == '_search_text' and not self._pipeline and not self.verbose
+    
+    def _reads_whole_files(self, final : Optional[Tuple[str, tuple]]) -> bool:
+        """Whether _process_file reads the whole file (which can then be read
+        ahead and passed to it) rather than streaming it or using the cache."""
+        return not self.chunked and not self._uses_cache(final)
+    
+    def _process_file(self, filepath : str, final : Optional[Tuple[str, tuple]] = None, data : Union[bytes, OSError, None] = None) -> Tuple[bool, Any]:
+        """Reads a file (unless its raw data is given) and runs the queued steps
+        on it, followed by the final step (which also receives the original
+        text). Returns (False, None) if the file could not be read."""
+        if self.chunked:
+            # Reading, regex work and writing are interleaved, so all count as regex time.
+            with self.stats.phase('regex', filepath):
+                return self._process_file_chunked(filepath, final)
+        if self._uses_cache(final):
+            return self._search_cached(filepath, *final[1])
+        original = self._read_file(filepath, self._step_literals(final), data)
+        if original is None:
+            return False, None
+        if original is _SKIPPED:
+            # None of the queued steps can match, so the file is left untouched.
+            if final[0] == '_save_text' and final[1][0] == 'copy':
+                return True, self._clone_copy(filepath, final[1][2])
+            for step, _ in self._pipeline + [final]:
+                if step in self._REGEX_STEPS - {'_matches_text'}:
+                    self._print_skipped_count(filepath)
+            return True, self._SKIP_RESULTS[final[0]]
+        txt = self._run_steps(self._pipeline, original, filepath)
+        if final is None:
+            return True, txt
+        return True, self._run_final(final, original, txt, filepath)
+    
+    def _search_cached(self, filepath : str, regex : str, max_count : int = None) -> Tuple[bool, Any]:
+        """Returns the number of matches (up to max_count) in an unmodified file
+        from the result cache, searching the file and caching all of its match
+        spans on a miss."""
+        entry = self.cache.get(filepath, regex, encoding=self.encoding)
+        if entry is not None:
+            count = entry[0] if max_count is None else min(entry[0], max_count)
+            self.stats.add('cache_hits')
+            self.stats.add('matches', count)
+            return True, count
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            st = None
+        txt = self._read_file(filepath)
+        if txt is None or st is None:
+            return False, None
+        with self.stats.phase('regex', filepath):
+            spans = [m.span() for m in self.compile(regex).finditer(txt)] if self.may_match(regex, txt) else []
+        self.cache.put(filepath, st, regex, spans, encoding=self.encoding)
+        count = len(spans) if max_count is None else min(len(spans), max_count)
+        self.stats.add('matches', count)
+        return True, count
+    
+    def _process_file_chunked(self, filepath : str, final : Optional[Tuple[str, tuple]] = None) -> Tuple[bool, Any]:
+        """Streams a file through the queued steps in blocks (or lines), so memory
+        use does not depend on the size of the file. Saved files are written to a
+        temporary file that replaces the target once complete."""
+        counters = []
+        try:
+            with open(filepath, 'rb') as f:
+                encoding = sniff_encoding(f.read(SNIFF_SIZE), self.encoding)
+            if encoding is None:
+                self._skip_file(filepath, 'binary')
+                return False, None
+            with open(filepath, 'r', encoding=encoding, errors=ERRORS) as f:
+                chunks = iter(f) if self.line_mode else read_chunks(f, self.chunk_size)
+                for step, args in self._pipeline:
+                    chunks = self._chunk_step(step, args, chunks, counters)
+                result = None
+                if final is None:
+                    result = ''.join(chunks)
+                elif final[0] == '_save_text':
+                    mode, fsync, link = final[1]
+                    path = self._save_path(filepath, mode)
+                    # A file with no matches (and nothing appended) is left untouched inplace, or linked as a copy.
+                    changed = lambda: any(step == '_append_text' for step, _ in self._pipeline) or any(c[2][0] for c in counters)
+                    size = write_atomic(path, chunks, like=filepath, fsync=fsync, commit=changed, encoding=encoding, errors=ERRORS)
+                    if size is not None:
+                        result = (path, size)
+                    elif mode == 'copy':
+                        result = self._clone_copy(filepath, link)
+                else:
+                    if final[0] == '_search_text':
+                        chunks = self._chunk_sub(final[1][0], lambda m: m.group(), chunks, counters, 'found')
+                    for _ in chunks:
+                        pass
+                    if final[0] == '_search_text':
+                        result = counters[-1][2][0] if final[1][1] is None else min(counters[-1][2][0], final[1][1])
+        except (OSError, UnicodeError, LookupError):
+            self._skip_file(filepath, 'unreadable')
+            return False, None
+        self.stats.add('matches', sum(counter[0] for _, _, counter in counters))
+        if self.verbose:
+            for regex, action, counter in counters:
+                print(">> {} matches to '{}' {} in '{}'.".format(counter[0], regex, action, filepath))
+        return True, result
+    
+    def _chunk_step(self, step : str, args : tuple, chunks : Iterator[str], counters : list) -> Iterator[str]:
+        """Returns the chunks with a queued step applied to them."""
+        if step == '_append_text':
+            return itertools.chain(chunks, ['\n' + args[0] + '\n'])
+        if step == '_remove_text':
+            return self._chunk_sub(args[0], '', chunks, counters, 'removed')
+        regex, replace, group, lambda_func = args
+        if replace is not None:
+            repl = replace
+        else:
+            repl = self.match_function(lambda_func=lambda_func) if lambda_func else self.match_function(group=group)
+        return self._chunk_sub(regex, repl, chunks, counters, 'replaced')
+    
+    def _chunk_sub(self, regex : str, repl, chunks : Iterator[str], counters : list, action : str) -> Iterator[str]:
+        counter = [0]
+        counters.append((regex, action, counter))
+        self.stats.add('scans_regex')
+        if self.line_mode:
+            return sub_lines(chunks, self.compile(regex), repl, counter)
+        return sub_chunks(chunks, self.compile(regex), repl, self.max_match_length, counter)
+    
+    def _map_files(self, final : Optional[Tuple[str, tuple]] = None) -> Iterator[Any]:
+        """Yields the result of the final step for each file in order, or the
+        modified text when no final step is given."""
+        if not self.stream:
+            filenames = self.original_filenames or [None]*len(self.text)
+            for filename, original, txt in zip(filenames, self.original_text, self.text):
+                if final is None:
+                    yield txt
+                else:
+                    yield self._run_final(final, original, txt, filename)
+            return
+        if self.timeout is not None or self.time_budget is not None:
+            deadline = self._started + self.time_budget if self.time_budget is not None else None
+            results = process_files_killable(self, self.original_filenames, final, self.jobs, self.timeout, deadline)
+        elif self.jobs > 1:
+            results = process_files(self, self.original_filenames, final, self.jobs)
+        elif self.io_threads > 0:
+            results = process_files_overlapped(self, self.original_filenames, final, self.io_threads, self.read_ahead, self.write_behind)
+        else:
+            results = (self._process_file(filepath, final) for filepath in self.original_filenames)
+        for ok, result in results:
+            if ok:
+                yield result
+        self._pipeline_shown = True
+    
+    def iter_text(self) -> Iterator[str]:
+        """Yields the (modified) text of each file one at a time."""
+        return self._map_files()
+    
+    def preview(self) -> None:
+        """Runs the queued operations without saving, printing their output.
+        Operations already print as they run outside of stream mode, or when a
+        pass over the files (e.g. a search) has already run them."""
+        if self.stream and self._pipeline and not self._pipeline_shown:
+            for _ in self._map_files(('_preview_text', ())):
+                pass
+    
+    def _preview_text(self, original : str, txt : str, filename : str) -> None:
+        return None
     
     @mutually_exclusive('replace', 'from_file', 'group', 'lambda_func')
-    def search_and_replace(self, regex : str, replace : str = None, from_file : str = None, group: int = -1, lambda_func: str = None) -> List[str]:
-        new_text = []
+    def search_and_replace(self, regex : str, replace : str = None, from_file : str = None, group: int = -1, lambda_func: Union[str, Callable[[re.Match], str]] = None) -> Iterable[str]:
         if from_file is not None:
             replace = get_file_contents(from_file)
-        for i, txt in enumerate(self.text):
-            if replace or from_file:
-                new = super().search_and_replace(regex, txt, replace=replace)
-                colored_replace = self.colored_replace(regex, txt, replace=replace)
-            elif lambda_func:
-                new = super().lambda_search_and_replace(regex, txt, lambda_func)
-                colored_replace = self.colored_replace(regex, txt, lambda_func=lambda_func)
-            else:
-                new = super().search_and_replace(regex, txt, group=group)
-                colored_replace = self.colored_replace(regex, txt, group=group)
-            if self.verbose:
-                if self.original_filenames:
-                    print("Search and replacing in '{}'...\n".format(self.original_filenames[i]))
-                colored_search = self.colored_search(regex, txt)
-                print(colored_search)
-                count = ReUtil().search(regex, txt)
-                print(">> {} matches found.".format(count))
-                print(colored_replace)
-                super().print_line_divider()
-            new_text.append(new)
-        self.text = new_text
-        return self.text
+        if lambda_func:
+            # Compiled (and cached) up front so a bad expression fails before any file is touched.
+            as_match_function(lambda_func)
+        self.print_engine(regex, replace)
+        return self._apply('_search_and_replace_text', regex, replace, group, lambda_func)
     
-    def search(self, regex : str) -> int:
+    def _search_and_replace_text(self, regex : str, replace : Optional[str], group : int, lambda_func : Union[str, Callable[[re.Match], str], None], txt : str, filename : Optional[str] = None) -> str:
+        if replace is not None:
+            kwargs = {'replace': replace}
+        elif lambda_func:
+            kwargs = {'lambda_func': lambda_func}
+        else:
+            kwargs = {'group': group}
+        if not self.may_match(regex, txt):
+            self._print_skipped_count(filename)
+            return txt
+        if not self.verbose:
+            if 'lambda_func' in kwargs:
+                return super().lambda_search_and_replace(regex, txt, lambda_func)
+            return super().search_and_replace(regex, txt, **kwargs)
+        new, matches, pieces = self.scan_and_replace(regex, txt, **kwargs)
+        if self._print_matches(filename, txt, matches, pieces):
+            return new
+        if filename is not None:
+            print("Search and replacing in '{}'...\n".format(filename))
+        print(self.colored_spans(txt, matches))
+        print(">> {} matches found.".format(len(matches)))
+        print(self.colored_spans(txt, matches, pieces))
+        super().print_line_divider()
+        return new
+    
+    def search(self, regex : str, max_count : int = None) -> int:
+        """Returns the number of matches in all texts, counting at most
+        max_count matches per file if given."""
         count = 0
-        for i, txt in enumerate(self.text):
-            searches = super().search(regex, txt)
-            if self.verbose:
-                if self.original_filenames:
-                    print("Searching in '{}'...\n".format(self.original_filenames[i]))
-                colored_search = self.colored_search(regex, txt)
-                print(colored_search)
-                super().print_line_divider()
+        files = 0
+        self.print_engine(regex, search=True)
+        for searches in self._map_files(('_search_text', (regex, max_count))):
             count += searches
-        if self.verbose and self.original_filenames:
-            print(">> {} matches found in {} file(s)".format(count, len(self.original_filenames)))
+            files += 1
+        if self.cache is not None:
+            self.cache.flush()
+        if self.verbose and self.list_matches == 'files':
+            print(">> {} file(s) with matches out of {}.".format(count, files))
+        elif self.verbose and self.original_filenames:
+            print(">> {} matches found in {} file(s)".format(count, files))
         else:
             print(">> {} total matches found.".format(count))
         return count
     
-    def remove(self, regex : str) -> List[str]:
+    def _search_text(self, regex : str, max_count : Optional[int], original : str, txt : str, filename : Optional[str] = None) -> int:
+        if not self.may_match(regex, txt) or max_count == 0:
+            self._print_skipped_count(filename)
+            return 0
+        if not self.verbose:
+            return super().search(regex, txt, max_count)
+        if self.list_matches == 'files':
+            # Scanning stops at the first match, and the file counts once.
+            literal = literal_pattern(regex)
+            found = literal in txt if literal is not None else self.compile(regex).search(txt) is not None
+            self.stats.add('scans_literal' if literal is not None else 'scans_regex')
+            if found:
+                self._write("{}\n".format(filename))
+            return int(found)
+        if self.list_matches == 'count':
+            count = super().search(regex, txt, max_count)
+            self._write_count(filename, count)
+            return count
+        matches = list(itertools.islice(self.compile(regex).finditer(txt), max_count))
+        self.stats.add('scans_regex')
+        self.stats.add('matches', len(matches))
+        if self._print_matches(filename, txt, matches):
+            return len(matches)
+        if filename is not None:
+            print("Searching in '{}'...\n".format(filename))
+        print(self.colored_spans(txt, matches))
+        super().print_line_divider()
+        return len(matches)
+    
+    def iter_matches(self, regex : str, max_count : int = None, max_total : int = None) -> Iterator[MatchRecord]:
+        """Lazily yields the matches in each text (after the queued operations)
+        as MatchRecords, at most max_count per file and max_total in all. In
+        stream mode files are read one at a time as the matches are consumed,
+        skipping files without the literals the regex needs, so no file past
+        the last match taken is read. Nothing is printed."""
+        if max_total is not None and max_total <= 0:
+            return
+        total = 0
+        for filename, txt in self._iter_texts(regex):
+            for line, m in self.iter_spans(regex, txt, max_count):
+                yield MatchRecord(filename, line, m.span(), m.groups())
+                total += 1
+                if max_total is not None and total >= max_total:
+                    return
+    
+    def _iter_texts(self, regex : str) -> Iterator[Tuple[Optional[str], str]]:
+        """Yields the filename and (modified) text of each file that may match
+        the regex, reading files on demand in stream mode."""
+        if not self.stream:
+            yield from zip(self.original_filenames or [None]*len(self.text), self.text)
+            return
+        final = None if self.chunked else ('_matches_text', (regex,))
+        for filepath in self.original_filenames:
+            ok, txt = self._process_file(filepath, final)
+            if ok and txt is not None:
+                yield filepath, txt
+    
+    def _matches_text(self, regex : str, original : str, txt : str, filename : Optional[str] = None) -> str:
+        return txt
+    
+    def remove(self, regex : str) -> Iterable[str]:
         """Returns a list of texts with the regex matches removed"""
-        new_text = []
         if self.verbose:
             print("Removing searches...")
-        for i, txt in enumerate(self.text):
-            if self.verbose and self.original_filenames:
-                print("Searching for matches to remove in '{}'...\n".format(self.original_filenames[i]))
-            new = super().remove(regex, txt)
-            count = super().search(regex, txt)
-            if self.verbose:
-                if count == 0:
-                    print("No matches to '{}' were found.".format(regex))
-                else:
-                    colored_search = self.colored_search(regex, txt)
-                    print(colored_search)
-                    print("  {} matches to be removed were found".format(count))
-                super().print_line_divider()
-            new_text.append(new)
-        self.text = new_text
-        return self.text
+        self.print_engine(regex)
+        return self._apply('_remove_text', regex)
+    
+    def _remove_text(self, regex : str, txt : str, filename : Optional[str] = None) -> str:
+        if not self.may_match(regex, txt):
+            self._print_skipped_count(filename)
+            return txt
+        if not self.verbose:
+            return super().remove(regex, txt)
+        new, matches, _ = self.scan_and_replace(regex, txt, replace='')
+        if self._print_matches(filename, txt, matches):
+            return new
+        if filename is not None:
+            print("Searching for matches to remove in '{}'...\n".format(filename))
+        if len(matches) == 0:
+            print("No matches to '{}' were found.".format(regex))
+        else:
+            print(self.colored_spans(txt, matches))
+            print("  {} matches to be removed were found".format(len(matches)))
+        super().print_line_divider()
+        return new
 
-    def append(self, content : str, is_file : bool=False) -> List[str]:
+    def append(self, content : str, is_file : bool=False) -> Iterable[str]:
         """Appends content to the end of each file. Given either a string to
         append or a path to a file with contents to append."""
         if self.verbose:
@@ -178,100 +824,165 @@ class TextUtil(ReUtil):
                 print("Appending text to the end of each file...")
         if is_file:
             content = get_file_contents(content)
-        
-        new_text = []
-        for i, txt in enumerate(self.text):
-            if self.verbose:
-                if self.original_filenames:
-                    print("Appending to '{}'...\n".format(self.original_filenames[i]))
-                print(txt)
-                colored_append = self.colored_search(".*", content, color=[0,255,0])
-                print(colored_append + '\n')
-                super().print_line_divider()
-            txt += '\n' + content + '\n'
-            new_text.append(txt)
-        self.text = new_text
-        return self.text
+        return self._apply('_append_text', content)
+    
+    def _append_text(self, content : str, txt : str, filename : Optional[str] = None) -> str:
+        if self.verbose and self.list_matches:
+            self._write("{}\n".format(filename))
+        elif self.verbose and self.context is not None:
+            lines = txt.count('\n') + 1
+            appended = ["{}+{}".format(lines + n + 1, self._colored(self.color_replace, line)) for n, line in enumerate(content.split('\n'))]
+            self._write('\n'.join([filename or ''] + appended) + '\n')
+        elif self.verbose:
+            if filename is not None:
+                print("Appending to '{}'...\n".format(filename))
+            print(txt)
+            colored_append = self.colored_search(".*", content, color=[0,255,0])
+            print(colored_append + '\n')
+            super().print_line_divider()
+        return txt + '\n' + content + '\n'
     
-    def save_changes(self, mode : str = 'inplace') -> None:
-        """Saves content changes to original files, or to a copy of the file(s)."""
+    def save_changes(self, mode : str = 'inplace', fsync : bool = False, link : str = 'auto') -> Optional[dict]:
+        """Saves content changes to original files, or to a copy of the file(s).
+        Files are written atomically, and unchanged files are skipped when saving
+        inplace. As a copy, only changed files are written, and unchanged files
+        are linked to the originals (see utils.clone_file for the link methods).
+        With fsync, each file is flushed to disk before it replaces the original
+        and each directory written to is synced once at the end. Returns the
+        number of files written, linked and skipped, the bytes of each, and the
+        paths written or linked."""
         super().save_changes(mode)
         if len(self.original_filenames) == 0:
             print("No files to save changes to.")
-            return
-        if len(self.original_filenames) != len(self.text):
+            return None
+        if not self.stream and len(self.original_filenames) != len(self.text):
             raise Exception("Error! Length of original and modified files are not the same.")
         
-        if mode == 'inplace':
-            for i in range(0, len(self.original_text)):
-                with open(self.original_filenames[i], 'w') as f:
-                    f.write(self.text[i])
-            if self.verbose:
+        if mode == 'copy' and self.original_dir:
+            make_directories(os.path.dirname(self._save_path(filepath, mode)) for filepath in self.original_filenames)
+        report = {'written': 0, 'skipped': 0, 'bytes': 0, 'linked': 0, 'linked_bytes': 0, 'paths': []}
+        directories = set()
+        for result in self._map_files(('_save_text', (mode, fsync, link))):
+            if result is None:
+                report['skipped'] += 1
+                continue
+            path, size = result[:2]
+            report['paths'].append(path)
+            if fsync:
+                # The directory of the file actually replaced, for symlinked paths.
+                directories.add(os.path.dirname(os.path.realpath(path)))
+            if len(result) > 2:
+                report['linked'] += 1
+                report['linked_bytes'] += size
+                self.stats.add('bytes_linked', size)
+                continue
+            report['written'] += 1
+            report['bytes'] += size
+            self.stats.add('bytes_written', size)
+        if fsync:
+            for directory in directories:
+                fsync_directory(directory)
+        self.save_report = report
+        
+        if self.verbose:
+            if mode == 'inplace':
                 print("Changes saved inplace.")
-
-        if mode == 'copy':
-            if self.original_dir:
-                from pathlib import Path
-                
-                new_dir = self.original_dir + "_copy"
-                
-                for i, original_path in enumerate(self.original_filenames):
-                    subdirs, filename = get_subdir_and_file_from_dir(original_path, self.original_dir)
-                    dir_path = os.path.join(new_dir, *subdirs)
-                    Path(dir_path).mkdir(parents=True, exist_ok=True)
-                    with open(os.path.join(dir_path, filename), 'w') as f:
-                        f.write(self.text[i])
-                if self.verbose:
-                    print("Changes saved as files in a new directory '{}'".format(dir_path))
+            elif self.original_dir:
+                print("Changes saved as files in a new directory '{}'".format(self.original_dir + "_copy"))
             else:
-                for i, original_path in enumerate(self.original_filenames):
-                    head, tail, ext = split_fullpath(original_path)
-                    tail += "_copy"
-                    new_path = os.path.join(head, tail + ext)
-                    with open(new_path, 'w') as f:
-                        f.write(self.text[i])
-                if self.verbose:
-                    print("Changes saved as new files.")
+                print("Changes saved as new files.")
+            if mode == 'copy':
+                print(">> {} file(s) written ({} bytes), {} unchanged file(s) linked ({} bytes).".format(report['written'], report['bytes'], report['linked'], report['linked_bytes']))
+            else:
+                print(">> {} file(s) written ({} bytes), {} unchanged file(s) skipped.".format(report['written'], report['bytes'], report['skipped']))
+        return report
+    
+    def _save_text(self, mode : str, fsync : bool, link : str, original : str, txt : str, filename : str) -> Union[Tuple[str, int], Tuple[str, int, str], None]:
+        """Writes a file's text, returning its path and size, or None if it was
+        saved inplace unchanged and so not written. An unchanged copy is linked
+        instead, returning its path, size and link method."""
+        if txt == original:
+            return self._clone_copy(filename, link) if mode == 'copy' else None
+        path = self._save_path(filename, mode)
+        # Written back in the encoding the file was read with.
+        encoding = self.encodings.get(filename, self.encoding)
+        if self._writer is not None:
+            # Written behind by the I/O threads, see overlapped.process_files.
+            return path, self._writer.submit(write_atomic, path, [txt], like=filename, fsync=fsync, encoding=encoding, errors=ERRORS)
+        return path, write_atomic(path, [txt], like=filename, fsync=fsync, encoding=encoding, errors=ERRORS)
+    
+    def _clone_copy(self, filename : str, link : str) -> Tuple[str, int, str]:
+        path = self._save_path(filename, 'copy')
+        method = clone_file(filename, path, link)
+        return path, os.path.getsize(path), method
+    
+    def _save_path(self, original_path : str, mode : str) -> str:
+        """Returns the path the modified text of a file is saved to. Directories
+        of a copy are created up front by save_changes."""
+        if mode == 'inplace':
+            return original_path
+        if self.original_dir:
+            new_dir = self.original_dir + "_copy"
+            subdirs, filename = get_subdir_and_file_from_dir(original_path, self.original_dir)
+            return os.path.join(new_dir, *subdirs, filename)
+        head, tail, ext = split_fullpath(original_path)
+        tail += "_copy"
+        return os.path.join(head, tail + ext)
+    
+    def apply_rules(self, rules : Union[str, RuleSet, Iterable[Rule]]) -> Iterable[str]:
+        """Applies many (pattern, replacement) rules in order, scanning each text
+        once per group of independent rules. Hits per rule are kept in counters."""
+        ruleset = self.ruleset(rules)
+        if self.verbose:
+            print("Applying {} rules in {} scan(s)...".format(len(ruleset), len(ruleset.groups)))
+        return self._apply('_rules_text', ruleset)
     
-    def remove_extra_whitespaces(self) -> str:
+    def _rules_text(self, ruleset : RuleSet, txt : str, filename : Optional[str] = None) -> str:
+        new, hits = ruleset.apply(txt)
+        self.stats.add('matches', sum(hits))
+        for i, count in enumerate(hits):
+            if count:
+                self.counters[('rule', ruleset.name, i)] += count
+        if self.verbose and filename is not None and any(hits):
+            print(">> {} replacements by {} rule(s) in '{}'.".format(sum(hits), sum(1 for count in hits if count), filename))
+        return new
+    
+    def remove_extra_whitespaces(self) -> Iterable[str]:
         """Removes redundant whitespaces (leading, trailing, and spaces before a period, comma or bracket)."""
         if self.verbose:
             print("Removing extra whitespaces...")
-        new_text = []
-        for txt in self.text:
-            new_text.append(super().remove_extra_whitespaces(txt))
-        self.text = new_text
-        return self.text
+        return self._apply('_remove_extra_whitespaces_text')
+    
+    def _remove_extra_whitespaces_text(self, txt : str, filename : Optional[str] = None) -> str:
+        return super().remove_extra_whitespaces(txt)
     
     # CUSTOM TEXT FUNCTIONS
     
-    def strip_markdown_links(self) -> List[str]:
+    def strip_markdown_links(self) -> Iterable[str]:
         """Returns the text with stripped markdown links replaced with the link name."""
+        if self.verbose:
+            print("Stripping markdown links in text...")
+        return self._apply('_strip_markdown_links_text')
+    
+    def _strip_markdown_links_text(self, txt : str, filename : Optional[str] = None) -> str:
         link_name = "[\[]?[^\[^\]]+[\]]?"
         link_url = "http[s]?://[^\)]+"
-        mdlink_regex = f"\[{link_name}]\({link_url}\)"
         mdlink_parts_regex = f"\[({link_name})]\(({link_url})\)"
         
-        new_text = []
-        if self.verbose:
-            print("Stripping markdown links in text...")
-        for i, txt in enumerate(self.text):
-            new = super().search_and_replace(mdlink_parts_regex, txt, group=1)
-            count = ReUtil().search(mdlink_regex, txt)
-            if self.verbose:
-                if self.original_filenames:
-                    print("Searching '{}'...".format(self.original_filenames[i]))
-                if count == 0:
-                    print("No links were found.")
-                else:
-                    colored_search = self.colored_search(mdlink_parts_regex, txt)
-                    colored_replace = self.colored_replace(mdlink_parts_regex, txt, group=1)
-                    print(colored_search)
-                    print("  {} link(s) found".format(count))
-                    print(colored_replace,'\n')
-            new_text.append(new)
-        self.text = new_text
-        return self.text
+        if not self.verbose:
+            return super().search_and_replace(mdlink_parts_regex, txt, group=1)
+        new, matches, pieces = self.scan_and_replace(mdlink_parts_regex, txt, group=1)
+        if self._print_matches(filename, txt, matches, pieces):
+            return new
+        if filename is not None:
+            print("Searching '{}'...".format(filename))
+        if len(matches) == 0:
+            print("No links were found.")
+        else:
+            print(self.colored_spans(txt, matches))
+            print("  {} link(s) found".format(len(matches)))
+            print(self.colored_spans(txt, matches, pieces),'\n')
+        return new
 
 
 class FilenameUtil(ReUtil):
@@ -280,75 +991,128 @@ class FilenameUtil(ReUtil):
     def __init__(self, path : str = None, pathnames : List[str] = [], *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.path = path
-        self.original_pathnames : List[str] = pathnames
-        self.pathnames : List[str] = pathnames
+        # Operations only change the stems of the paths, see paths.PathTable.
+        self.table : PathTable = PathTable(self.shard.select(pathnames, None) if self.shard is not None else pathnames)
         if path is not None:
-            self.original_pathnames = iterate_files(path, search_subdirs=kwargs['search_subdirs']) if isdir(path) else [path]
-            self.original_pathnames.sort()
-            self.pathnames = self.original_pathnames
+            with self.stats.phase('walk'):
+                paths = list(walk_files(path, **self.walk_options)) if isdir(path) else [path]
+            if self.shard is not None:
+                paths = self.shard.select(paths, path if isdir(path) else None)
+            paths.sort()
+            self.table = PathTable(paths)
+    
+    @property
+    def original_pathnames(self) -> List[str]:
+        """The original paths, built from the path table. Setting them starts
+        over from the given paths, with no changes."""
+        return list(self.table.originals())
+    
+    @original_pathnames.setter
+    def original_pathnames(self, paths : List[str]) -> None:
+        self.table = PathTable(paths)
+    
+    @property
+    def pathnames(self) -> List[str]:
+        """The modified paths, built from the path table. Setting them changes
+        the name of each file, which must keep its directory and extension."""
+        return list(self.table)
+    
+    @pathnames.setter
+    def pathnames(self, paths : List[str]) -> None:
+        if len(paths) != len(self.table):
+            raise Exception("Error! Length of original and modified filenames are not the same.")
+        for i, path in enumerate(paths):
+            head, tail, ext = split_fullpath(path)
+            if head != self.table.directory(i) or ext != self.table.exts[i]:
+                raise Exception("Error: '{}' is not '{}' renamed within its directory and with its extension.".format(path, self.table.original(i)))
+            self.table.set_stem(i, tail)
+    
+    def apply_plan(self, plan) -> 'FilenameUtil':
+        """Applies the operations of an OperationPlan in order."""
+        for name, kwargs in plan:
+            getattr(self, name)(**kwargs)
+        return self
+    
+    def _print_path(self, i : int, colored_tail : str) -> str:
+        return os.path.join(self.table.directory(i), colored_tail + self.table.exts[i])
     
     @mutually_exclusive('replace', 'from_file', 'group', 'lambda_func')
-    def search_and_replace(self, regex : str, replace : str = None, from_file : str = None, group : int = 0, lambda_func : str = None) -> List[str]:
-        """Substitutes regex searches with a string replacement, returning a list of new pathnames."""
-        new_names = []
+    def search_and_replace(self, regex : str, replace : str = None, from_file : str = None, group : int = 0, lambda_func : Union[str, Callable[[re.Match], str]] = None) -> PathView:
+        """Substitutes regex searches with a string replacement, returning the new pathnames."""
         files_changed = 0
         if from_file is not None:
             replace = get_file_contents(from_file)
-        for path in self.pathnames:
-            head, tail, ext = split_fullpath(path)
+        if lambda_func:
+            lambda_func = as_match_function(lambda_func)
+        self.print_engine(regex, replace)
+        for i, tail in enumerate(self.table.current_stems()):
             if replace or from_file:
                 new_tail = super().search_and_replace(regex, tail, replace=replace)
-                colored_replace = os.path.join(head, self.colored_replace(regex,tail,replace=replace)+ext)
             elif lambda_func:
                 new_tail = super().lambda_search_and_replace(regex, tail, lambda_str=lambda_func)
-                colored_replace = os.path.join(head, self.colored_replace(regex,tail,lambda_func=lambda_func)+ext)
             else:
                 new_tail = super().search_and_replace(regex, tail, group=group)
-                colored_replace = os.path.join(head, self.colored_replace(regex,tail,group=group)+ext)
             if new_tail != tail:
                 files_changed += 1
-            colored_search = os.path.join(head, self.colored_search(regex,tail)+ext)
+                self.table.set_stem(i, new_tail)
             if self.verbose:
+                if replace or from_file:
+                    colored_replace = self._print_path(i, self.colored_replace(regex, tail, replace=replace))
+                elif lambda_func:
+                    colored_replace = self._print_path(i, self.colored_replace(regex, tail, lambda_func=lambda_func))
+                else:
+                    colored_replace = self._print_path(i, self.colored_replace(regex, tail, group=group))
+                colored_search = self._print_path(i, self.colored_search(regex, tail))
                 if colored_search == colored_replace:
                     print(colored_search)
                 else:
                     print("{} ==> {}".format(colored_search, colored_replace))
-            new_names.append(os.path.join(head, new_tail+ext))
         if self.verbose:
-            print("  Changes in {}/{} filenames.".format(files_changed, len(self.pathnames)))
-        self.pathnames = new_names
-        return self.pathnames
+            print("  Changes in {}/{} filenames.".format(files_changed, len(self.table)))
+        return PathView(self.table)
     
-    def search(self, regex : str) -> int:
-        """Returns number of regex matches in the names."""
+    def search(self, regex : str, max_count : int = None) -> int:
+        """Returns number of regex matches in the names, counting at most
+        max_count per name if given."""
         count = 0
-        for path in self.pathnames:
-            head, tail, ext = split_fullpath(path)
-            # matches, colored_search = super().search(regex, tail)
-            matches = super().search(regex, tail)
+        self.print_engine(regex)
+        for i, tail in enumerate(self.table.current_stems()):
+            matches = super().search(regex, tail, max_count)
             if self.verbose:
-                colored_search = self.colored_search(regex, tail)
-                print(os.path.join(head,colored_search+ext))
+                print(self._print_path(i, self.colored_search(regex, tail)))
             count += matches
         if self.verbose:
-            print(">> {} matches found in {} filename(s).".format(count, len(self.pathnames)))
+            print(">> {} matches found in {} filename(s).".format(count, len(self.table)))
         return count
     
-    def remove(self, regex : str) -> List[str]:
-        """Returns a list of new pathnames with the regex search removed."""
-        new_names = []
-        for path in self.pathnames:
-            head, tail, ext = split_fullpath(path)
+    def iter_matches(self, regex : str, max_count : int = None, max_total : int = None) -> Iterator[MatchRecord]:
+        """Lazily yields the matches in the names (without their directory or
+        extension) as MatchRecords, at most max_count per name and max_total in
+        all. Nothing is printed."""
+        if max_total is not None and max_total <= 0:
+            return
+        total = 0
+        pattern = self.compile(regex)
+        for i, tail in enumerate(self.table.current_stems()):
+            for m in itertools.islice(pattern.finditer(tail), max_count):
+                yield MatchRecord(self.table.path(i), None, m.span(), m.groups())
+                total += 1
+                if max_total is not None and total >= max_total:
+                    return
+    
+    def remove(self, regex : str) -> PathView:
+        """Returns the new pathnames with the regex search removed."""
+        self.print_engine(regex)
+        for i, tail in enumerate(self.table.current_stems()):
             tail = super().remove(regex, tail)
             if self.verbose:
                 print("To be removed...")
                 colored_search = self.colored_search(regex, tail)
-                print(os.path.join(head, colored_search+ext))
-            new_names.append(os.path.join(head,tail+ext))
-        self.pathnames = new_names
-        return self.pathnames
+                print(self._print_path(i, colored_search))
+            self.table.set_stem(i, tail)
+        return PathView(self.table)
     
-    def append(self, content : str, is_file : bool=False) -> List[str]:
+    def append(self, content : str, is_file : bool=False) -> PathView:
         """Appends content to the end of the filenames."""
         if self.verbose:
             if is_file:
@@ -358,60 +1122,88 @@ class FilenameUtil(ReUtil):
         if is_file:
             content = get_file_contents(content)
             
-        new_names = []
-        for path in self.pathnames:
-            head, tail, ext = split_fullpath(path)
-            new_name = tail+content+ext
-            content_copy = content
+        for i, tail in enumerate(self.table.current_stems()):
+            ext = self.table.exts[i]
+            new_tail = tail+content
             # Checks if filename is too long
-            if len(new_name) > 255:
+            if len(new_tail+ext) > 255:
                 warning_txt = "WARNING: Filename exceeds 255 characters and has been truncated."
                 print(super()._colored([255,0,0], warning_txt))
-                content = content[:255-len(tail)-len(ext)]
-                new_name = tail+content+ext
+                new_tail = tail+content[:255-len(tail)-len(ext)]
             if self.verbose:
-                colored_append = self.colored_search(".*", content, color=[0,255,0])
-                print(os.path.join(head, tail+colored_append+ext))
-            new_names.append(os.path.join(head, new_name))
-            content = content_copy
-        self.pathnames = new_names
-        return self.pathnames
-    
-    def save_changes(self, mode : str = 'inplace') -> None:
-        """Saves the filename changes inplace (renames input paths), or creates a copy."""
+                colored_append = self.colored_search(".*", new_tail[len(tail):], color=[0,255,0])
+                print(self._print_path(i, tail+colored_append))
+            self.table.set_stem(i, new_tail)
+        return PathView(self.table)
+    
+    def apply_rules(self, rules : Union[str, RuleSet, Iterable[Rule]]) -> PathView:
+        """Applies many (pattern, replacement) rules in order to the filenames."""
+        ruleset = self.ruleset(rules)
+        for i, tail in enumerate(self.table.current_stems()):
+            new_tail, hits = ruleset.apply(tail)
+            for k, count in enumerate(hits):
+                if count:
+                    self.counters[('rule', ruleset.name, k)] += count
+            if new_tail != tail:
+                if self.verbose:
+                    print("{} ==> {}".format(self.table.path(i), self._print_path(i, new_tail)))
+                self.table.set_stem(i, new_tail)
+        return PathView(self.table)
+    
+    def save_changes(self, mode : str = 'inplace', journal : str = None, threads : int = 1, on_conflict : str = 'error', link : str = 'auto') -> None:
+        """Saves the filename changes inplace (renames input paths), or creates a copy.
+        Renames are planned up front, see rename.RenamePlan, so a conflict stops
+        the run before any file is renamed (or is skipped with on_conflict='skip'),
+        and chains or cycles of renames never overwrite each other. With a journal
+        file, an interrupted run can be resumed or rolled back. Copies are linked
+        to the originals where possible, see utils.clone_file, and unchanged names
+        are skipped when copying beside the originals."""
         super().save_changes(mode)
-        if len(self.original_pathnames) != len(self.pathnames):
-            raise Exception("Error! Length of original and modified filenames are not the same.")
         
-        if mode is 'inplace':
-            for i in range(0, len(self.original_pathnames)):
-                os.rename(self.original_pathnames[i], self.pathnames[i])
+        if mode == 'inplace':
+            with self.stats.phase('save'):
+                # Only the changed names are planned, unchanged files stay where they are.
+                changes = list(self.table.changes())
+                plan = RenamePlan([source for source, _ in changes], [target for _, target in changes], on_conflict=on_conflict)
+                for source, target, reason in plan.conflicts:
+                    print("Warning: Skipped renaming '{}' to '{}' ({}).".format(source, target, reason))
+                plan.execute(journal=journal, threads=threads, verbose=self.verbose)
             if self.verbose:
                 print("Changes saved inplace.")
+                print(">> {} file(s) renamed, {} conflict(s) skipped.".format(plan.files, len(plan.conflicts)))
         
-        if mode is 'copy':
+        if mode == 'copy':
+            table = self.table
             if self.path and isdir(self.path):
-                from pathlib import Path
                 new_dir = self.path + '_copy'
-                for original_path, new_path in zip(self.original_pathnames, self.pathnames):
-                    subdirs, filename = get_subdir_and_file_from_dir(new_path, self.path)
-                    dir_path = os.path.join(new_dir, *subdirs)
-                    Path(dir_path).mkdir(parents=True, exist_ok=True)
-                    shutil.copyfile(original_path, os.path.join(dir_path, filename))
-                if self.verbose:
-                    print("Changes saved in a copy of the original directory '{}'".format(new_dir))
+                # The copy of each directory is worked out once for all of its files.
+                dirs = []
+                for directory in table.dirs:
+                    subdirs, _ = get_subdir_and_file_from_dir(os.path.join(directory, ''), self.path)
+                    dirs.append(os.path.join(new_dir, *subdirs))
+                make_directories(dirs[dir_id] for dir_id in set(table.dir_ids))
             else:
-                for original_path, new_path in zip(self.original_pathnames, self.pathnames):
-                    shutil.copyfile(original_path, new_path)
-                if self.verbose:
+                dirs = table.dirs
+            methods = collections.Counter()
+            with self.stats.phase('save'):
+                for i in range(len(table)):
+                    target = os.path.join(dirs[table.dir_ids[i]], table.stem(i) + table.exts[i])
+                    if same_entry(table.original(i), target):
+                        # An unchanged name copied beside the original is the original itself.
+                        methods['skipped'] += 1
+                        continue
+                    methods[clone_file(table.original(i), target, link)] += 1
+            if self.verbose:
+                if self.path and isdir(self.path):
+                    print("Changes saved in a copy of the original directory '{}'".format(new_dir))
+                else:
                     print("Changes saved as a copy.")
+                print(">> {} file(s) linked and {} copied, {} unchanged file(s) skipped.".format(methods['reflink'] + methods['hardlink'], methods['copy'], methods['skipped']))
                     
-    def remove_extra_whitespaces(self) -> str:
+    def remove_extra_whitespaces(self) -> PathView:
         """Removes extra whitespaces from the filenames."""
         if self.verbose:
             print("Removing extra whitespaces from the filenames...")
-        new_names = []
-        for filename in self.pathnames:
-            new_names.append(super().remove_extra_whitespaces(filename))
-        self.pathnames = new_names
-        return self.pathnames
\ No newline at end of file
+        for i, tail in enumerate(self.table.current_stems()):
+            self.table.set_stem(i, super().remove_extra_whitespaces(tail))
+        return PathView(self.table)
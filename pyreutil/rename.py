@@ -0,0 +1,267 @@
+import concurrent.futures
+import json
+import os
+import threading
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+JOURNAL_VERSION = 1
+
+def _key(path : str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+def _temp_path(path : str) -> str:
+    head, tail = os.path.split(path)
+    return os.path.join(head, '.{}.{}.rename'.format(tail, os.urandom(4).hex()))
+
+class RenamePlan:
+    """Plans a bulk rename of sources to targets so that no file is clobbered.
+    Two sources renamed to the same target, and targets that are existing files
+    not being renamed themselves, are conflicts: they raise an exception, or
+    with on_conflict='skip' the conflicting sources are left as they are.
+
+    The renames are split into independent units, one per chain (a->b while
+    b->c) or cycle (a->b while b->a) of renames. The renames of a unit are
+    ordered so each target is free when renamed to, with a cycle going through
+    a temporary name. Units run in batches, optionally across threads, and a
+    journal records the plan and each rename before it is made, so an
+    interrupted run can be resumed or rolled back."""
+
+    def __init__(self, sources : Iterable[str], targets : Iterable[str], on_conflict : str = 'error', exists = os.path.lexists):
+        if on_conflict not in ('error', 'skip'):
+            raise Exception("Error: The conflict mode {} is not valid. Input 'error' or 'skip'.".format(on_conflict))
+        self.conflicts : List[Tuple[str, str, str]] = []
+        # The number of files renamed, not counting moves to temporary names.
+        self.files : int = 0
+        self.units : List[List[Tuple[str, str]]] = []
+        renames = {}
+        paths = {}
+        for source, target in zip(sources, targets):
+            key, target_key = _key(source), _key(target)
+            if key != target_key:
+                renames[key] = target_key
+                paths[key], paths[target_key] = source, target
+        self._paths : Dict[str, str] = paths
+        self._resolve_conflicts(renames, exists, on_conflict)
+        self.files = len(renames)
+        self._order(renames)
+
+    def __len__(self) -> int:
+        return sum(len(unit) for unit in self.units)
+
+    def __iter__(self):
+        for unit in self.units:
+            yield from unit
+
+    def _resolve_conflicts(self, renames : Dict[str, str], exists, on_conflict : str) -> None:
+        """Finds renames whose target is taken, dropping them in skip mode. A
+        dropped rename keeps its source in place, which can make other renames
+        to that path conflict in turn."""
+        sources_of = {}
+        for source, target in renames.items():
+            sources_of.setdefault(target, []).append(source)
+        queue = []
+        for target, sources in sources_of.items():
+            if len(sources) > 1:
+                queue.extend((source, 'duplicate target') for source in sources)
+            elif target not in renames and exists(self._paths[target]):
+                queue.append((sources[0], 'target exists'))
+        dropped = set()
+        while queue:
+            source, reason = queue.pop()
+            if source in dropped:
+                continue
+            self.conflicts.append((self._paths[source], self._paths[renames[source]], reason))
+            dropped.add(source)
+            # Whatever was to be renamed to this source now finds it occupied.
+            queue.extend((other, 'target exists') for other in sources_of.get(source, []) if other not in dropped)
+        if self.conflicts and on_conflict == 'error':
+            lines = "\n".join("  '{}' -> '{}' ({})".format(*conflict) for conflict in self.conflicts[:20])
+            raise Exception("Error: {} rename conflict(s), no files were renamed:\n{}".format(len(self.conflicts), lines))
+        for source in dropped:
+            del renames[source]
+
+    def _order(self, renames : Dict[str, str]) -> None:
+        """Splits the renames into units of ordered renames. Each target is the
+        target of one source only, so the renames form disjoint chains, which
+        are run from their free end, and cycles, which are broken with a
+        temporary name. Runs in O(n)."""
+        incoming = {target: source for source, target in renames.items()}
+        done = set()
+        for source, target in renames.items():
+            if target in renames or source in done:
+                continue
+            # The end of a chain: walk back towards its start.
+            unit = []
+            while source is not None:
+                unit.append((self._paths[source], self._paths[target]))
+                done.add(source)
+                source, target = incoming.get(source), source
+            self.units.append(unit)
+        for start in renames:
+            if start in done:
+                continue
+            temp = _temp_path(self._paths[start])
+            unit = [(self._paths[start], temp)]
+            done.add(start)
+            source, target = incoming[start], start
+            while source != start:
+                unit.append((self._paths[source], self._paths[target]))
+                done.add(source)
+                source, target = incoming[source], source
+            unit.append((temp, self._paths[renames[start]]))
+            self.units.append(unit)
+
+    def execute(self, journal : str = None, threads : int = 1, batch_size : int = 1000, verbose : bool = False) -> int:
+        """Makes the renames, returning how many were made. With a journal, the
+        plan is written to it first so the run can be resumed or rolled back."""
+        writer = RenameJournal.create(journal, self.units) if journal else None
+        count = _run_units(list(enumerate(self.units)), writer, threads, batch_size, verbose)
+        if writer is not None:
+            writer.close(complete=True)
+        return count
+
+def _run_units(units : List[Tuple[int, List[Tuple[str, str]]]], journal : Optional['RenameJournal'], threads : int, batch_size : int, verbose : bool,
+               offsets : Dict[int, int] = None) -> int:
+    """Runs the renames of each unit in order, starting `offsets[unit]` renames
+    in, with the units of each batch spread over threads."""
+    offsets = offsets or {}
+    def run(index, unit):
+        start = offsets.get(index, 0)
+        for step in range(start, len(unit)):
+            if journal is not None:
+                journal.record(index, step)
+            os.replace(*unit[step])
+        return len(unit) - start
+    count = 0
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+    try:
+        for start in range(0, len(units), batch_size):
+            batch = units[start:start+batch_size]
+            if executor is None:
+                count += sum(run(index, unit) for index, unit in batch)
+            else:
+                count += sum(executor.map(lambda item: run(*item), batch))
+            if journal is not None:
+                journal.flush()
+            if verbose:
+                print(">> {} renames made ({}/{} units).".format(count, min(start + batch_size, len(units)), len(units)))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+    return count
+
+class RenameJournal:
+    """Journal of a bulk rename: the planned renames of each unit, then a record
+    written (and flushed) before each rename is made. As each unit runs its
+    renames in order, the renames done can be worked out from the last record
+    of the unit and whether that rename's source is still in place."""
+
+    def __init__(self, path : str, units : List[List[Tuple[str, str]]], records : List[Tuple[int, int, bool]] = (), complete : bool = False):
+        self.path : str = path
+        self.units : List[List[Tuple[str, str]]] = units
+        self.records : List[Tuple[int, int, bool]] = list(records)
+        self.complete : bool = complete
+        self._file = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path : str, units : List[List[Tuple[str, str]]]) -> 'RenameJournal':
+        """Writes the planned renames to a new journal. Paths are made absolute,
+        so the journal can be resumed or rolled back from any directory."""
+        units = [[(os.path.abspath(source), os.path.abspath(target)) for source, target in unit] for unit in units]
+        journal = cls(path, units)
+        with open(path, 'w') as f:
+            f.write(json.dumps({'version': JOURNAL_VERSION, 'units': len(units)}) + '\n')
+            for unit in units:
+                f.write(json.dumps([list(step) for step in unit]) + '\n')
+            f.write(json.dumps({'planned': True}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        journal._file = open(path, 'a')
+        return journal
+
+    @classmethod
+    def load(cls, path : str) -> 'RenameJournal':
+        units, records, complete = [], [], False
+        with open(path) as f:
+            header = json.loads(f.readline())
+            if header.get('version') != JOURNAL_VERSION:
+                raise Exception("Error: '{}' is not a rename journal of this version of pyreutil.".format(path))
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # A record cut short by the interruption.
+                    break
+                if isinstance(item, list) and item and isinstance(item[0], list):
+                    units.append([tuple(step) for step in item])
+                elif isinstance(item, list):
+                    records.append((item[0], item[1], len(item) > 2))
+                elif 'complete' in item:
+                    complete = item['complete']
+        if len(units) != header['units']:
+            raise Exception("Error: The rename journal '{}' is incomplete, no files were renamed with it.".format(path))
+        journal = cls(path, units, records, complete)
+        journal._file = open(path, 'a')
+        return journal
+
+    def record(self, unit : int, step : int, undo : bool = False) -> None:
+        with self._lock:
+            self._file.write(json.dumps([unit, step, 1] if undo else [unit, step]) + '\n')
+            self._file.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self, complete : Optional[bool] = None) -> None:
+        if complete is not None:
+            self._file.write(json.dumps({'complete': complete}) + '\n')
+        self._file.close()
+
+    def progress(self) -> Dict[int, int]:
+        """Returns the number of renames in effect for each unit."""
+        done = {}
+        last = {}
+        for unit, step, undo in self.records:
+            last[unit] = (step, undo)
+        for unit, (step, undo) in last.items():
+            source, target = self.units[unit][step]
+            if undo:
+                source, target = target, source
+            # The last recorded rename was made unless its source is still there.
+            made = not (os.path.lexists(source) and not os.path.lexists(target))
+            if undo:
+                done[unit] = step if made else step + 1
+            else:
+                done[unit] = step + 1 if made else step
+        return done
+
+    def resume(self, threads : int = 1, batch_size : int = 1000, verbose : bool = False) -> int:
+        """Makes the renames of the journal that were not made yet."""
+        if self.complete:
+            return 0
+        done = self.progress()
+        units = [(index, unit) for index, unit in enumerate(self.units) if done.get(index, 0) < len(unit)]
+        count = _run_units(units, self, threads, batch_size, verbose, offsets=done)
+        self.close(complete=True)
+        self.complete = True
+        return count
+
+    def rollback(self, verbose : bool = False) -> int:
+        """Undoes the renames of the journal that were made, newest first."""
+        made = 0
+        for index, count in self.progress().items():
+            for step in reversed(range(count)):
+                source, target = self.units[index][step]
+                self.record(index, step, undo=True)
+                os.replace(target, source)
+                made += 1
+        self.flush()
+        if verbose:
+            print(">> {} renames undone.".format(made))
+        self.close(complete=False)
+        self.complete = False
+        return made
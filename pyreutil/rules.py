@@ -0,0 +1,134 @@
+import json
+import re
+
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from .patterns import literal_core, literal_replacement, required_literals
+
+class Rule(NamedTuple):
+    pattern : str
+    replacement : str
+
+def load_rules(filename : str) -> List[Rule]:
+    """Loads (pattern, replacement) rules from a file. JSON files hold a list of
+    [pattern, replacement] pairs or {"search": ..., "replace": ...} objects.
+    Other files hold one rule per line as the pattern and replacement separated
+    by a tab, where blank lines and lines starting with '#' are ignored. A rule
+    without a replacement removes its matches."""
+    with open(filename, 'r') as f:
+        content = f.read()
+    rules = []
+    if filename.endswith('.json'):
+        for item in json.loads(content):
+            if isinstance(item, dict):
+                rules.append(Rule(item['search'], item.get('replace', '')))
+            else:
+                rules.append(Rule(item[0], item[1] if len(item) > 1 else ''))
+    else:
+        for line in content.splitlines():
+            if not line.strip() or line.startswith('#'):
+                continue
+            pattern, _, replacement = line.partition('\t')
+            rules.append(Rule(pattern, replacement))
+    for rule in rules:
+        try:
+            re.compile(rule.pattern)
+        except re.error as e:
+            raise ValueError("Error: Invalid pattern '{}' in the rules file '{}': {}".format(rule.pattern, filename, e)) from None
+    return rules
+
+def _overlaps(a : str, b : str) -> bool:
+    """Returns whether occurrences of a and b could share characters."""
+    if a in b or b in a:
+        return True
+    for k in range(1, min(len(a), len(b))):
+        if a.endswith(b[:k]) or b.endswith(a[:k]):
+            return True
+    return False
+
+def _word_edges(text : str) -> Tuple[bool, bool]:
+    is_word = lambda c: c.isalnum() or c == '_'
+    return is_word(text[0]), is_word(text[-1])
+
+class RuleSet:
+    """Applies many (pattern, replacement) rules with the same result as applying
+    them one after another. Consecutive rules that match fixed strings (with
+    optional word boundaries) and cannot interact are merged into a single
+    alternation, so a text is scanned once per merged group instead of once per
+    rule. Hit counts are kept per rule."""
+
+    def __init__(self, rules : Iterable[Rule], name : str = 'rules'):
+        self.name : str = name
+        self.rules : List[Rule] = [Rule(*rule) for rule in rules]
+        # Each group is (compiled pattern, rule indexes, replacement functions).
+        self.groups : List[Tuple[re.Pattern, List[int], list]] = []
+        for indexes in self._merge():
+            if len(indexes) == 1:
+                i = indexes[0]
+                self.groups.append((re.compile(self.rules[i].pattern), indexes, [self.rules[i].replacement]))
+                continue
+            regex = '|'.join('(?P<r{}>{})'.format(k, self.rules[i].pattern) for k, i in enumerate(indexes))
+            functions = []
+            for i in indexes:
+                replacement = self.rules[i].replacement
+                literal = literal_replacement(replacement)
+                functions.append((lambda m, r=literal: r) if literal is not None else (lambda m, r=replacement: m.expand(r)))
+            self.groups.append((re.compile(regex), indexes, functions))
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def _merge(self) -> List[List[int]]:
+        """Splits the rules into runs of consecutive rules that are independent."""
+        groups = []
+        current = []
+        for j, rule in enumerate(self.rules):
+            if current and all(self._independent(i, j) for i in current):
+                current.append(j)
+                continue
+            if current:
+                groups.append(current)
+            current = [j]
+        if current:
+            groups.append(current)
+        return groups
+
+    def _independent(self, i : int, j : int) -> bool:
+        """Returns whether rule i (applied first) and rule j can be applied in
+        the same scan. Both must match fixed strings that cannot overlap, and
+        rule i's replacement must not be able to create or border a match of
+        rule j."""
+        core_i, core_j = literal_core(self.rules[i].pattern), literal_core(self.rules[j].pattern)
+        replacement = literal_replacement(self.rules[i].replacement)
+        if core_i is None or core_j is None or replacement is None or not replacement:
+            return False
+        (literal_i, _), (literal_j, bounded_j) = core_i, core_j
+        if _overlaps(literal_i, literal_j) or _overlaps(replacement, literal_j):
+            return False
+        # Changing whether the edges are word characters could move a \b.
+        if bounded_j and _word_edges(replacement) != _word_edges(literal_i):
+            return False
+        return True
+
+    def apply(self, text : str) -> Tuple[str, List[int]]:
+        """Returns the text with every rule applied and the hits of each rule."""
+        hits = [0]*len(self.rules)
+        for pattern, indexes, replacements in self.groups:
+            if len(indexes) == 1:
+                text, n = pattern.subn(replacements[0], text)
+                hits[indexes[0]] += n
+                continue
+            def substitute(m):
+                k = int(m.lastgroup[1:])
+                hits[indexes[k]] += 1
+                return replacements[k](m)
+            text = pattern.sub(substitute, text)
+        return text, hits
+
+    def required_literals(self) -> Optional[List[Tuple[str, ...]]]:
+        """Returns the literals required by each rule, or None if some rule can
+        match without any, for skipping texts that no rule can change."""
+        literals = [required_literals(rule.pattern) for rule in self.rules]
+        if not all(literals):
+            return None
+        return literals
@@ -0,0 +1,160 @@
+import hashlib
+import heapq
+import json
+import os
+
+from typing import Dict, Iterable, List, Optional
+
+from .stats import Stats, format_summary
+
+SUMMARY_VERSION = 1
+
+def relative_path(path : str, root : Optional[str]) -> str:
+    """Returns the path relative to the root directory (or its name without
+    one) with '/' separators, so it is the same on every host sharing the
+    files whatever their mount point."""
+    if root is None:
+        rel = os.path.basename(path)
+    else:
+        prefix = os.path.join(root, '')
+        rel = path[len(prefix):] if path.startswith(prefix) else os.path.relpath(path, root)
+    return rel.replace(os.sep, '/')
+
+def stable_shard(relpath : str, count : int) -> int:
+    """Returns the shard of a relative path by a hash that does not change
+    between runs, processes or hosts (unlike the built-in hash)."""
+    digest = hashlib.blake2b(relpath.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+def balance(sizes : Dict[str, int], count : int) -> Dict[str, int]:
+    """Assigns files to shards so the shards get about the same number of bytes:
+    largest files first, each to the shard with the fewest bytes so far. Ties
+    are broken by path and shard index, so every host gets the same result."""
+    loads = [(0, index) for index in range(count)]
+    assignment = {}
+    for relpath, size in sorted(sizes.items(), key=lambda item: (-item[1], item[0])):
+        load, index = heapq.heappop(loads)
+        assignment[relpath] = index
+        heapq.heappush(loads, (load + size, index))
+    return assignment
+
+def write_manifest(path : str, filepaths : Iterable[str], root : str) -> int:
+    """Writes the size of each file (by path relative to the root directory)
+    as a JSON manifest for size-balanced sharding, returning the number of
+    files in it."""
+    sizes = {}
+    for filepath in filepaths:
+        try:
+            sizes[relative_path(filepath, root)] = os.path.getsize(filepath)
+        except OSError:
+            continue
+    with open(path, 'w') as f:
+        json.dump(sizes, f, indent=0, sort_keys=True)
+    return len(sizes)
+
+class Shard:
+    """Shard `index` of `count` (0 <= index < count) of the files of a run.
+    Every file belongs to exactly one shard, by a stable hash of its path
+    relative to the source, so independent runs over the same files (on one
+    host or several sharing a filesystem) split the work without
+    coordinating. With a manifest of file sizes (see write_manifest), the
+    files in it are assigned so each shard gets about as many bytes instead,
+    and only the files missing from it are assigned by hash."""
+
+    def __init__(self, index : int, count : int, manifest : Dict[str, int] = None):
+        if count < 1 or not 0 <= index < count:
+            raise Exception("Error: The shard {}/{} is not valid. Input K/N with 0 <= K < N.".format(index, count))
+        self.index : int = index
+        self.count : int = count
+        self.assignment : Dict[str, int] = balance(manifest, count) if manifest else {}
+        # Files seen and selected so far, for the shard summary.
+        self.files_total : int = 0
+        self.files : int = 0
+
+    @classmethod
+    def parse(cls, spec : str, manifest : str = None) -> 'Shard':
+        """Returns the shard given as 'K/N', balanced by a manifest file if given."""
+        try:
+            index, count = (int(part) for part in spec.split('/'))
+        except ValueError:
+            raise Exception("Error: The shard '{}' is not valid. Input K/N, e.g. 0/4.".format(spec))
+        sizes = None
+        if manifest is not None:
+            with open(manifest) as f:
+                sizes = json.load(f)
+        return cls(index, count, sizes)
+
+    def __repr__(self) -> str:
+        return "{}/{}".format(self.index, self.count)
+
+    def shard_of(self, relpath : str) -> int:
+        index = self.assignment.get(relpath)
+        return index if index is not None else stable_shard(relpath, self.count)
+
+    def select(self, filepaths : Iterable[str], root : Optional[str]) -> List[str]:
+        """Returns the files (under the root directory, if any) that belong to
+        this shard."""
+        selected = []
+        for filepath in filepaths:
+            self.files_total += 1
+            if self.shard_of(relative_path(filepath, root)) == self.index:
+                selected.append(filepath)
+        self.files += len(selected)
+        return selected
+
+def write_summary(path : str, stats : Stats, shard : Optional[Shard] = None) -> None:
+    """Writes the stats of a run, with its shard and number of files, as JSON
+    for merge_summaries."""
+    summary = {'version': SUMMARY_VERSION}
+    if shard is not None:
+        summary.update({'shard': [shard.index, shard.count], 'files': shard.files, 'files_total': shard.files_total})
+    summary.update(stats.to_dict())
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=2)
+        f.write('\n')
+
+def merge_summaries(summaries : List[dict], top : int = 10) -> dict:
+    """Combines the summaries of the shards of a run. Phase times, counters and
+    CPU time add up, while the wall time is that of the slowest shard, as the
+    shards run side by side. Missing or repeated shards are listed."""
+    merged = {'shards': [], 'missing': [], 'repeated': [], 'files': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+              'phases': {}, 'counters': {}, 'slowest_files': []}
+    counts = set()
+    for summary in summaries:
+        if summary.get('version') != SUMMARY_VERSION:
+            raise Exception("Error: Not a pyreutil summary of this version.")
+        if 'shard' in summary:
+            index, count = summary['shard']
+            if index in merged['shards']:
+                merged['repeated'].append(index)
+            merged['shards'].append(index)
+            counts.add(count)
+        merged['files'] += summary.get('files', 0)
+        merged['wall_seconds'] = max(merged['wall_seconds'], summary['wall_seconds'])
+        merged['cpu_seconds'] += summary['cpu_seconds']
+        for name, phase in summary['phases'].items():
+            totals = merged['phases'].setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'calls': 0})
+            for key in totals:
+                totals[key] += phase[key]
+        for name, value in summary['counters'].items():
+            merged['counters'][name] = merged['counters'].get(name, 0) + value
+        merged['slowest_files'].extend(summary['slowest_files'])
+    if len(counts) > 1:
+        raise Exception("Error: The summaries are of runs split into different numbers of shards ({}).".format(', '.join(map(str, sorted(counts)))))
+    if counts:
+        merged['missing'] = sorted(set(range(counts.pop())) - set(merged['shards']))
+    merged['shards'].sort()
+    merged['phases'] = dict(sorted(merged['phases'].items()))
+    merged['counters'] = dict(sorted(merged['counters'].items()))
+    merged['slowest_files'] = heapq.nlargest(top, merged['slowest_files'], key=lambda item: item['regex_seconds'])
+    return merged
+
+def format_merged(merged : dict) -> str:
+    """Returns merged summaries as a human readable report."""
+    lines = ["Shards: {} merged, {} file(s)".format(len(merged['shards']), merged['files'])]
+    if merged['missing']:
+        lines.append("Warning: Missing the summaries of shard(s) {}.".format(', '.join(map(str, merged['missing']))))
+    if merged['repeated']:
+        lines.append("Warning: More than one summary of shard(s) {}.".format(', '.join(map(str, sorted(set(merged['repeated']))))))
+    lines.append(format_summary(merged))
+    return '\n'.join(lines)
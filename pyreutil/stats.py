@@ -0,0 +1,176 @@
+import collections
+import contextlib
+import heapq
+import json
+import sys
+import time
+
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+class Stats:
+    """Collects wall and CPU time per phase of a run (walk, read, regex, render,
+    print and save), counters such as bytes read and written and matches, and
+    the regex time of each file. Time spent in a phase nested in another (e.g.
+    printing during a regex step) only counts towards the inner phase."""
+
+    def __init__(self, top : int = 10):
+        self.top : int = top
+        self.phases : Dict[str, List[float]] = collections.defaultdict(lambda: [0.0, 0.0, 0])
+        self.counters : collections.Counter = collections.Counter()
+        self.file_times : Dict[str, float] = collections.defaultdict(float)
+        self.started : float = time.perf_counter()
+        self._started_cpu : float = time.process_time()
+        self._stack : List[List[float]] = []
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __getstate__(self) -> dict:
+        # Worker processes start with empty stats, which are merged back with take().
+        state = self.__dict__.copy()
+        state['phases'] = {}
+        state['counters'] = collections.Counter()
+        state['file_times'] = {}
+        state['_stack'] = []
+        return state
+
+    def __setstate__(self, state : dict) -> None:
+        self.__dict__.update(state)
+        self.phases = collections.defaultdict(lambda: [0.0, 0.0, 0])
+        self.file_times = collections.defaultdict(float)
+
+    @contextlib.contextmanager
+    def phase(self, name : str, filename : Optional[str] = None) -> Iterator[None]:
+        """Times the enclosed code as the phase, and per file if given."""
+        frame = [time.perf_counter(), time.process_time(), 0.0, 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            wall = time.perf_counter() - frame[0]
+            cpu = time.process_time() - frame[1]
+            totals = self.phases[name]
+            totals[0] += wall - frame[2]
+            totals[1] += cpu - frame[3]
+            totals[2] += 1
+            if filename is not None:
+                self.file_times[filename] += wall - frame[2]
+            if self._stack:
+                self._stack[-1][2] += wall
+                self._stack[-1][3] += cpu
+
+    def add(self, name : str, value : int = 1) -> None:
+        self.counters[name] += value
+
+    def empty(self) -> 'Stats':
+        """Returns new empty stats with the same settings, e.g. for a worker."""
+        return Stats(top=self.top)
+
+    def take(self) -> dict:
+        """Returns the stats collected so far (for merging into another Stats
+        with merge) and resets them."""
+        state = {'phases': dict(self.phases), 'counters': dict(self.counters), 'file_times': dict(self.file_times)}
+        self.phases.clear()
+        self.counters.clear()
+        self.file_times.clear()
+        return state
+
+    def merge(self, state : Optional[dict]) -> None:
+        if not state:
+            return
+        for name, (wall, cpu, calls) in state['phases'].items():
+            totals = self.phases[name]
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += calls
+        self.counters.update(state['counters'])
+        for filename, seconds in state['file_times'].items():
+            self.file_times[filename] += seconds
+
+    def slowest_files(self) -> List[Tuple[str, float]]:
+        """Returns the files with the most regex time, slowest first."""
+        return heapq.nlargest(self.top, self.file_times.items(), key=lambda item: item[1])
+
+    def to_dict(self) -> dict:
+        return {
+            'wall_seconds': time.perf_counter() - self.started,
+            'cpu_seconds': time.process_time() - self._started_cpu,
+            'phases': {name: {'wall_seconds': wall, 'cpu_seconds': cpu, 'calls': calls} for name, (wall, cpu, calls) in sorted(self.phases.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'slowest_files': [{'file': filename, 'regex_seconds': seconds} for filename, seconds in self.slowest_files()],
+        }
+
+    def summary(self) -> str:
+        """Returns the stats as a human readable report."""
+        return format_summary(self.to_dict())
+
+    def report(self, fmt : str = 'text', file : TextIO = None) -> None:
+        file = file or sys.stdout
+        if fmt == 'json':
+            json.dump(self.to_dict(), file, indent=2)
+            file.write('\n')
+        else:
+            print(self.summary(), file=file)
+
+    @contextlib.contextmanager
+    def timed_stdout(self) -> Iterator[None]:
+        """Counts the time spent writing to stdout as the print phase."""
+        stdout = sys.stdout
+        sys.stdout = _TimedWriter(stdout, self)
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+def format_summary(stats : dict) -> str:
+    """Formats stats as returned by Stats.to_dict as a human readable report."""
+    lines = ["Stats: {:.3f}s wall, {:.3f}s CPU".format(stats['wall_seconds'], stats['cpu_seconds'])]
+    for name, phase in sorted(stats['phases'].items(), key=lambda item: -item[1]['wall_seconds']):
+        lines.append("  {:<8} {:>10.4f}s wall {:>10.4f}s CPU {:>10} calls".format(name, phase['wall_seconds'], phase['cpu_seconds'], phase['calls']))
+    for name, value in stats['counters'].items():
+        lines.append("  {:<16} {:>12}".format(name, value))
+    if stats['slowest_files']:
+        lines.append("  Slowest files by regex time:")
+        for item in stats['slowest_files']:
+            lines.append("    {:>10.4f}s  {}".format(item['regex_seconds'], item['file']))
+    return '\n'.join(lines)
+
+class _TimedWriter:
+
+    def __init__(self, stream : TextIO, stats : Stats):
+        self._stream = stream
+        self._stats = stats
+
+    def write(self, text : str) -> int:
+        with self._stats.phase('print'):
+            return self._stream.write(text)
+
+    def __getattr__(self, name : str):
+        return getattr(self._stream, name)
+
+class NullStats:
+    """Stand-in for Stats when they are not collected. It is falsy, so costly
+    measurements can be skipped with `if self.stats:`."""
+
+    _null = contextlib.nullcontext()
+
+    def __bool__(self) -> bool:
+        return False
+
+    def phase(self, name : str, filename : Optional[str] = None) -> contextlib.nullcontext:
+        return self._null
+
+    def add(self, name : str, value : int = 1) -> None:
+        pass
+
+    def empty(self) -> 'NullStats':
+        return self
+
+    def take(self) -> None:
+        return None
+
+    def merge(self, state : Optional[dict]) -> None:
+        pass
+
+NULL_STATS = NullStats()
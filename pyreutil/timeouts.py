@@ -0,0 +1,151 @@
+import contextlib
+import io
+import multiprocessing
+import multiprocessing.connection
+import sys
+import time
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .parallel import worker_copy
+from .utils import remove_atomic_temps
+
+def _serve(conn, util) -> None:
+    """Processes the files sent by the parent one at a time, sending back each
+    result with its output, counters and stats, until the pipe is closed."""
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            return
+        if item is None:
+            return
+        filepath, final = item
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            ok, result = util._process_file(filepath, final)
+        counters = dict(util.counters)
+        util.counters.clear()
+        conn.send((ok, result, output.getvalue(), counters, util.stats.take()))
+
+class _Worker:
+    """A worker process given one file at a time, which can be killed."""
+
+    def __init__(self, context, util):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, util), daemon=True)
+        self.process.start()
+        child.close()
+        self.index : int = -1
+        self.filepath : Optional[str] = None
+        self.started : float = 0.0
+
+    def submit(self, index : int, filepath : str, final : Optional[Tuple[str, tuple]]) -> None:
+        self.index, self.filepath = index, filepath
+        self.started = time.monotonic()
+        self.conn.send((filepath, final))
+
+    def close(self) -> None:
+        with contextlib.suppress(OSError):
+            self.conn.send(None)
+        self.conn.close()
+        self.process.join()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+def _cleanup(util, filepath : str, final : Optional[Tuple[str, tuple]]) -> None:
+    """Removes the temporary file a worker killed while saving the file left."""
+    if final is not None and final[0] == '_save_text':
+        remove_atomic_temps(util._save_path(filepath, final[1][0]))
+
+def _skip(util, filepath : str, reason : str, seconds : float = 0.0) -> None:
+    util._skip_file(filepath, reason)
+    if util.stats and seconds:
+        # Counted as regex time, so the file shows up among the slowest files.
+        util.stats.file_times[filepath] += seconds
+
+def process_files(util, filepaths : List[str], final : Optional[Tuple[str, tuple]], jobs : int, timeout : float = None, deadline : float = None) -> Iterator[Tuple[bool, Any]]:
+    """Runs util._process_file over the files in worker processes that each
+    get one file at a time, yielding the (ok, result) pairs and printing each
+    file's output in the original file order. A worker still on a file after
+    `timeout` seconds is killed and replaced, and the file is skipped as
+    'timeout'. Once time.monotonic() reaches the deadline, all workers are
+    killed and the files not done yet are skipped as 'budget'. A file left
+    half saved by a killed worker keeps its original contents, and the
+    temporary file being written is removed."""
+    if not filepaths:
+        return
+    context = multiprocessing.get_context()
+    shell = worker_copy(util)
+    idle = [_Worker(context, shell) for _ in range(min(jobs, len(filepaths)))]
+    busy : Dict[Any, _Worker] = {}
+    done : Dict[int, Tuple[bool, Any, str]] = {}
+    queued = 0
+    yielded = 0
+    try:
+        while yielded < len(filepaths):
+            while idle and queued < len(filepaths):
+                worker = idle.pop()
+                worker.submit(queued, filepaths[queued], final)
+                busy[worker.conn] = worker
+                queued += 1
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                for worker in busy.values():
+                    worker.kill()
+                    _cleanup(util, worker.filepath, final)
+                    _skip(util, worker.filepath, 'budget', now - worker.started)
+                    done[worker.index] = (False, None, '')
+                busy.clear()
+                for index in range(queued, len(filepaths)):
+                    _skip(util, filepaths[index], 'budget')
+                    done[index] = (False, None, '')
+                queued = len(filepaths)
+            else:
+                limits = [worker.started + timeout for worker in busy.values()] if timeout else []
+                if deadline is not None:
+                    limits.append(deadline)
+                wait = max(0.0, min(limits) - now) if limits else None
+                for conn in multiprocessing.connection.wait(list(busy), wait):
+                    worker = busy.pop(conn)
+                    try:
+                        ok, result, output, counters, stats = conn.recv()
+                    except EOFError:
+                        # The worker died on the file, e.g. killed for using too much memory.
+                        worker.kill()
+                        _cleanup(util, worker.filepath, final)
+                        _skip(util, worker.filepath, 'failed', time.monotonic() - worker.started)
+                        done[worker.index] = (False, None, '')
+                        if queued < len(filepaths):
+                            idle.append(_Worker(context, shell))
+                        continue
+                    util.counters.update(counters)
+                    util.stats.merge(stats)
+                    done[worker.index] = (ok, result, output)
+                    idle.append(worker)
+                if timeout:
+                    now = time.monotonic()
+                    for conn, worker in list(busy.items()):
+                        if now - worker.started >= timeout:
+                            del busy[conn]
+                            worker.kill()
+                            _cleanup(util, worker.filepath, final)
+                            _skip(util, worker.filepath, 'timeout', now - worker.started)
+                            done[worker.index] = (False, None, '')
+                            if queued < len(filepaths):
+                                idle.append(_Worker(context, shell))
+            while yielded in done:
+                ok, result, output = done.pop(yielded)
+                if output:
+                    sys.stdout.write(output)
+                yield ok, result
+                yielded += 1
+    finally:
+        for worker in busy.values():
+            worker.kill()
+            _cleanup(util, worker.filepath, final)
+        for worker in idle:
+            worker.close()
@@ -1,7 +1,20 @@
+import fnmatch
 import functools
 import os
+import re
+import shutil
+import sys
 
-from typing import Callable, List
+from typing import Callable, Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request that clones a file's extents on Linux (btrfs, XFS, ...).
+FICLONE = 0x40049409
+CLONE_METHODS = ('auto', 'reflink', 'hardlink', 'copy')
 
 # TODO: Decorator type hints????? 
 # TODO: Improve clarity when initialising objects
@@ -23,6 +36,147 @@ def get_file_contents(filename: str) -> str:
     with open(filename, 'r') as f:
         return f.read()
     
+def write_atomic(path: str, chunks: Iterable[str], like: str = None, fsync: bool = False, commit: Callable[[], bool] = None,
+                 encoding: str = None, errors: str = None) -> Optional[int]:
+    """Writes text chunks to a temporary file beside the path (in the given
+    encoding and error handling) and then moves it into place, so the file is
+    never left half written. Permissions are copied from `like` (or the file
+    being replaced). If `commit` is given and returns False once everything is
+    written, the temporary file is discarded instead. Returns the number of
+    bytes written, or None if nothing was committed. A symlinked path is
+    written through, replacing the file it links to and keeping the link."""
+    path = os.path.realpath(path)
+    head, tail = os.path.split(path)
+    tmp = os.path.join(head, '.{}.{}.tmp'.format(tail, os.urandom(4).hex()))
+    # Created like a regular file (respecting the umask), unlike mkstemp's 0600.
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding, errors=errors) as f:
+            for chunk in chunks:
+                f.write(chunk)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        if commit is not None and not commit():
+            os.unlink(tmp)
+            return None
+        source = like or path
+        if os.path.exists(source):
+            shutil.copymode(source, tmp)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return size
+
+def remove_atomic_temps(path: str) -> int:
+    """Removes the temporary files write_atomic leaves beside a path when the
+    process writing it is killed, returning how many were removed."""
+    head, tail = os.path.split(os.path.realpath(path))
+    temp = re.compile(r'\.{}\.[0-9a-f]{{8}}\.tmp$'.format(re.escape(tail)))
+    removed = 0
+    try:
+        names = os.listdir(head)
+    except OSError:
+        return 0
+    for name in names:
+        if temp.match(name):
+            try:
+                os.unlink(os.path.join(head, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+def clone_file(source: str, target: str, method: str = 'auto') -> str:
+    """Makes target a copy of source that shares its data where possible. By
+    default ('auto' or 'reflink') it is a reflink (a copy-on-write clone) if
+    the filesystem supports it, otherwise a full copy. A hard link is only made
+    when asked for ('hardlink'), as it is the same file, so editing either in
+    place changes both. Raises shutil.SameFileError if the target is the
+    source itself. Returns the method used."""
+    if method not in CLONE_METHODS:
+        raise Exception("Error: The link method {} is not valid. Input one of {}.".format(method, ', '.join(CLONE_METHODS)))
+    if same_entry(source, target):
+        raise shutil.SameFileError("{!r} and {!r} are the same file".format(source, target))
+    if os.path.lexists(target):
+        os.unlink(target)
+    if method in ('auto', 'reflink') and _reflink(source, target):
+        return 'reflink'
+    if method == 'hardlink':
+        try:
+            os.link(source, target)
+            return 'hardlink'
+        except OSError:
+            pass
+    shutil.copyfile(source, target)
+    shutil.copymode(source, target)
+    return 'copy'
+
+def same_entry(source: str, target: str) -> bool:
+    """Whether the target path names the source file itself (and not a link to
+    it), so that removing the target would remove the source."""
+    if not os.path.lexists(target):
+        return False
+    if os.path.abspath(source) == os.path.abspath(target):
+        return True
+    if os.path.islink(target) or not os.path.exists(source) or not os.path.samefile(source, target):
+        return False
+    # Hard links are other names of the file in the same or other directories, a
+    # name in the same directory (e.g. through a linked directory) is the file.
+    source_dir, source_name = os.path.split(os.path.abspath(source))
+    target_dir, target_name = os.path.split(os.path.abspath(target))
+    if not os.path.samefile(source_dir, target_dir):
+        return False
+    return os.path.normcase(source_name) == os.path.normcase(target_name) or os.stat(target).st_nlink == 1
+
+def _reflink(source: str, target: str) -> bool:
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    with open(source, 'rb') as src:
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            fcntl.ioctl(fd, FICLONE, src.fileno())
+        except OSError:
+            os.close(fd)
+            os.unlink(target)
+            return False
+        os.close(fd)
+    shutil.copymode(source, target)
+    return True
+
+def make_directories(directories: Iterable[str]) -> int:
+    """Creates each of the directories (and their parents) once, returning how
+    many calls were made. Parents of directories in the list are skipped."""
+    made = 0
+    unique = sorted(set(directories), key=lambda d: (-d.count(os.sep), d))
+    created = set()
+    for directory in unique:
+        if directory in created or not directory:
+            continue
+        os.makedirs(directory, exist_ok=True)
+        made += 1
+        # Its parents now exist too.
+        while directory and directory not in created:
+            created.add(directory)
+            directory = os.path.dirname(directory)
+    return made
+
+def fsync_directory(directory: str) -> None:
+    """Flushes a directory entry (e.g. after renaming files into it) to disk."""
+    try:
+        fd = os.open(directory or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
 def isdir(fullpath: str) -> bool:
     """Returns true if is a file, and false if otherwise (a directory)."""
     try:
@@ -33,19 +187,105 @@ def isdir(fullpath: str) -> bool:
     except FileNotFoundError:
         print(f'{fullpath} does not exist.')
 
+# Directories that are never walked into unless explicitly allowed.
+DEFAULT_EXCLUDE_DIRS = ('.git', '.hg', '.svn', 'node_modules', '__pycache__')
+WALK_OPTIONS = ('search_subdirs', 'include', 'exclude', 'exclude_dirs', 'gitignore')
+
 def iterate_files(directory: str, search_subdirs: bool = True) -> List:
     """Iterates over the files in the given directory and returns a list of 
     found files."""
-    files = []
-    for file in os.listdir(directory):
-        filename = os.fsdecode(file)
-        fullpath = os.path.join(directory, filename)
-        if (isdir(fullpath)):
-            if search_subdirs:
-                files += iterate_files(fullpath)
-        else:
-            files.append(fullpath)
-    return files
+    return list(walk_files(directory, search_subdirs=search_subdirs, exclude_dirs=()))
+
+def _glob_matcher(patterns: Optional[Iterable[str]]) -> Optional[Callable[[str], bool]]:
+    """Returns a function matching a path against any of the glob patterns."""
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(p) for p in patterns)).match
+
+def walk_files(directory: str, search_subdirs: bool = True, include: Iterable[str] = None, exclude: Iterable[str] = None,
+               exclude_dirs: Iterable[str] = DEFAULT_EXCLUDE_DIRS, gitignore: bool = False) -> Iterator[str]:
+    """Lazily yields the files in a directory using os.scandir. Files are kept if
+    their name or path relative to the directory matches an `include` glob (when
+    given) and no `exclude` glob. Directories matching `exclude` or named in
+    `exclude_dirs` are pruned, as are paths ignored by .gitignore files when
+    `gitignore` is set."""
+    included = _glob_matcher(include)
+    excluded = _glob_matcher(exclude)
+    exclude_dirs = frozenset(exclude_dirs)
+    stack = [(directory, '', GitIgnore() if gitignore else None)]
+    while stack:
+        dirpath, relpath, ignore = stack.pop()
+        if ignore is not None:
+            ignore = ignore.extend(os.path.join(dirpath, '.gitignore'), relpath)
+        try:
+            entries = os.scandir(dirpath)
+        except OSError as e:
+            print("Error: Could not open directory '{}': {}".format(dirpath, e.strerror))
+            continue
+        with entries:
+            for entry in entries:
+                name = entry.name
+                rel = relpath + '/' + name if relpath else name
+                is_dir = entry.is_dir()
+                if excluded and (excluded(name) or excluded(rel)):
+                    continue
+                if ignore is not None and ignore.ignored(rel, is_dir):
+                    continue
+                if is_dir:
+                    if search_subdirs and name not in exclude_dirs:
+                        stack.append((entry.path, rel, ignore))
+                elif included is None or included(name) or included(rel):
+                    yield entry.path
+
+class GitIgnore:
+    """Patterns collected from the .gitignore files of a directory and its parents."""
+    
+    def __init__(self, rules: tuple = ()):
+        # Each rule is (base, regex match, negated, directory only, anchored).
+        self.rules = rules
+    
+    def extend(self, filepath: str, base: str) -> 'GitIgnore':
+        """Returns the rules with those of the .gitignore file (if any) added,
+        where `base` is the relative path of the directory containing it."""
+        try:
+            with open(filepath, 'r') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return self
+        rules = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            line = line.lstrip('/')
+            if line.startswith('**/'):
+                line, anchored = line[3:], '/' in line[3:]
+            if line:
+                rules.append((base, re.compile(fnmatch.translate(line)).match, negated, dir_only, anchored))
+        return GitIgnore(self.rules + tuple(rules)) if rules else self
+    
+    def ignored(self, relpath: str, is_dir: bool) -> bool:
+        """Returns whether a path (relative to the walked directory) is ignored.
+        As in git, the last matching rule wins."""
+        ignored = False
+        for base, match, negated, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not relpath.startswith(base + '/'):
+                    continue
+                path = relpath[len(base)+1:]
+            else:
+                path = relpath
+            if match(path if anchored else path.rsplit('/', 1)[-1]):
+                ignored = not negated
+        return ignored
 
 def split_fullpath(fullpath: str) -> tuple[str, str, str]:
     """Splits the full path into the directory, filename, and extension."""
@@ -0,0 +1,96 @@
+import os
+import time
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .stats import NULL_STATS, Stats
+from .utils import isdir, walk_files
+
+# The (mtime in nanoseconds, size) of a file, which changes when it is written.
+Signature = Tuple[int, int]
+
+def signature(path : str) -> Optional[Signature]:
+    """Returns the signature of a file, or None if it no longer exists."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+class Watcher:
+    """Watches a directory (or a single file) for added and modified files by
+    polling an index of the (mtime, size) of every file. Nothing is read to
+    poll: each poll walks the tree and stats the files, and only the files
+    that changed are handed on to be processed.
+
+    A changed file is handed on once it has stayed unchanged for the debounce
+    time, so a file still being written is picked up by a later poll. Files
+    written or renamed by the processing itself are stated again afterwards
+    and so do not trigger another run, while any other file keeps the
+    signature it had before processing, so an edit made during a run is
+    processed by the next one."""
+
+    def __init__(self, root : str, walk_options : dict = None, interval : float = 1.0, debounce : float = 0.5, stats : Stats = None):
+        self.root : str = root
+        self.walk_options : dict = walk_options or {}
+        self.interval : float = interval
+        self.debounce : float = debounce
+        self.stats : Stats = stats if stats is not None else NULL_STATS
+        self.index : Dict[str, Signature] = {}
+
+    def scan(self) -> Dict[str, Signature]:
+        """Returns the signature of every file under the root."""
+        with self.stats.phase('walk'):
+            paths = walk_files(self.root, **self.walk_options) if isdir(self.root) else [self.root]
+            index = {}
+            for path in paths:
+                sig = signature(path)
+                if sig is not None:
+                    index[path] = sig
+        return index
+
+    def poll(self) -> List[str]:
+        """Returns the files added or modified since the last poll, sorted, and
+        updates the index with them. Files still changing after the debounce
+        time are left for a later poll."""
+        new = self.scan()
+        changed = sorted(path for path, sig in new.items() if self.index.get(path) != sig)
+        if changed and self.debounce > 0:
+            time.sleep(self.debounce)
+            unstable = {path for path in changed if signature(path) != new[path]}
+            if unstable:
+                changed = [path for path in changed if path not in unstable]
+                for path in unstable:
+                    # Kept at its old signature (or left out) so the next poll sees it again.
+                    if path in self.index:
+                        new[path] = self.index[path]
+                    else:
+                        del new[path]
+        self.index = new
+        return changed
+
+    def absorb(self, paths : Iterable[str]) -> None:
+        """Updates the index with the current signature of the files, e.g. once
+        they have been written, dropping those that no longer exist."""
+        for path in paths:
+            sig = signature(path)
+            if sig is None:
+                self.index.pop(path, None)
+            else:
+                self.index[path] = sig
+
+    def run(self, process : Callable[[Optional[List[str]]], Iterable[str]], cycles : int = None) -> None:
+        """Calls process(None) for a full pass over the tree, then process(paths)
+        with the files added or modified since, every interval seconds, for the
+        given number of polls or until interrupted. The process function returns
+        the paths it wrote or created (e.g. saved or renamed files), which are
+        the only ones absorbed."""
+        self.index = self.scan()
+        self.absorb(process(None) or ())
+        count = 0
+        while cycles is None or count < cycles:
+            time.sleep(self.interval)
+            changed = self.poll()
+            if changed:
+                self.absorb(process(changed) or ())
+            count += 1
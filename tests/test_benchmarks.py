@@ -0,0 +1,31 @@
+import os
+import tempfile
+import unittest
+
+from benchmarks.__main__ import compare, run_child
+from benchmarks.corpus import generate
+
+class TestBenchmarks(unittest.TestCase):
+    
+    def test_corpus_is_reproducible(self):
+        with tempfile.TemporaryDirectory() as d:
+            first = generate('tiny_dense', os.path.join(d, 'a'), scale=0.01)
+            second = generate('tiny_dense', os.path.join(d, 'b'), scale=0.01)
+            self.assertEqual(first, second)
+            path = os.path.join('d00', 'file00000.txt')
+            with open(os.path.join(d, 'a', path)) as a, open(os.path.join(d, 'b', path)) as b:
+                self.assertEqual(a.read(), b.read())
+    
+    def test_cli_benchmark_runs(self):
+        with tempfile.TemporaryDirectory() as d:
+            generate('tiny_dense', os.path.join(d, 'corpus'), scale=0.01)
+            result = run_child('cli.search', os.path.join(d, 'corpus'), repeat=1)
+            self.assertGreater(result['seconds'], 0)
+    
+    def test_compare_flags_regressions(self):
+        baseline = {'fast': {'seconds': 1.0}, 'slow': {'seconds': 1.0}}
+        results = {'fast': {'seconds': 1.1}, 'slow': {'seconds': 1.5}, 'new': {'seconds': 9.0}}
+        self.assertEqual(compare(results, baseline, threshold=0.25), ['slow'])
+
+if __name__ == "__main__":
+    unittest.main()
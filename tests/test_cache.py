@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from pyreutil.cache import *
+
+class TestResultCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.tmp.name, 'a.txt')
+        with open(self.file, 'w') as f:
+            f.write("foo bar foo")
+        self.cache = ResultCache(os.path.join(self.tmp.name, 'cache', 'results.sqlite3'), max_entries=2)
+    
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+    
+    def test_get_and_invalidation(self):
+        self.assertIsNone(self.cache.get(self.file, "foo"))
+        self.cache.put(self.file, os.stat(self.file), "foo", [(0, 3), (8, 11)])
+        self.assertEqual(self.cache.get(self.file, "foo"), (2, [(0, 3), (8, 11)]))
+        self.assertIsNone(self.cache.get(self.file, "bar"))
+        with open(self.file, 'a') as f:
+            f.write(" foo")
+        self.assertIsNone(self.cache.get(self.file, "foo"))
+        self.cache.put(self.file, os.stat(self.file), "foo", [])
+        self.cache.clear()
+        self.assertIsNone(self.cache.get(self.file, "foo"))
+    
+    def test_keyed_by_encoding(self):
+        self.cache.put(self.file, os.stat(self.file), "foo", [(0, 3)], encoding='latin-1')
+        self.assertIsNotNone(self.cache.get(self.file, "foo", encoding='ISO-8859-1'))
+        self.assertIsNone(self.cache.get(self.file, "foo", encoding='utf-8'))
+    
+    def test_eviction(self):
+        for regex in ("a", "b", "c"):
+            self.cache.put(self.file, os.stat(self.file), regex, [])
+        self.cache.evict()
+        self.assertIsNone(self.cache.get(self.file, "a"))
+        self.assertIsNotNone(self.cache.get(self.file, "c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
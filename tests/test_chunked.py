@@ -0,0 +1,39 @@
+import io
+import re
+import unittest
+
+from pyreutil.chunked import *
+
+class TestChunked(unittest.TestCase):
+    
+    def test_sub_chunks_matches_across_blocks(self):
+        text = "foo bar\nfoo-bar foobar " * 50 + "foo"
+        pattern = re.compile(r"\bfoo(-?)bar\b|^foo")
+        for chunk_size in (1, 7, 64, 10000):
+            counter = [0]
+            chunks = read_chunks(io.StringIO(text), chunk_size)
+            result = ''.join(sub_chunks(chunks, pattern, "<\\1>", max_match_length=8, counter=counter))
+            expected, n = pattern.subn("<\\1>", text)
+            self.assertEqual(result, expected)
+            self.assertEqual(counter[0], n)
+    
+    def test_sub_chunks_sees_text_after_matches(self):
+        text = "foo\nbar\n" * 20
+        for regex, max_match_length in [("foo$", 3), ("bar$", 3), ("foo(?=\nbar\nfoo)", 11)]:
+            pattern = re.compile(regex)
+            for chunk_size in (1, 3, 5, 64):
+                counter = [0]
+                chunks = read_chunks(io.StringIO(text), chunk_size)
+                result = ''.join(sub_chunks(chunks, pattern, "X", max_match_length=max_match_length, counter=counter))
+                expected, n = pattern.subn("X", text)
+                self.assertEqual((result, counter[0]), (expected, n), (regex, chunk_size))
+    
+    def test_sub_lines(self):
+        counter = [0]
+        lines = io.StringIO("a-b\nc\nd-e-f\n")
+        self.assertEqual(''.join(sub_lines(lines, re.compile("-"), "_", counter)), "a_b\nc\nd_e_f\n")
+        self.assertEqual(counter[0], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
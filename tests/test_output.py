@@ -0,0 +1,19 @@
+import unittest
+
+from pyreutil.output import *
+
+class TestOutput(unittest.TestCase):
+    
+    def test_render_context(self):
+        text = "one\ntwo foo\nthree\nfour\nfive\nsix foo\nseven\n"
+        spans = [(text.index("foo"), text.index("foo") + 3), (text.rindex("foo"), text.rindex("foo") + 3)]
+        out = render_context("f.txt", text, spans, ["[foo]", "[foo]"], context=1)
+        self.assertEqual(out, "f.txt\n1-one\n2:two [foo]\n3-three\n--\n5-five\n6:six [foo]\n7-seven\n")
+        # Runs of lines closer than the context are merged.
+        out = render_context(None, text, spans, ["[foo]", "[foo]"], ["bar", "baz"], context=2)
+        self.assertEqual(out.count('--'), 0)
+        self.assertIn("6+six baz", out.splitlines())
+        self.assertEqual(render_context("f.txt", text, [], []), '')
+
+if __name__ == "__main__":
+    unittest.main()
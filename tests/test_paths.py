@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyreutil.paths import PathTable, PathView
+from pyreutil.pyreutil import FilenameUtil
+
+class TestPathTable(unittest.TestCase):
+
+    def test_interned_dirs_and_changed_stems(self):
+        paths = [os.path.join('a', 'b', 'one.txt'), os.path.join('a', 'b', 'two.txt'), os.path.join('c', 'three'), 'four.md']
+        table = PathTable(paths)
+        self.assertEqual(table.dirs, [os.path.join('a', 'b'), 'c', ''])
+        self.assertEqual(list(table), paths)
+        table.set_stem(1, 'TWO')
+        table.set_stem(2, 'three')
+        self.assertEqual(table.changed, {1: 'TWO'})
+        self.assertEqual(table[1], os.path.join('a', 'b', 'TWO.txt'))
+        self.assertEqual(list(table.originals()), paths)
+        self.assertEqual(list(table.changes()), [(paths[1], os.path.join('a', 'b', 'TWO.txt'))])
+
+    def test_filenameutil_saves_changed_stems(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        os.makedirs(os.path.join(tmp.name, 'sub'))
+        for name in ['a-1.txt', 'b.txt', os.path.join('sub', 'c-2.md')]:
+            with open(os.path.join(tmp.name, name), 'w') as f:
+                f.write(name)
+        names = FilenameUtil(path=tmp.name, search_subdirs=True)
+        renamed = names.search_and_replace('-', replace='_')
+        # A lazy view of the table, equal to the list of paths either way round.
+        self.assertIsInstance(renamed, PathView)
+        self.assertEqual(renamed, names.pathnames)
+        self.assertEqual(names.pathnames, renamed)
+        self.assertNotEqual(renamed, names.original_pathnames)
+        self.assertEqual(len(names.table.changed), 2)
+        # The paths can still be set as lists, with only the names changed.
+        renamed = names.pathnames
+        names.pathnames = names.original_pathnames
+        self.assertEqual(names.table.changed, {})
+        names.pathnames = renamed
+        with self.assertRaises(Exception):
+            names.pathnames = [path + '.bak' for path in renamed]
+        names.save_changes(mode='copy', link='copy')
+        self.addCleanup(shutil.rmtree, tmp.name + '_copy')
+        self.assertEqual(sorted(os.listdir(os.path.join(tmp.name + '_copy', 'sub'))), ['c_2.md'])
+        names.save_changes(mode='inplace')
+        self.assertEqual(sorted(os.listdir(tmp.name)), ['a_1.txt', 'b.txt', 'sub'])
+        self.assertEqual(os.listdir(os.path.join(tmp.name, 'sub')), ['c_2.md'])
+
+if __name__ == "__main__":
+    unittest.main()
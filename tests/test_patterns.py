@@ -0,0 +1,47 @@
+import re
+import unittest
+
+from pyreutil.patterns import *
+
+class TestPatternCache(unittest.TestCase):
+    
+    def test_compile_hits_and_eviction(self):
+        cache = PatternCache(maxsize=2)
+        first = cache.compile("a+")
+        self.assertIs(first, cache.compile("a+"))
+        cache.compile("b+")
+        cache.compile("c+")
+        self.assertEqual(cache.info(), {'hits': 1, 'misses': 3, 'size': 2, 'maxsize': 2})
+        cache.compile("a+")
+        self.assertEqual(cache.misses, 4)
+        self.assertRaises(ValueError, PatternCache, maxsize=0)
+    
+    def test_compile_lambda(self):
+        func = compile_lambda("x.group(2).upper()")
+        self.assertIs(func, compile_lambda("x.group(2).upper()"))
+        self.assertEqual(re.sub("(_)([a-z])", func, "snake_case_name"), "snakeCaseName")
+        self.assertIs(as_match_function(str.upper), str.upper)
+        self.assertRaises(ValueError, compile_lambda, "x.group(")
+        # Names of the pyreutil module can be used, e.g. os and split_fullpath.
+        match = re.search(".+", "dir/name.txt")
+        self.assertEqual(compile_lambda("os.path.basename(x.group())")(match), "name.txt")
+        self.assertEqual(compile_lambda("split_fullpath(x.group())[2]")(match), ".txt")
+    
+    def test_required_literals(self):
+        self.assertEqual(required_literals("foo\\.bar(\\d+)"), ('foo.bar',))
+        self.assertEqual(required_literals("(abc)+x?y"), ('abc', 'y'))
+        self.assertEqual(required_literals("\\[([\\[]?[^\\[^\\]]+[\\]]?)]\\((http[s]?://[^\\)]+)\\)")[0], 'http')
+        self.assertEqual(required_literals("(?i)abc"), ())
+        self.assertEqual(required_literals("a|b"), ())
+        self.assertTrue(may_contain(b"x foo.bar1", ('foo.bar',)))
+        self.assertFalse(may_contain("x foo_bar1", ('foo.bar',)))
+        self.assertTrue(may_contain(b"a\r\nb", ('a\nb',)))
+    
+    def test_literal_pattern(self):
+        self.assertEqual(literal_pattern("foo\\.bar"), "foo.bar")
+        self.assertEqual(literal_pattern("-"), "-")
+        self.assertIsNone(literal_pattern("foo.bar"))
+        self.assertIsNone(literal_pattern("(?i)foo"))
+        self.assertIsNone(literal_pattern(""))
+        self.assertEqual(literal_replacement("_"), "_")
+        self.assertIsNone(literal_replacement("\\1"))
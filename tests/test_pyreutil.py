@@ -1,5 +1,8 @@
+import os
+import shutil
 import unittest
 
+from pyreutil.plan import OperationPlan
 from pyreutil.pyreutil import *
 
 class TestReUtil(unittest.TestCase):
@@ -18,7 +21,195 @@ class TestReUtil(unittest.TestCase):
         result2 = ReUtil().search_and_replace(regex_with_groups, sample_text, replace="[link]")
         self.assertEquals(expected1, result1)
         self.assertEquals(expected2, result2)
-   
+    
+    def test_lambda_search_and_replace_callable(self):
+        expected = "snakeCaseName"
+        self.assertEqual(ReUtil().lambda_search_and_replace("(_)([a-z])", "snake_case_name", "x.group(2).upper()"), expected)
+        self.assertEqual(ReUtil().lambda_search_and_replace("(_)([a-z])", "snake_case_name", lambda m: m.group(2).upper()), expected)
+    
+    def test_literal_engine(self):
+        util = ReUtil()
+        text = "a-b--c.d"
+        self.assertEqual(util.engine("-", "_"), 'literal')
+        self.assertEqual(util.engine("\\.", "\\1"), 'regex')
+        self.assertEqual(util.search_and_replace("-", text, replace="_"), "a_b__c.d")
+        self.assertEqual(util.search("\\.", text), 1)
+        self.assertEqual(util.remove("--", text), "a-bc.d")
+    
+    def test_scan_and_replace_matches_sub(self):
+        util = ReUtil()
+        text = "a1 b22 c333"
+        new, matches, pieces = util.scan_and_replace("([a-z])(\\d+)", text, replace="\\2\\1")
+        self.assertEqual(new, util.search_and_replace("([a-z])(\\d+)", text, replace="\\2\\1"))
+        self.assertEqual(len(matches), util.search("([a-z])(\\d+)", text))
+        self.assertEqual(util.colored_spans(text, matches, pieces), util.colored_replace("([a-z])(\\d+)", text, replace="\\2\\1"))
+        self.assertEqual(util.colored_spans(text, matches), util.colored_search("([a-z])(\\d+)", text))
+
+
+class TestTextUtil(unittest.TestCase):
+    
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        for name, content in [('a.txt', "foo-bar baz\n"), ('b.txt', "no dashes here\n"), ('c.txt', "a-b-c\n")]:
+            with open(os.path.join(self.dir, name), 'w') as f:
+                f.write(content)
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_stream_matches_eager(self):
+        eager = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False)
+        eager.remove("baz")
+        eager.search_and_replace("-", replace="_")
+        stream = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, stream=True)
+        stream.remove("baz")
+        stream.search_and_replace("-", replace="_")
+        self.assertEqual(stream.original_text, [])
+        self.assertEqual(eager.text, list(stream.iter_text()))
+        stream.save_changes('inplace')
+        self.assertEqual(TextUtil(filenames=self.dir, search_subdirs=False).text, eager.text)
+    
+    def test_save_changes_skips_unchanged(self):
+        inodes = {name: os.stat(os.path.join(self.dir, name)).st_ino for name in os.listdir(self.dir)}
+        content = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False)
+        content.search_and_replace("-", replace="_")
+        report = content.save_changes('inplace')
+        self.assertEqual(report['written'], 2)
+        self.assertEqual(report['skipped'], 1)
+        self.assertEqual(report['bytes'], len("foo_bar baz\n") + len("a_b_c\n"))
+        self.assertEqual(os.stat(os.path.join(self.dir, 'b.txt')).st_ino, inodes['b.txt'])
+        self.assertNotEqual(os.stat(os.path.join(self.dir, 'a.txt')).st_ino, inodes['a.txt'])
+        self.assertEqual(os.listdir(self.dir).count('a.txt'), 1)
+        self.assertEqual(len(os.listdir(self.dir)), 3)
+    
+    def test_operation_plan(self):
+        plan = OperationPlan().remove("baz").append("end").search_and_replace("-", replace="_").remove_extra_whitespaces()
+        self.assertTrue(plan.modifies)
+        eager = plan.apply(TextUtil(filenames=self.dir, verbose=False, search_subdirs=False))
+        self.assertEqual(eager.text, ["foo_bar end", "no dashes here end", "a_b_c end"])
+        stream = plan.apply(TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, stream=True))
+        self.assertEqual(list(stream.iter_text()), eager.text)
+        # The search pass runs the queued remove, so a preview does not read the files again.
+        stats = Stats()
+        searched = OperationPlan().remove("baz").search("-").apply(TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, stream=True, stats=stats))
+        searched.preview()
+        self.assertEqual(stats.to_dict()['phases']['read']['calls'], 3)
+    
+    def test_jobs_match_serial(self):
+        serial = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False)
+        serial.search_and_replace("(\\w)-(\\w)", lambda_func="x.group(2) + x.group(1)")
+        parallel = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, jobs=2)
+        parallel.search_and_replace("(\\w)-(\\w)", lambda_func="x.group(2) + x.group(1)")
+        self.assertEqual(serial.text, list(parallel.iter_text()))
+        self.assertEqual(parallel.search("\\w"), serial.search("\\w"))
+
+    def test_io_threads_match_serial(self):
+        serial = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False)
+        serial.search_and_replace("-", replace="+")
+        overlapped = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, io_threads=2, read_ahead=1, write_behind=1)
+        overlapped.search_and_replace("-", replace="+")
+        self.assertEqual(serial.text, list(overlapped.iter_text()))
+        report = overlapped.save_changes(mode='inplace')
+        self.assertEqual((report['written'], report['skipped']), (2, 1))
+        with open(os.path.join(self.dir, 'c.txt')) as f:
+            self.assertEqual(f.read(), "a+b+c\n")
+
+    def test_copy_links_unchanged_files(self):
+        content = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False)
+        content.search_and_replace("-", replace="+")
+        report = content.save_changes(mode='copy', link='hardlink')
+        self.assertEqual((report['written'], report['linked']), (2, 1))
+        copy_dir = self.dir + "_copy"
+        self.addCleanup(shutil.rmtree, copy_dir)
+        self.assertTrue(os.path.samefile(os.path.join(self.dir, 'b.txt'), os.path.join(copy_dir, 'b.txt')))
+        with open(os.path.join(copy_dir, 'c.txt')) as f:
+            self.assertEqual(f.read(), "a+b+c\n")
+
+    def test_count_lists_every_file(self):
+        import contextlib, io
+        # c.txt is skipped by the prefilter, the others are scanned without a match.
+        for stream in (False, True):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                TextUtil(filenames=self.dir, verbose=True, search_subdirs=False, stream=stream, list_matches='count').search("o\\d")
+            lines = sorted(line for line in output.getvalue().splitlines() if not line.startswith('>>'))
+            self.assertEqual(lines, [os.path.join(self.dir, name) + ':0' for name in ('a.txt', 'b.txt', 'c.txt')])
+
+    def test_iter_matches(self):
+        content = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, stream=True)
+        content.search_and_replace("a", replace="a\n")
+        matches = list(content.iter_matches("(\\w)-", max_count=1))
+        self.assertEqual(matches, [MatchRecord(os.path.join(self.dir, 'a.txt'), 1, (2, 4), ('o',)), MatchRecord(os.path.join(self.dir, 'c.txt'), 2, (3, 5), ('b',))])
+        reads = []
+        content._read_file = lambda *args: reads.append(args[0]) or TextUtil._read_file(content, *args)
+        self.assertEqual(next(content.iter_matches("-")).path, os.path.join(self.dir, 'a.txt'))
+        self.assertEqual(reads, [os.path.join(self.dir, 'a.txt')])
+        self.assertEqual(content.search("-", max_count=1), 2)
+        names = FilenameUtil(path=self.dir, search_subdirs=False)
+        self.assertEqual([m.span for m in names.iter_matches("[a-c]", max_total=2)], [(0, 1), (0, 1)])
+
+    def test_encodings_and_binary_files(self):
+        files = {'latin.txt': b'caf\xe9 a-b\n', 'bom.txt': 'x-y\n'.encode('utf-16'), 'binary.dat': b'\x00\x01-' * 5000}
+        for name, data in files.items():
+            with open(os.path.join(self.dir, name), 'wb') as f:
+                f.write(data)
+        for options in [{}, {'stream': True}, {'io_threads': 2}]:
+            content = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, encoding='utf-8', **options)
+            content.search_and_replace("-", replace="+")
+            content.save_changes('inplace')
+            self.assertEqual(content.skipped_files(), {'binary': 1})
+            content.search_and_replace("\\+", replace="-")
+            content.save_changes('inplace')
+        with open(os.path.join(self.dir, 'latin.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'caf\xe9 a-b\n')
+        content = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, encoding='utf-8')
+        content.search_and_replace("-", replace="+")
+        content.save_changes('inplace')
+        with open(os.path.join(self.dir, 'bom.txt'), 'rb') as f:
+            self.assertEqual(f.read(), 'x+y\n'.encode('utf-16'))
+        with open(os.path.join(self.dir, 'binary.dat'), 'rb') as f:
+            self.assertEqual(f.read(), files['binary.dat'])
+
+    def test_timeout_skips_pathological_files(self):
+        with open(os.path.join(self.dir, 'bad.txt'), 'w') as f:
+            f.write("a" * 40 + "b")
+        content = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, timeout=0.5, jobs=2)
+        content.search_and_replace("(a+)+$", replace="x")
+        content.save_changes('inplace')
+        self.assertEqual(content.skipped_files(), {'timeout': 1})
+        with open(os.path.join(self.dir, 'c.txt')) as f:
+            self.assertEqual(f.read(), "a-b-c\n")
+        with open(os.path.join(self.dir, 'bad.txt')) as f:
+            self.assertEqual(f.read(), "a" * 40 + "b")
+        # In blocks, the file is killed while being written, and its temporary file is removed.
+        content = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, timeout=0.5, chunk_size=1024)
+        content.search_and_replace("(a+)+$", replace="x")
+        content.save_changes('inplace')
+        self.assertEqual(content.skipped_files(), {'timeout': 1})
+        self.assertEqual(sorted(os.listdir(self.dir)), ['a.txt', 'b.txt', 'bad.txt', 'c.txt'])
+
+    def test_stats(self):
+        self.assertFalse(TextUtil(text=["a"]).stats)
+        stats = Stats(top=1)
+        content = TextUtil(filenames=self.dir, verbose=False, search_subdirs=False, stats=stats)
+        content.search_and_replace("-", replace="+")
+        content.save_changes(mode='inplace')
+        report = stats.to_dict()
+        self.assertTrue({'walk', 'read', 'regex', 'save'} <= set(report['phases']))
+        # b.txt is skipped by the prefilter, so two texts are scanned.
+        self.assertEqual(report['counters'], {'bytes_read': 33, 'bytes_written': 18, 'matches': 3, 'scans_literal': 2})
+        self.assertEqual(len(report['slowest_files']), 1)
+        # Verbose output colors matches found with the regex, and says so.
+        import contextlib, io
+        stats = Stats()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            TextUtil(filenames=self.dir, verbose=True, search_subdirs=False, stats=stats).search_and_replace("\\+", replace="-")
+        self.assertIn("Using the regex engine", output.getvalue())
+        self.assertEqual((stats.counters['scans_regex'], stats.counters['scans_literal']), (2, 0))
+
+
 if __name__ == "__main__":
     unittest.main()
-        
\ No newline at end of file
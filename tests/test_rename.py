@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+
+from pyreutil.rename import *
+
+class TestRenamePlan(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        for name in ['a', 'b', 'c', 'x', 'y', 'keep']:
+            with open(self.path(name), 'w') as f:
+                f.write(name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def contents(self):
+        result = {}
+        for name in sorted(os.listdir(self.dir)):
+            if not name.endswith('.journal'):
+                with open(self.path(name)) as f:
+                    result[name] = f.read()
+        return result
+
+    def test_chains_cycles_and_conflicts(self):
+        # A chain (a->b->c->d) and a cycle (x<->y).
+        renames = {'a': 'b', 'b': 'c', 'c': 'd', 'x': 'y', 'y': 'x'}
+        plan = RenamePlan([self.path(k) for k in renames], [self.path(v) for v in renames.values()])
+        self.assertEqual((plan.files, len(plan.units)), (5, 2))
+        plan.execute(threads=2)
+        self.assertEqual(self.contents(), {'b': 'a', 'c': 'b', 'd': 'c', 'keep': 'keep', 'x': 'y', 'y': 'x'})
+        with self.assertRaises(Exception):
+            RenamePlan([self.path('b'), self.path('c')], [self.path('z'), self.path('z')])
+        # Renaming onto an untouched file conflicts, and so does renaming onto its source in turn.
+        plan = RenamePlan([self.path('b'), self.path('d')], [self.path('keep'), self.path('b')], on_conflict='skip')
+        self.assertEqual(sorted(reason for _, _, reason in plan.conflicts), ['target exists', 'target exists'])
+        self.assertEqual(len(plan), 0)
+
+    def test_journal_resume_and_rollback(self):
+        sources, targets = [self.path('a'), self.path('b'), self.path('x')], [self.path('b'), self.path('a'), self.path('z')]
+        plan = RenamePlan(sources, targets)
+        journal_path = self.path('renames.journal')
+        journal = RenameJournal.create(journal_path, plan.units)
+        # Interrupted after the first rename of the a<->b cycle.
+        index = next(i for i, unit in enumerate(plan.units) if len(unit) == 3)
+        journal.record(index, 0)
+        os.replace(*plan.units[index][0])
+        journal.close()
+        journal = RenameJournal.load(journal_path)
+        self.assertEqual(journal.progress(), {index: 1})
+        self.assertEqual(journal.resume(), 3)
+        self.assertEqual(self.contents(), {'a': 'b', 'b': 'a', 'c': 'c', 'keep': 'keep', 'y': 'y', 'z': 'x'})
+        journal = RenameJournal.load(journal_path)
+        self.assertTrue(journal.complete)
+        journal.rollback()
+        self.assertEqual(self.contents(), {'a': 'a', 'b': 'b', 'c': 'c', 'keep': 'keep', 'x': 'x', 'y': 'y'})
+
+    def test_journal_from_another_directory(self):
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(self.dir)
+        plan = RenamePlan(['a', 'x'], ['z', 'w'])
+        journal = RenameJournal.create('renames.journal', plan.units)
+        journal.close()
+        os.chdir(cwd)
+        journal = RenameJournal.load(self.path('renames.journal'))
+        self.assertEqual(journal.resume(), 2)
+        self.assertEqual(self.contents(), {'b': 'b', 'c': 'c', 'keep': 'keep', 'w': 'x', 'y': 'y', 'z': 'a'})
+
+if __name__ == "__main__":
+    unittest.main()
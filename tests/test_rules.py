@@ -0,0 +1,44 @@
+import os
+import re
+import tempfile
+import unittest
+
+from pyreutil import TextUtil
+from pyreutil.rules import *
+
+class TestRuleSet(unittest.TestCase):
+
+    def test_matches_sequential_application(self):
+        rules = [
+            (r"\bfoo\b", "foo_v2"),
+            ("API_V1", "API_V2"),
+            ("cat", "dog"),
+            ("dog", "wolf"),    # sees the output of the previous rule
+            (r"(\d+)px", r"\1em"),
+            ("ab", ""),
+        ]
+        ruleset = RuleSet(rules)
+        text = "foo food API_V1 cat dog 12px abab foo.bar"
+        expected = text
+        for pattern, replacement in rules:
+            expected = re.sub(pattern, replacement, expected)
+        new, hits = ruleset.apply(text)
+        self.assertEqual(new, expected)
+        self.assertEqual(hits, [2, 1, 1, 2, 1, 2])
+        # The first three rules are independent and merged into one scan.
+        self.assertLess(len(ruleset.groups), len(rules))
+        self.assertEqual(ruleset.groups[0][1], [0, 1, 2])
+
+    def test_load_rules_and_text_util(self):
+        with tempfile.TemporaryDirectory() as d:
+            rules_path = os.path.join(d, 'rules.tsv')
+            with open(rules_path, 'w') as f:
+                f.write("# renames\nfoo\tbar\nbaz\tqux\n\nremoved\n")
+            self.assertEqual(load_rules(rules_path), [Rule('foo', 'bar'), Rule('baz', 'qux'), Rule('removed', '')])
+            content = TextUtil(text=["foo baz removed", "nothing"])
+            content.apply_rules(rules_path)
+            self.assertEqual(content.text, ["bar qux ", "nothing"])
+            self.assertEqual(content.rule_hits(content.ruleset(rules_path)), [1, 1, 1])
+
+if __name__ == '__main__':
+    unittest.main()
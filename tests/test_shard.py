@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import unittest
+
+from pyreutil.pyreutil import FilenameUtil, Stats, TextUtil
+from pyreutil.shard import *
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        os.makedirs(os.path.join(self.dir, 'sub'))
+        self.sizes = {}
+        for i in range(40):
+            name = 'f{}.txt'.format(i) if i % 2 else 'sub/f{}.txt'.format(i)
+            with open(os.path.join(self.dir, name), 'w') as f:
+                f.write('x-' * (i + 1))
+            self.sizes[name] = 2 * (i + 1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_shards_partition_files(self):
+        everything = TextUtil(filenames=self.dir, search_subdirs=True).original_filenames
+        shards = [TextUtil(filenames=self.dir, search_subdirs=True, shard='{}/3'.format(k)).original_filenames for k in range(3)]
+        self.assertEqual(sorted(sum(shards, [])), everything)
+        self.assertTrue(all(shards))
+        # The same files whatever the mount point, and for filenames too.
+        self.assertEqual(stable_shard('sub/f2.txt', 3), stable_shard('sub/f2.txt', 3))
+        self.assertEqual(FilenameUtil(path=self.dir, search_subdirs=True, shard=(1, 3)).original_pathnames, shards[1])
+        # Balanced by a manifest, the shards get about as many bytes.
+        loads = [0, 0, 0]
+        for relpath, index in balance(self.sizes, 3).items():
+            loads[index] += self.sizes[relpath]
+        self.assertLessEqual(max(loads) - min(loads), max(self.sizes.values()))
+        with self.assertRaises(Exception):
+            Shard.parse('3/3')
+
+    def test_merge_summaries(self):
+        summaries = []
+        for k in range(2):
+            stats = Stats()
+            shard = Shard(k, 3)
+            content = TextUtil(filenames=self.dir, search_subdirs=True, stats=stats, shard=shard)
+            content.search('-')
+            path = os.path.join(self.dir, 'summary{}.json'.format(k))
+            write_summary(path, stats, shard)
+            with open(path) as f:
+                summaries.append(json.load(f))
+        merged = merge_summaries(summaries)
+        self.assertEqual((merged['shards'], merged['missing']), ([0, 1], [2]))
+        self.assertEqual(merged['files'], summaries[0]['files'] + summaries[1]['files'])
+        self.assertEqual(merged['counters']['matches'], summaries[0]['counters']['matches'] + summaries[1]['counters']['matches'])
+
+if __name__ == "__main__":
+    unittest.main()
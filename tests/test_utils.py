@@ -1,3 +1,4 @@
+import os
 import unittest
 
 from pyreutil.utils import *
@@ -9,4 +10,57 @@ class TestUtils(unittest.TestCase):
         fullpath = 'home/user/dir1/dir2/dir3/file.txt'
         subdirs, filename = get_subdir_and_file_from_dir(fullpath, original_dir)
         self.assertEqual(subdirs, ['dir2', 'dir3'])
-        self.assertEqual(filename, 'file.txt')
\ No newline at end of file
+        self.assertEqual(filename, 'file.txt')
+    
+    def test_walk_files(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            for path in ['a.md', 'b.txt', 'sub/c.md', 'sub/build/d.md', '.git/config', 'node_modules/x.md']:
+                os.makedirs(os.path.join(root, os.path.dirname(path)), exist_ok=True)
+                open(os.path.join(root, path), 'w').close()
+            with open(os.path.join(root, '.gitignore'), 'w') as f:
+                f.write("# build output\nbuild/\n")
+            def walk(**kwargs):
+                return sorted(os.path.relpath(p, root) for p in walk_files(root, **kwargs))
+            self.assertEqual(walk(search_subdirs=False), ['.gitignore', 'a.md', 'b.txt'])
+            self.assertEqual(walk(include=['*.md']), ['a.md', 'sub/build/d.md', 'sub/c.md'])
+            self.assertEqual(walk(include=['*.md'], gitignore=True), ['a.md', 'sub/c.md'])
+            self.assertEqual(walk(exclude=['sub', '.*']), ['a.md', 'b.txt'])
+            self.assertEqual(len(walk(exclude_dirs=())), 7)
+            self.assertEqual(len(iterate_files(root)), 7)
+
+    def test_clone_file(self):
+        import shutil
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            source = os.path.join(root, 'a.txt')
+            with open(source, 'w') as f:
+                f.write("a")
+            # The target being the source (or a name of it through a linked directory) is never removed.
+            os.symlink(root, os.path.join(root, 'linked'))
+            for target in [source, os.path.join(root, '.', 'a.txt'), os.path.join(root, 'linked', 'a.txt')]:
+                with self.assertRaises(shutil.SameFileError):
+                    clone_file(source, target)
+                self.assertTrue(os.path.exists(source))
+            # Copies are independent of the originals unless hard links are asked for.
+            target = os.path.join(root, 'b.txt')
+            self.assertIn(clone_file(source, target), ('reflink', 'copy'))
+            self.assertFalse(os.path.samefile(source, target))
+            self.assertEqual(clone_file(source, target, 'hardlink'), 'hardlink')
+            self.assertTrue(os.path.samefile(source, target))
+            self.assertFalse(same_entry(source, target))
+
+    def test_write_atomic_through_symlink(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as root:
+            os.mkdir(os.path.join(root, 'real'))
+            target = os.path.join(root, 'real', 'a.txt')
+            with open(target, 'w') as f:
+                f.write("a")
+            link = os.path.join(root, 'link.txt')
+            os.symlink(target, link)
+            self.assertEqual(write_atomic(link, ["b"]), 1)
+            self.assertTrue(os.path.islink(link))
+            with open(target) as f:
+                self.assertEqual(f.read(), "b")
+            self.assertEqual(sorted(os.listdir(os.path.join(root, 'real'))), ['a.txt'])
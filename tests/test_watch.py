@@ -0,0 +1,38 @@
+import os
+import tempfile
+import unittest
+
+from pyreutil.pyreutil import TextUtil
+from pyreutil.watch import Watcher
+
+class TestWatcher(unittest.TestCase):
+
+    def test_processes_only_changed_files_once(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = lambda name: os.path.join(tmp.name, name)
+        for name, text in [('a.txt', "a-a"), ('c.txt', "c")]:
+            with open(path(name), 'w') as f:
+                f.write(text)
+        calls = []
+        def process(paths):
+            calls.append(paths)
+            content = TextUtil(filenames=paths if paths is not None else tmp.name)
+            content.search_and_replace("-", replace="+")
+            written = content.save_changes('inplace')['paths']
+            if paths is None:
+                # Added, and c.txt (left unchanged) edited, while the full pass
+                # runs, so both are picked up by the next poll.
+                with open(path('b.txt'), 'w') as f:
+                    f.write("b-b")
+                with open(path('c.txt'), 'w') as f:
+                    f.write("c-c-c")
+            return written
+        Watcher(tmp.name, interval=0, debounce=0).run(process, cycles=3)
+        self.assertEqual(calls, [None, [path('b.txt'), path('c.txt')]])
+        for name, text in [('a.txt', "a+a"), ('b.txt', "b+b"), ('c.txt', "c+c+c")]:
+            with open(path(name)) as f:
+                self.assertEqual(f.read(), text)
+
+if __name__ == "__main__":
+    unittest.main()